@@ -13,19 +13,165 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "3-clause BSD"
 __maintainer__ = "Steven Kearnes"
 
+import copy
 from copy import deepcopy
+import multiprocessing
 import os
+import traceback
+import warnings
+
+from theano.compat.six.moves import cPickle, queue
 
 from pylearn2.cross_validation.mlp import PretrainedLayerCV
+from pylearn2.cross_validation.train_cv_extensions import TrainCVExtension
 from pylearn2.train import Train, SerializationGuard
 from pylearn2.utils import serial
 
 
+class FoldResult(object):
+    """
+    Stand-in for the Train object of a fold trained in a worker process.
+
+    Only what the parent TrainCV object needs is sent back to the parent
+    process (see `TrainCVExtension.fold_result_fields`); the other
+    attributes are None.
+
+    Parameters
+    ----------
+    model : Model, optional
+        Trained model.
+    extensions : list, optional
+        TrainExtension objects of the fold's Train object.
+    params : list, optional
+        Parameter values of the trained model.
+    """
+    def __init__(self, model=None, extensions=None, params=None):
+        self.model = model
+        self.extensions = extensions
+        self.params = params
+        self.dataset = None
+        self.algorithm = None
+
+    @classmethod
+    def from_trainer(cls, trainer, fields=('model', 'extensions')):
+        """
+        Returns the FoldResult of a trained Train object.
+
+        Parameters
+        ----------
+        trainer : Train
+            Train object of the fold.
+        fields : iterable, optional
+            Fields to keep, among 'model', 'extensions' and 'params'.
+        """
+        result = cls()
+        if 'model' in fields:
+            result.model = trainer.model
+        if 'extensions' in fields:
+            result.extensions = trainer.extensions
+        if 'params' in fields:
+            result.params = trainer.model.get_param_values()
+        return result
+
+
+def _fold_result_fields(extension):
+    """
+    Returns the fields of the FoldResult of each fold that the `on_save`
+    method of a TrainCV extension reads. Extensions which override
+    `on_save` without declaring `fold_result_fields` get the model and
+    the extensions.
+
+    Parameters
+    ----------
+    extension : object
+        TrainCV extension.
+    """
+    fields = getattr(extension, 'fold_result_fields', None)
+    if fields is not None:
+        return fields
+    method = getattr(type(extension), 'on_save', None)
+    method = getattr(method, '__func__', method)
+    base = getattr(TrainCVExtension.on_save, '__func__',
+                   TrainCVExtension.on_save)
+    if method is base:
+        return ()
+    return ('model', 'extensions')
+
+
+def _overrides_setup(extension):
+    """
+    Returns whether a TrainCV extension still relies on the deprecated
+    `setup(trainers)` entry point, i.e. whether it overrides `setup` or
+    does not implement `setup_fold`.
+
+    Parameters
+    ----------
+    extension : object
+        TrainCV extension.
+    """
+    if not hasattr(extension, 'setup_fold'):
+        return True
+    method = getattr(type(extension), 'setup', None)
+    method = getattr(method, '__func__', method)
+    base = getattr(TrainCVExtension.setup, '__func__', TrainCVExtension.setup)
+    return method is not base
+
+
+def _train_fold(template, k, datasets, time_budget, fields, result_queue):
+    """
+    Build and train a single fold in a worker process and put its
+    FoldResult (or the formatted traceback of the failure) on
+    `result_queue`.
+
+    Parameters
+    ----------
+    template : TrainCV
+        Copy of the parent TrainCV object holding only what is needed to
+        build fold `k` (see `TrainCV._fold_template`).
+    k : int
+        Fold index.
+    datasets : dict
+        Datasets for this fold.
+    time_budget : int or None
+        The maximum number of seconds before interrupting training.
+    fields : tuple
+        Fields of the FoldResult sent back, see `FoldResult.from_trainer`.
+    result_queue : multiprocessing.Queue
+        Queue for (k, result, error) tuples.
+    """
+    try:
+        trainer = template.make_trainer(k, datasets)
+        template.setup_extensions(k, trainer)
+        del datasets
+        trainer.main_loop(time_budget)
+        for extension in trainer.extensions:
+            extension.on_save(trainer.model, trainer.dataset,
+                              trainer.algorithm)
+        # pickle here so that failures are reported rather than lost in
+        # the queue's feeder thread
+        result = cPickle.dumps(FoldResult.from_trainer(trainer, fields),
+                               protocol=cPickle.HIGHEST_PROTOCOL)
+        result_queue.put((k, result, None))
+    except Exception:
+        result_queue.put((k, None, traceback.format_exc()))
+
+
 class TrainCV(object):
     """
     Wrapper for Train that partitions the dataset according to a given
     cross-validation iterator, returning a Train object for each split.
 
+    The Train object for each fold is only built when that fold is about
+    to be trained, so the datasets of the folds are built one at a time.
+    When folds are trained in parallel, each worker builds its own Train
+    object and only sends back a `FoldResult` holding what the TrainCV
+    extensions and `save_path` need.
+
+    For backward compatibility, reading `trainers` before `main_loop`, or
+    using a TrainCV extension that overrides the deprecated
+    `setup(trainers)` instead of `setup_fold`, builds the Train objects of
+    every fold up front as before.
+
     Parameters
     ----------
     dataset_iterator : iterable
@@ -49,54 +195,20 @@ class TrainCV(object):
     cv_extensions : list or None
         TrainCVExtension objects for the parent TrainCV object.
     """
+    # Class defaults for objects pickled before these attributes existed
+    _trainers = None
+    _trained = False
+
     def __init__(self, dataset_iterator, model, algorithm=None,
                  save_path=None, save_freq=0, extensions=None,
                  allow_overwrite=True, save_folds=False, cv_extensions=None):
         self.dataset_iterator = dataset_iterator
-        trainers = []
-        for k, datasets in enumerate(dataset_iterator):
-            if save_folds and save_path is not None:
-                path, ext = os.path.splitext(save_path)
-                this_save_path = path + '-{}'.format(k) + ext
-                this_save_freq = save_freq
-            else:
-                this_save_path = None
-                this_save_freq = 0
-
-            # setup model, including any pretrained layers
-            if isinstance(model, list):
-                this_model = deepcopy(model[k])
-            else:
-                this_model = deepcopy(model)
-            if hasattr(this_model, 'layers') and any(
-                    [isinstance(l, PretrainedLayerCV)
-                     for l in this_model.layers]):
-                for i, layer in enumerate(this_model.layers):
-                    if isinstance(layer, PretrainedLayerCV):
-                        this_model.layers[i] = layer.select_fold(k)
-
-            # setup monitoring datasets
-            this_algorithm = deepcopy(algorithm)
-            this_algorithm._set_monitoring_dataset(datasets)
-
-            # extensions
-            this_extensions = deepcopy(extensions)
-
-            # construct an isolated Train object
-            # no shared references between trainers are allowed
-            # (hence all the deepcopy operations)
-            try:
-                assert isinstance(datasets, dict)
-                trainer = Train(datasets['train'], this_model, this_algorithm,
-                                this_save_path, this_save_freq,
-                                this_extensions, allow_overwrite)
-            except AssertionError:
-                raise AssertionError("Dataset iterator must be a dict with " +
-                                     "dataset names (e.g. 'train') as keys.")
-            except KeyError:
-                raise KeyError("Dataset iterator must yield training data.")
-            trainers.append(trainer)
-        self.trainers = trainers
+        self.model = model
+        self.algorithm = algorithm
+        self.save_freq = save_freq
+        self.extensions = extensions
+        self.save_folds = save_folds
+        self._trainers = None
         self.save_path = save_path
         self.allow_overwrite = allow_overwrite
         if cv_extensions is None:
@@ -104,83 +216,317 @@ class TrainCV(object):
         else:
             self.cv_extensions = cv_extensions
 
+    def __setstate__(self, state):
+        # Older versions stored the Train objects in `trainers`, which is
+        # now a property.
+        if 'trainers' in state:
+            state['_trainers'] = state.pop('trainers')
+        self.__dict__.update(state)
+
+    @property
+    def trainers(self):
+        """
+        The Train objects of each fold, built on first access before
+        `main_loop`. After folds are trained in parallel, their
+        FoldResult objects.
+        """
+        if self._trainers is None:
+            self._trainers = [self.make_trainer(k, datasets)
+                              for k, datasets
+                              in enumerate(self.dataset_iterator)]
+        return self._trainers
+
+    @trainers.setter
+    def trainers(self, trainers):
+        self._trainers = trainers
+
+    def _get_model(self, k):
+        """
+        Returns the template model of fold `k`.
+
+        Parameters
+        ----------
+        k : int
+            Fold index.
+        """
+        if isinstance(self.model, list):
+            return self.model[k]
+        return self.model
+
+    def _fold_template(self, k):
+        """
+        Returns a shallow copy of this object with only what a worker
+        process needs to build fold `k`: the fold's template model, the
+        algorithm, the extensions and the settings. The dataset iterator
+        (and the full dataset it holds) is left out.
+
+        Parameters
+        ----------
+        k : int
+            Fold index.
+        """
+        template = copy.copy(self)
+        template.dataset_iterator = None
+        template._trainers = None
+        template.model = self._get_model(k)
+        return template
+
+    def make_trainer(self, k, datasets):
+        """
+        Construct an isolated Train object for a single fold.
+
+        Parameters
+        ----------
+        k : int
+            Fold index.
+        datasets : dict
+            Datasets for this fold, as yielded by the dataset iterator.
+        """
+        if self.save_folds and self.save_path is not None:
+            path, ext = os.path.splitext(self.save_path)
+            this_save_path = path + '-{}'.format(k) + ext
+            this_save_freq = self.save_freq
+        else:
+            this_save_path = None
+            this_save_freq = 0
+
+        # setup model, including any pretrained layers
+        this_model = deepcopy(self._get_model(k))
+        if hasattr(this_model, 'layers') and any(
+                [isinstance(l, PretrainedLayerCV)
+                 for l in this_model.layers]):
+            for i, layer in enumerate(this_model.layers):
+                if isinstance(layer, PretrainedLayerCV):
+                    this_model.layers[i] = layer.select_fold(k)
+
+        # setup monitoring datasets
+        this_algorithm = deepcopy(self.algorithm)
+        this_algorithm._set_monitoring_dataset(datasets)
+
+        # extensions
+        this_extensions = deepcopy(self.extensions)
+
+        # construct an isolated Train object
+        # no shared references between trainers are allowed
+        # (hence all the deepcopy operations)
+        try:
+            assert isinstance(datasets, dict)
+            trainer = Train(datasets['train'], this_model, this_algorithm,
+                            this_save_path, this_save_freq,
+                            this_extensions, self.allow_overwrite)
+        except AssertionError:
+            raise AssertionError("Dataset iterator must be a dict with " +
+                                 "dataset names (e.g. 'train') as keys.")
+        except KeyError:
+            raise KeyError("Dataset iterator must yield training data.")
+        return trainer
+
     def setup(self):
-        """Set up the main loop."""
-        self.setup_extensions()
+        """
+        Set up the main loop. If the Train objects were built up front,
+        set up the extensions for all of them.
+        """
+        if self._trainers is not None:
+            self.setup_extensions()
+
+    def setup_extensions(self, k=None, trainer=None):
+        """
+        Set up extensions.
+
+        Without arguments, call `setup` of every TrainCV extension with
+        the Train objects of all the folds, building them if needed.
+        Otherwise, set up the extensions for the single fold `k`.
 
-    def setup_extensions(self):
-        """Set up extensions."""
+        Parameters
+        ----------
+        k : int, optional
+            Fold index.
+        trainer : Train, optional
+            Train object for fold `k`.
+        """
+        if k is None:
+            for extension in self.cv_extensions:
+                extension.setup(self.trainers)
+            return
         for extension in self.cv_extensions:
-            extension.setup(self.trainers)
+            extension.setup_fold(k, trainer)
 
-    def main_loop(self, time_budget=None, parallel=False, client_kwargs=None,
-                  view_flags=None):
+    def main_loop(self, time_budget=None, parallel=False, num_workers=None,
+                  start_method=None, client_kwargs=None, view_flags=None):
         """
         Run main_loop of each trainer.
 
-        Note: if you get PickleErrors when running in parallel, make sure
-        you have `dill` installed.
-
         Parameters
         ----------
         time_budget : int, optional
             The maximum number of seconds before interrupting
             training. Default is `None`, no time limit.
         parallel : bool, optional
-            Whether to train subtrainers in parallel using
-            IPython.parallel (default False).
+            Whether to train folds in parallel worker processes (default
+            False). Each worker receives the template model, algorithm
+            and extensions and the datasets of its fold, builds the fold's
+            Train object itself and only sends back a FoldResult with the
+            trained model if `save_path` is set, and whatever the TrainCV
+            extensions declare in `fold_result_fields`. These must be
+            picklable.
+        num_workers : int, optional
+            Maximum number of folds trained at the same time when
+            `parallel` is True. Defaults to the number of CPUs.
+        start_method : str, optional
+            multiprocessing start method for the workers ('fork', 'spawn'
+            or 'forkserver'); requires Python 3.4 or later. Defaults to
+            the platform default. Use 'spawn' or 'forkserver' if a GPU has
+            already been initialized in this process, since forked
+            workers cannot use the parent's CUDA context. The template
+            and fold datasets are then pickled, so a DatasetSubset fold
+            is sent along with its parent dataset.
         client_kwargs : dict, optional
-            Keyword arguments for IPython.parallel Client.
+            Deprecated and ignored; IPython.parallel is no longer used.
         view_flags : dict, optional
-            Flags for IPython.parallel LoadBalancedView.
+            Deprecated and ignored; IPython.parallel is no longer used.
         """
+        if client_kwargs is not None or view_flags is not None:
+            warnings.warn("client_kwargs and view_flags are ignored, folds "
+                          "are now trained in local worker processes.")
+        if self._trained:
+            # trained by a previous call, start over
+            self._trainers = None
+            self._trained = False
+        legacy = [extension for extension in self.cv_extensions
+                  if _overrides_setup(extension)]
+        if legacy:
+            warnings.warn("TrainCVExtension.setup(trainers) is deprecated, "
+                          "implement setup_fold(k, trainer) instead. The "
+                          "Train objects of all folds are built up front "
+                          "for %s." % ', '.join(type(extension).__name__
+                                                for extension in legacy),
+                          DeprecationWarning)
+        eager = legacy or self._trainers is not None
+        if eager and parallel:
+            raise ValueError("parallel=True builds each fold in its worker "
+                             "process, so it cannot be used once the Train "
+                             "objects have been built (by reading "
+                             "`trainers`) or with TrainCV extensions that "
+                             "override setup(trainers).")
+        if eager:
+            self.trainers  # build the Train objects of all folds
         self.setup()
         if parallel:
-            from IPython.parallel import Client
-
-            def _train(trainer, time_budget=None):
-                """
-                Run main_loop of this trainer.
-
-                Parameters
-                ----------
-                trainer : Train object
-                    Train object.
-                time_budget : int, optional
-                    The maximum number of seconds before interrupting
-                    training. Default is `None`, no time limit.
-                """
-                trainer.main_loop(time_budget)
-                return trainer
-
-            if client_kwargs is None:
-                client_kwargs = {}
-            if view_flags is None:
-                view_flags = {}
-            client = Client(**client_kwargs)
-            view = client.load_balanced_view()
-            view.set_flags(**view_flags)
-            call = view.map(_train,
-                            self.trainers,
-                            [time_budget] * len(self.trainers),
-                            block=False)
-            self.trainers = call.get()
-        else:
+            self._parallel_main_loop(time_budget, num_workers, start_method)
+        elif eager:
             for trainer in self.trainers:
-                trainer.main_loop(time_budget)
+                self._train(trainer, time_budget)
+        else:
+            self.trainers = []
+            for k, datasets in enumerate(self.dataset_iterator):
+                trainer = self.make_trainer(k, datasets)
+                self.setup_extensions(k, trainer)
+                del datasets
+                self._train(trainer, time_budget)
+                self.trainers.append(trainer)
+        self._trained = True
         self.save()
 
-    def save(self):
+    def _train(self, trainer, time_budget):
+        """
+        Run main_loop of a fold's Train object and call on_save for its
+        extensions.
+
+        Parameters
+        ----------
+        trainer : Train
+            Train object of the fold.
+        time_budget : int or None
+            The maximum number of seconds before interrupting training.
+        """
+        trainer.main_loop(time_budget)
+        for extension in trainer.extensions:
+            extension.on_save(trainer.model, trainer.dataset,
+                              trainer.algorithm)
+
+    def _parallel_main_loop(self, time_budget, num_workers, start_method):
         """
-        Call on_save for Train and TrainCV extensions and serialize trained
-        models if save_path is set.
+        Train folds in at most `num_workers` worker processes.
+
+        The datasets of each fold are built in the parent just before its
+        worker is started, so at most `num_workers` folds are held in
+        memory at a time.
+
+        Parameters
+        ----------
+        time_budget : int or None
+            The maximum number of seconds before interrupting training.
+        num_workers : int or None
+            Maximum number of concurrent worker processes.
+        start_method : str or None
+            multiprocessing start method.
         """
-        # Train extensions
-        for trainer in self.trainers:
-            for extension in trainer.extensions:
-                extension.on_save(trainer.model, trainer.dataset,
-                                  trainer.algorithm)
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if num_workers < 1:
+            raise ValueError("num_workers must be positive, got %d."
+                             % num_workers)
+        if start_method is None:
+            context = multiprocessing
+        elif hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context(start_method)
+        else:
+            raise ValueError("start_method requires Python 3.4 or later.")
+        fields = set()
+        if self.save_path is not None:
+            fields.add('model')
+        for extension in self.cv_extensions:
+            fields.update(_fold_result_fields(extension))
+        fields = tuple(sorted(fields))
+        result_queue = context.Queue()
+        workers = {}
+        results = {}
+
+        def collect():
+            missing = False
+            while True:
+                try:
+                    k, result, error = result_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    # give a dead worker's result one more timeout to
+                    # arrive before giving up on it
+                    dead = [j for j, worker in workers.items()
+                            if not worker.is_alive()]
+                    if dead and missing:
+                        raise RuntimeError("Worker for fold %d exited "
+                                           "without a result." % dead[0])
+                    missing = bool(dead)
+            workers.pop(k).join()
+            if error is not None:
+                raise RuntimeError("Training fold %d failed:\n%s"
+                                   % (k, error))
+            results[k] = cPickle.loads(result)
+
+        try:
+            for k, datasets in enumerate(self.dataset_iterator):
+                if len(workers) >= num_workers:
+                    collect()
+                worker = context.Process(
+                    target=_train_fold,
+                    args=(self._fold_template(k), k, datasets, time_budget,
+                          fields, result_queue))
+                worker.start()
+                workers[k] = worker
+                del datasets
+            while workers:
+                collect()
+        finally:
+            for worker in workers.values():
+                worker.terminate()
+        self.trainers = [results[k] for k in sorted(results)]
 
+    def save(self):
+        """
+        Call on_save for TrainCV extensions and serialize trained models if
+        save_path is set. on_save for the extensions of each Train object
+        is called when its fold finishes training.
+        """
         # TrainCV extensions
         for extension in self.cv_extensions:
             extension.on_save(self.trainers)
@@ -190,10 +536,13 @@ class TrainCV(object):
             models = [trainer.model for trainer in self.trainers]
             try:
                 for trainer in self.trainers:
-                    trainer.dataset._serialization_guard = SerializationGuard()
+                    if trainer.dataset is not None:
+                        trainer.dataset._serialization_guard = \
+                            SerializationGuard()
                 if not self.allow_overwrite and os.path.exists(self.save_path):
                     raise IOError("Trying to overwrite file when not allowed.")
                 serial.save(self.save_path, models, on_overwrite='backup')
             finally:
                 for trainer in self.trainers:
-                    trainer.dataset._serialization_guard = None
+                    if trainer.dataset is not None:
+                        trainer.dataset._serialization_guard = None
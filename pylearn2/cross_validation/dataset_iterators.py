@@ -7,6 +7,7 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "3-clause BSD"
 __maintainer__ = "Steven Kearnes"
 
+import functools
 import numpy as np
 import warnings
 
@@ -21,13 +22,158 @@ from pylearn2.cross_validation.blocks import StackedBlocksCV
 from pylearn2.cross_validation.subset_iterators import (
     ValidationKFold, StratifiedValidationKFold, ValidationShuffleSplit,
     StratifiedValidationShuffleSplit)
+from pylearn2.datasets.dataset import Dataset
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 from pylearn2.datasets.transformer_dataset import TransformerDataset
+from pylearn2.space import CompositeSpace
+from pylearn2.utils import safe_zip
+from pylearn2.utils.iteration import (FiniteDatasetIterator,
+                                      resolve_iterator_class)
+from pylearn2.utils.rng import make_np_rng
+
+
+class DatasetSubset(Dataset):
+    """
+    View of a subset of the examples of a dataset. Holds a reference to
+    the parent dataset and an array of example indices instead of a copy
+    of the data; batches are gathered from the parent as they are
+    requested.
+
+    Parameters
+    ----------
+    dataset : DenseDesignMatrix
+        Parent dataset. Must implement `get_data` and `get_data_specs`.
+    indices : array_like
+        Indices of the examples of `dataset` in this subset.
+    rng : object, optional
+        Random number generator (or seed) used by stochastic iteration
+        modes.
+    """
+    _default_seed = (17, 2, 946)
+
+    def __init__(self, dataset, indices, rng=_default_seed):
+        self.dataset = dataset
+        self.indices = np.asarray(indices)
+        if self.indices.dtype == bool:
+            self.indices = np.where(self.indices)[0]
+        self.rng = make_np_rng(rng, which_method="random_integers")
+        self.data_specs = dataset.get_data_specs()
+
+    def get_data_specs(self):
+        """
+        Returns the data_specs of the parent dataset.
+        """
+        return self.data_specs
+
+    def get_num_examples(self):
+        """
+        Returns the number of examples in this subset.
+        """
+        return len(self.indices)
+
+    def has_targets(self):
+        """
+        Returns whether the parent dataset has targets.
+        """
+        return 'targets' in self._sources()
+
+    def _sources(self):
+        """
+        Returns the sources of the parent dataset as a tuple.
+        """
+        source = self.data_specs[1]
+        if not isinstance(source, tuple):
+            source = (source,)
+        return source
+
+    def get(self, source, indexes):
+        """
+        Returns a tuple of batches, one for each source.
+
+        Parameters
+        ----------
+        source : tuple of str
+            Sources to return.
+        indexes : slice or list of int
+            Indices of the examples within this subset.
+        """
+        data = self.dataset.get_data()
+        if not isinstance(data, tuple):
+            data = (data,)
+        sources = self._sources()
+        indexes = self.indices[indexes]
+        return tuple(data[sources.index(s)][indexes] for s in source)
+
+    def get_data(self):
+        """
+        Returns the data of this subset in the format given by
+        `get_data_specs`. Note that this copies the subset.
+        """
+        rval = self.get(self._sources(), slice(None))
+        if len(rval) == 1:
+            rval, = rval
+        return rval
+
+    @functools.wraps(Dataset.iterator)
+    def iterator(self, mode=None, batch_size=None, num_batches=None,
+                 rng=None, data_specs=None, return_tuple=False):
+        if data_specs is None:
+            data_specs = getattr(self.dataset, '_iter_data_specs',
+                                 self.data_specs)
+
+        space, source = data_specs
+        if isinstance(space, CompositeSpace):
+            sub_spaces = space.components
+            sub_sources = source
+        else:
+            sub_spaces = (space,)
+            sub_sources = (source,)
+
+        # Use the view converter of the parent for "features", as
+        # DenseDesignMatrix.iterator does.
+        view_converter = getattr(self.dataset, 'view_converter', None)
+        convert = []
+        for sp, src in safe_zip(sub_spaces, sub_sources):
+            if src == 'features' and view_converter is not None:
+                conv_fn = (lambda batch, space=sp:
+                           view_converter.get_formatted_batch(batch, space))
+            else:
+                conv_fn = None
+            convert.append(conv_fn)
+
+        if mode is None:
+            if hasattr(self.dataset, '_iter_subset_class'):
+                mode = self.dataset._iter_subset_class
+            else:
+                raise ValueError('iteration mode not provided and no default '
+                                 'mode set for %s' % str(self))
+        else:
+            mode = resolve_iterator_class(mode)
+
+        if batch_size is None:
+            batch_size = getattr(self.dataset, '_iter_batch_size', None)
+        if num_batches is None:
+            num_batches = getattr(self.dataset, '_iter_num_batches', None)
+        if rng is None and mode.stochastic:
+            rng = self.rng
+        return FiniteDatasetIterator(self,
+                                     mode(self.get_num_examples(),
+                                          batch_size,
+                                          num_batches,
+                                          rng),
+                                     data_specs=data_specs,
+                                     return_tuple=return_tuple,
+                                     convert=convert)
 
 
 class DatasetCV(object):
     """
-    Construct a new DenseDesignMatrix for each subset.
+    Construct a dataset for each subset.
+
+    By default each subset is copied into a new DenseDesignMatrix. With
+    `views=True` and no preprocessor, each subset is instead a
+    DatasetSubset view of the full dataset, so the data is not copied
+    for every fold.
 
     Parameters
     ----------
@@ -53,15 +199,20 @@ class DatasetCV(object):
         partition, 'train', 'valid', and 'test' are used). If False,
         returns a list of datasets matching the subset order given by
         subset_iterator.
+    views : bool
+        Whether to return DatasetSubset views of the full dataset instead
+        of DenseDesignMatrix copies. Views only support the iterator
+        interface (no `X`, `y`, `get_design_matrix`, `get_batch_design`
+        or `get_topological_view`), so models and extensions that read
+        the data directly need copies. Ignored if a preprocessor is
+        given, since preprocessing modifies the data it is applied to.
     """
     def __init__(self, dataset, subset_iterator, preprocessor=None,
-                 fit_preprocessor=False, which_set=None, return_dict=True):
+                 fit_preprocessor=False, which_set=None, return_dict=True,
+                 views=False):
         self.dataset = dataset
         self.subset_iterator = list(subset_iterator)  # allow generator reuse
-        dataset_iterator = dataset.iterator(mode='sequential', num_batches=1,
-                                            data_specs=dataset.data_specs,
-                                            return_tuple=True)
-        self._data = dataset_iterator.next()
+        self._data = None
         self.preprocessor = preprocessor
         self.fit_preprocessor = fit_preprocessor
         self.which_set = which_set
@@ -73,6 +224,18 @@ class DatasetCV(object):
                     raise ValueError("Unrecognized subset '{}'".format(label))
             self.which_set = which_set
         self.return_dict = return_dict
+        self.views = views
+
+    def _get_data(self):
+        """
+        Return the raw data of the full dataset, reading it on first use.
+        """
+        if self._data is None:
+            dataset_iterator = self.dataset.iterator(
+                mode='sequential', num_batches=1,
+                data_specs=self.dataset.data_specs, return_tuple=True)
+            self._data = dataset_iterator.next()
+        return self._data
 
     def get_data_subsets(self):
         """
@@ -88,7 +251,7 @@ class DatasetCV(object):
             # data_subsets is an OrderedDict to maintain label order
             data_subsets = OrderedDict()
             for i, subset in enumerate(subsets):
-                subset_data = tuple(data[subset] for data in self._data)
+                subset_data = tuple(data[subset] for data in self._get_data())
                 if len(subset_data) == 2:
                     X, y = subset_data
                 else:
@@ -97,16 +260,41 @@ class DatasetCV(object):
                 data_subsets[labels[i]] = (X, y)
             yield data_subsets
 
+    def get_index_subsets(self):
+        """
+        Partition the dataset according to cross-validation subsets and
+        return the example indices of each subset.
+        """
+        for subsets in self.subset_iterator:
+            labels = None
+            if len(subsets) == 3:
+                labels = ['train', 'valid', 'test']
+            elif len(subsets) == 2:
+                labels = ['train', 'test']
+            # index_subsets is an OrderedDict to maintain label order
+            index_subsets = OrderedDict()
+            for i, subset in enumerate(subsets):
+                index_subsets[labels[i]] = subset
+            yield index_subsets
+
     def __iter__(self):
         """
-        Create a DenseDesignMatrix for each dataset subset and apply any
+        Create a dataset for each dataset subset and apply any
         preprocessing to the child datasets.
         """
-        for data_subsets in self.get_data_subsets():
+        views = self.views and self.preprocessor is None
+        if views:
+            subsets_iterator = self.get_index_subsets()
+        else:
+            subsets_iterator = self.get_data_subsets()
+        for data_subsets in subsets_iterator:
             datasets = {}
             for label, data in data_subsets.items():
-                X, y = data
-                datasets[label] = DenseDesignMatrix(X=X, y=y)
+                if views:
+                    datasets[label] = DatasetSubset(self.dataset, data)
+                else:
+                    X, y = data
+                    datasets[label] = DenseDesignMatrix(X=X, y=y)
 
             # preprocessing
             if self.preprocessor is not None:
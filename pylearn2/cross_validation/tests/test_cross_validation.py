@@ -5,7 +5,11 @@ import os
 import tempfile
 
 from pylearn2.config import yaml_parse
+from pylearn2.cross_validation import TrainCV
+from pylearn2.cross_validation.train_cv_extensions import TrainCVExtension
 from pylearn2.testing.skip import skip_if_no_sklearn
+from pylearn2.train import Train
+from pylearn2.utils import serial
 
 
 def test_train_cv():
@@ -48,6 +52,68 @@ def test_train_cv():
     os.remove(layer0_filename)
     os.remove(layer1_filename)
 
+
+def test_train_cv_parallel():
+    """Test TrainCV with folds trained in worker processes."""
+    skip_if_no_sklearn()
+    handle, filename = tempfile.mkstemp()
+    trainer = yaml_parse.load(test_yaml_layer0 %
+                              {'layer0_filename': filename})
+    trainer.main_loop(parallel=True, num_workers=2)
+    assert len(trainer.trainers) == 3
+    models = serial.load(filename)
+    assert len(models) == 3
+
+    # clean up
+    os.remove(filename)
+
+
+def test_train_cv_serial_trainers():
+    """Test that serial TrainCV keeps the Train object of each fold."""
+    skip_if_no_sklearn()
+    handle, filename = tempfile.mkstemp()
+    trainer = yaml_parse.load(test_yaml_layer0 %
+                              {'layer0_filename': filename})
+    trainer.main_loop()
+    assert len(trainer.trainers) == 3
+    for fold in trainer.trainers:
+        assert isinstance(fold, Train)
+        assert fold.algorithm is not None
+
+    # TrainCV objects pickled with the Train objects in `trainers`
+    state = dict(trainer.__dict__)
+    state['trainers'] = state.pop('_trainers')
+    legacy = TrainCV.__new__(TrainCV)
+    legacy.__setstate__(state)
+    assert legacy.trainers is trainer.trainers
+
+    # clean up
+    os.remove(filename)
+
+
+class LegacySetupExtension(TrainCVExtension):
+    """TrainCV extension using the deprecated setup(trainers)."""
+    def setup(self, trainers):
+        """Record the number of trainers."""
+        self.num_trainers = len(trainers)
+
+
+def test_train_cv_legacy_setup():
+    """Test TrainCV with the Train objects built before main_loop."""
+    skip_if_no_sklearn()
+    handle, filename = tempfile.mkstemp()
+    trainer = yaml_parse.load(test_yaml_layer0 %
+                              {'layer0_filename': filename})
+    extension = LegacySetupExtension()
+    trainer.cv_extensions.append(extension)
+    assert len(trainer.trainers) == 3
+    trainer.main_loop()
+    assert extension.num_trainers == 3
+    assert len(trainer.trainers) == 3
+
+    # clean up
+    os.remove(filename)
+
 test_yaml_layer0 = """
 !obj:pylearn2.cross_validation.TrainCV {
     dataset_iterator:
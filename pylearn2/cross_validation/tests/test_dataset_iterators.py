@@ -1,7 +1,13 @@
 """
 Test cross-validation dataset iterators.
 """
+import numpy as np
+
 from pylearn2.config import yaml_parse
+from pylearn2.cross_validation.dataset_iterators import (DatasetKFold,
+                                                         DatasetSubset)
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.testing.datasets import random_one_hot_dense_design_matrix
 from pylearn2.testing.skip import skip_if_no_sklearn
 
 
@@ -115,6 +121,35 @@ def test_no_targets():
     trainer = yaml_parse.load(test_yaml_no_targets)
     trainer.main_loop()
 
+
+def test_dataset_subset():
+    """Test that fold datasets are views matching the parent's examples."""
+    skip_if_no_sklearn()
+    rng = np.random.RandomState(0)
+    dataset = random_one_hot_dense_design_matrix(rng, 20, 5, 2)
+    for datasets in DatasetKFold(dataset, n_folds=4):
+        for subset in datasets.values():
+            assert isinstance(subset, DenseDesignMatrix)
+    cv = DatasetKFold(dataset, n_folds=4, views=True)
+    for datasets in cv:
+        for label, subset in datasets.items():
+            assert isinstance(subset, DatasetSubset)
+            assert subset.dataset is dataset
+            X = dataset.X[subset.indices]
+            y = dataset.y[subset.indices]
+            assert subset.get_num_examples() == X.shape[0]
+            it = subset.iterator(mode='shuffled_sequential', batch_size=3,
+                                 data_specs=dataset.get_data_specs(),
+                                 return_tuple=True)
+            seen = 0
+            for X_batch, y_batch in it:
+                X_cast = X.astype(X_batch.dtype)
+                rows = [np.where((X_cast == row).all(axis=1))[0][0]
+                        for row in X_batch]
+                assert np.array_equal(y[rows], y_batch)
+                seen += X_batch.shape[0]
+            assert seen == X.shape[0]
+
 test_yaml_dataset_iterator = """
 !obj:pylearn2.cross_validation.TrainCV {
     dataset_iterator:
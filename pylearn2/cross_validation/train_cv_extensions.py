@@ -20,16 +20,47 @@ class TrainCVExtension(object):
     TrainCV extension class. This class operates on the Train objects
     corresponding to each fold of cross-validation, and therefore does not
     implement an on_monitor method.
+
+    Attributes
+    ----------
+    fold_result_fields : tuple or None
+        The attributes of each fold's Train object read by `on_save`,
+        among 'model', 'extensions' and 'params' (the model's parameter
+        values). When folds are trained in parallel, only these are sent
+        back from the worker processes. If None, subclasses overriding
+        `on_save` get the model and the extensions.
     """
+    fold_result_fields = None
     def setup(self, trainers):
         """
-        Set up training extension.
+        Set up training extension for all folds at once.
+
+        Deprecated: TrainCV calls `setup_fold` for each fold as its Train
+        object is built. Subclasses that still override this method make
+        TrainCV build the Train objects of all folds up front, and cannot
+        be used with parallel training.
 
         Parameters
         ----------
         trainers : list
             List of Train objects belonging to the parent TrainCV object.
         """
+        for k, trainer in enumerate(trainers):
+            self.setup_fold(k, trainer)
+
+    def setup_fold(self, k, trainer):
+        """
+        Set up training extension for a single fold. Called by TrainCV
+        when the Train object for fold `k` is built, which may happen in a
+        worker process.
+
+        Parameters
+        ----------
+        k : int
+            Fold index.
+        trainer : Train
+            Train object for this fold.
+        """
 
     def on_save(self, trainers):
         """
@@ -67,6 +98,9 @@ class MonitorBasedSaveBestCV(TrainCVExtension):
         Whether to write individual files for each cross-validation fold.
         Only used if save_path is not None.
     """
+    # on_save only reads the best models kept by the fold extensions
+    fold_result_fields = ('extensions',)
+
     def __init__(self, channel_name, save_path=None, store_best_model=False,
                  higher_is_better=False, tag_key=None, save_folds=False):
         self.channel_name = channel_name
@@ -81,29 +115,30 @@ class MonitorBasedSaveBestCV(TrainCVExtension):
         self.tag_key = tag_key
         self.save_folds = save_folds
 
-    def setup(self, trainers):
+    def setup_fold(self, k, trainer):
         """
-        Add tracking to all trainers.
+        Add tracking to the trainer for a single fold.
 
         Parameters
         ----------
-        trainers : list
-            List of Train objects belonging to the parent TrainCV object.
+        k : int
+            Fold index.
+        trainer : Train
+            Train object for this fold.
         """
-        for k, trainer in enumerate(trainers):
-            if self.save_path is not None and self.save_folds:
-                path, ext = os.path.splitext(self.save_path)
-                save_path = path + '-{}'.format(k) + ext
-            else:
-                save_path = None
-            if self.tag_key is not None:
-                tag_key = '{}-{}'.format(self.tag_key, k)
-            else:
-                tag_key = None
-            extension = MonitorBasedSaveBest(
-                self.channel_name, save_path=save_path, store_best_model=True,
-                higher_is_better=self.higher_is_better, tag_key=tag_key)
-            trainer.extensions.append(extension)
+        if self.save_path is not None and self.save_folds:
+            path, ext = os.path.splitext(self.save_path)
+            save_path = path + '-{}'.format(k) + ext
+        else:
+            save_path = None
+        if self.tag_key is not None:
+            tag_key = '{}-{}'.format(self.tag_key, k)
+        else:
+            tag_key = None
+        extension = MonitorBasedSaveBest(
+            self.channel_name, save_path=save_path, store_best_model=True,
+            higher_is_better=self.higher_is_better, tag_key=tag_key)
+        trainer.extensions.append(extension)
 
     def on_save(self, trainers):
         """
@@ -125,8 +160,11 @@ class MonitorBasedSaveBestCV(TrainCVExtension):
         assert len(models) == len(trainers)
         try:
             for trainer in trainers:
-                trainer.dataset._serialization_guard = SerializationGuard()
-                serial.save(self.save_path, models, on_overwrite='backup')
+                if trainer.dataset is not None:
+                    trainer.dataset._serialization_guard = \
+                        SerializationGuard()
+            serial.save(self.save_path, models, on_overwrite='backup')
         finally:
             for trainer in trainers:
-                trainer.dataset._serialization_guard = None
+                if trainer.dataset is not None:
+                    trainer.dataset._serialization_guard = None
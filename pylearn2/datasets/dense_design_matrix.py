@@ -17,6 +17,7 @@ __email__ = "pylearn-dev@googlegroups"
 import functools
 
 import logging
+import os
 import warnings
 
 import numpy as np
@@ -267,7 +268,7 @@ class DenseDesignMatrix(Dataset):
     @functools.wraps(Dataset.iterator)
     def iterator(self, mode=None, batch_size=None, num_batches=None,
                  rng=None, data_specs=None,
-                 return_tuple=False):
+                 return_tuple=False, num_buffers=None):
 
         if data_specs is None:
             data_specs = self._iter_data_specs
@@ -318,7 +319,8 @@ class DenseDesignMatrix(Dataset):
                                           rng),
                                      data_specs=data_specs,
                                      return_tuple=return_tuple,
-                                     convert=convert)
+                                     convert=convert,
+                                     num_buffers=num_buffers)
 
     def get_data(self):
         """
@@ -336,7 +338,7 @@ class DenseDesignMatrix(Dataset):
         else:
             return (self.X, self.y)
 
-    def use_design_loc(self, path):
+    def use_design_loc(self, path, mmap_mode=None):
         """
         Caling this function changes the serialization behavior of the object
         permanently.
@@ -354,12 +356,18 @@ class DenseDesignMatrix(Dataset):
         ----------
         path : str
             The path to save the design matrix to
+        mmap_mode : str, optional
+            If given, the design matrix is memory-mapped from `path` with
+            this mode (see `numpy.load`) when the object is unpickled,
+            instead of being read into memory. With mode 'r' the pages
+            are shared by all the processes that load the dataset.
         """
 
         if not path.endswith('.npy'):
             raise ValueError("path should end with '.npy'")
 
         self.design_loc = path
+        self.design_loc_mmap_mode = mmap_mode
 
     def get_topo_batch_axis(self):
         """
@@ -410,7 +418,12 @@ class DenseDesignMatrix(Dataset):
         if self.design_loc is not None:
             # TODO: Get rid of this logic, use custom array-aware picklers
             # (joblib, custom pylearn2 serialization format).
-            np.save(self.design_loc, rval['X'])
+            X = rval['X']
+            # Don't overwrite the file X is memory-mapped from
+            if not (isinstance(X, np.memmap) and X.filename is not None and
+                    os.path.abspath(X.filename) ==
+                    os.path.abspath(self.design_loc)):
+                np.save(self.design_loc, X)
             del rval['X']
 
         return rval
@@ -424,7 +437,8 @@ class DenseDesignMatrix(Dataset):
         if d['design_loc'] is not None:
             if control.get_load_data():
                 fname = cache.datasetCache.cache_file(d['design_loc'])
-                d['X'] = np.load(fname)
+                d['X'] = np.load(fname,
+                                 mmap_mode=d.get('design_loc_mmap_mode'))
             else:
                 d['X'] = None
 
@@ -1,14 +1,27 @@
 """Objects for datasets serialized in the NumPy native format (.npy/.npz)."""
+import copy
 import functools
+import warnings
 import numpy
+from theano.compat import six
+from pylearn2.datasets import control
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 
 
 class NpyDataset(DenseDesignMatrix):
 
-    """A dense dataset based on a single array stored as a .npy file."""
+    """
+    A dense dataset based on a single array stored as a .npy file.
 
-    def __init__(self, file, mmap_mode=None):
+    With `mmap_mode='r'` the design matrix is a read-only `numpy.memmap`
+    of the file: batches are read from disk as the iterator asks for
+    them, and since the mapped pages live in the OS page cache they are
+    shared by every process on the machine that maps the same file.
+    When pickled, a memory-mapped dataset only stores the path to the
+    file and maps it again when unpickled.
+    """
+
+    def __init__(self, file, mmap_mode=None, axes=('b', 0, 1, 'c')):
         """
         Creates an NpyDataset object.
 
@@ -21,8 +34,15 @@ class NpyDataset(DenseDesignMatrix):
             Memory mapping options for memory-mapping an array on disk,
             rather than loading it into memory. See the `numpy.load`
             docstring for details.
+        axes : tuple, optional
+            The axes ordering of the stored array, if it is a topological
+            view. Memory-mapping a topological view without copying it
+            requires the channel axis to come right after the batch axis,
+            i.e. `('b', 'c', 0, 1)`, or a single channel.
         """
         self._path = file
+        self._mmap_mode = mmap_mode
+        self._axes = axes
         self._loaded = False
 
     def _deferred_load(self):
@@ -32,14 +52,63 @@ class NpyDataset(DenseDesignMatrix):
             WRITEME
         """
         self._loaded = True
-        loaded = numpy.load(self._path)
+        loaded = numpy.load(self._path, mmap_mode=self._mmap_mode)
         assert isinstance(loaded, numpy.ndarray), (
             "single arrays (.npy) only"
         )
         if len(loaded.shape) == 2:
             super(NpyDataset, self).__init__(X=loaded)
         else:
-            super(NpyDataset, self).__init__(topo_view=loaded)
+            super(NpyDataset, self).__init__(topo_view=loaded,
+                                             axes=self._axes)
+            if (isinstance(loaded, numpy.memmap) and
+                    not numpy.may_share_memory(self.X, loaded)):
+                warnings.warn("The topological view stored in %s could "
+                              "not be flattened without copying it into "
+                              "memory; store it with axes ('b', 'c', 0, 1) "
+                              "to keep it memory-mapped." % self._path)
+
+    def _is_remappable(self):
+        """
+        Whether the design matrix can be mapped again from `self._path`
+        instead of being pickled.
+        """
+        return (getattr(self, '_mmap_mode', None) is not None and
+                isinstance(self._path, six.string_types) and
+                isinstance(self.X, numpy.memmap) and
+                not self.compress and self.design_loc is None)
+
+    def __getstate__(self):
+        """
+        Returns the state to pickle, leaving out a memory-mapped design
+        matrix, which is mapped again from the .npy file on unpickling.
+        """
+        if not self._loaded:
+            return copy.copy(self.__dict__)
+        rval = super(NpyDataset, self).__getstate__()
+        if self._is_remappable():
+            del rval['X']
+        return rval
+
+    def __setstate__(self, d):
+        """
+        Restores the pickled state, mapping the design matrix again if it
+        was left out by `__getstate__`.
+        """
+        if not d['_loaded']:
+            self.__dict__.update(d)
+            return
+        if 'X' not in d:
+            if control.get_load_data():
+                loaded = numpy.load(d['_path'], mmap_mode=d['_mmap_mode'])
+                if len(loaded.shape) == 2:
+                    d['X'] = loaded
+                else:
+                    d['X'] = d['view_converter'].topo_view_to_design_mat(
+                        loaded)
+            else:
+                d['X'] = None
+        super(NpyDataset, self).__setstate__(d)
 
     @functools.wraps(DenseDesignMatrix.get_design_matrix)
     def get_design_matrix(self, topo=None):
@@ -17,7 +17,9 @@ import logging
 import time
 import warnings
 import os
+from multiprocessing.pool import ThreadPool
 import numpy
+from theano.compat import six
 from theano.compat.six.moves import xrange
 import scipy
 try:
@@ -43,6 +45,248 @@ log = logging.getLogger(__name__)
 convert_axes = Conv2DSpace.convert_numpy
 
 
+def _row_blocks(X, batch_size, items=()):
+    """
+    Yields `(start, block)` for consecutive blocks of at most
+    `batch_size` rows of the design matrix `X`, each read into memory
+    and passed through the `_transform_rows` of every preprocessor in
+    `items`.
+    """
+    for start in xrange(0, X.shape[0], batch_size):
+        block = numpy.array(X[start:start + batch_size])
+        for item in items:
+            block = item._transform_rows(block)
+        yield start, block
+
+
+def _check_in_place(X):
+    """
+    Raises a ValueError if the design matrix `X` can't be overwritten
+    block by block.
+    """
+    if not numpy.issubdtype(X.dtype, numpy.floating):
+        raise ValueError("Preprocessing in batches writes the result back "
+                         "into the design matrix, so it must have a "
+                         "floating point dtype, not %s." % X.dtype)
+    if isinstance(X, numpy.ndarray) and not X.flags.writeable:
+        raise ValueError("Preprocessing in batches writes the result back "
+                         "into the design matrix, which is read-only. If "
+                         "it is memory-mapped, open it with mmap_mode='r+'.")
+
+
+def _write_rows(dataset, X, start, rows):
+    """
+    Writes `rows` into the design matrix `X` of `dataset`, starting at
+    row `start`.
+    """
+    if isinstance(X, numpy.ndarray):
+        X[start:start + rows.shape[0]] = rows
+    else:
+        # PyTables storage
+        dataset.set_design_matrix(rows, start=start)
+
+
+def _supports_rows(item):
+    """
+    Whether `item` is an ExamplewisePreprocessor implementing the
+    row block interface (`_fit_rows` and `_transform_rows`).
+    """
+    if not isinstance(item, ExamplewisePreprocessor):
+        return False
+    method = six.get_unbound_function(type(item)._transform_rows)
+    base = six.get_unbound_function(ExamplewisePreprocessor._transform_rows)
+    return method is not base
+
+
+def _apply_rows(dataset, items, can_fit, batch_size):
+    """
+    Applies a sequence of ExamplewisePreprocessors implementing the row
+    block interface to the design matrix of `dataset`.
+
+    If `batch_size` is None, the whole design matrix is fit and
+    transformed at once, and the result replaces it. Otherwise the
+    design matrix is only ever read `batch_size` rows at a time: each
+    preprocessor is fit (if `can_fit`) in one pass over blocks that have
+    gone through the preprocessors before it, then a last pass writes
+    the transformed blocks back in place. The design matrix can then be
+    a writable memory map or PyTables array larger than memory.
+
+    Parameters
+    ----------
+    dataset : DenseDesignMatrix
+        The dataset to act on.
+    items : list of ExamplewisePreprocessor
+        The preprocessors to apply, in order.
+    can_fit : bool
+        Whether the preprocessors may be fit to `dataset`.
+    batch_size : int or None
+        The number of rows to process at once.
+    """
+    X = dataset.get_design_matrix()
+    if batch_size is None:
+        for item in items:
+            if can_fit:
+                item._fit_rows([X])
+            X = item._transform_rows(X)
+        dataset.set_design_matrix(X)
+        return
+
+    _check_in_place(X)
+    if can_fit:
+        for i, item in enumerate(items):
+            log.info("%s fitting in batches of %d"
+                     % (item.__class__.__name__, batch_size))
+            item._fit_rows(block for start, block
+                           in _row_blocks(X, batch_size, items[:i]))
+    for start, block in _row_blocks(X, batch_size, items):
+        log.info("Preprocessing data from %d to %d"
+                 % (start, start + block.shape[0]))
+        _write_rows(dataset, X, start, block)
+
+
+def _column_moments(blocks):
+    """
+    Computes the per-column mean and sum of squared deviations of the
+    rows in `blocks`, merging the statistics of each block as in [1].
+
+    Parameters
+    ----------
+    blocks : iterable of ndarray
+        Blocks of rows of a design matrix.
+
+    Returns
+    -------
+    count : int
+        The number of rows.
+    mean : ndarray
+        The mean of each column, in float64.
+    m2 : ndarray
+        The sum of the squared deviations from the mean of each column,
+        in float64.
+    dtype : numpy.dtype
+        The dtype statistics should be returned in: the dtype of the
+        blocks if they are floating point, float64 otherwise.
+
+    References
+    ----------
+    .. [1] Chan, T. F., Golub, G. H. and LeVeque, R. J. (1979). Updating
+       formulae and a pairwise algorithm for computing sample variances.
+    """
+    count = 0
+    mean = m2 = dtype = None
+    for block in blocks:
+        if dtype is None:
+            dtype = block.dtype
+        block_count = block.shape[0]
+        if block_count == 0:
+            continue
+        block_mean = block.mean(axis=0, dtype='float64')
+        # Center in the dtype of the block, so that the only full-size
+        # temporary has the size of the block itself.
+        if numpy.issubdtype(block.dtype, numpy.floating):
+            centered = block - block_mean.astype(block.dtype)
+        else:
+            centered = block - block_mean
+        numpy.square(centered, out=centered)
+        block_m2 = centered.sum(axis=0, dtype='float64')
+        del centered
+        if count == 0:
+            mean, m2 = block_mean, block_m2
+        else:
+            delta = block_mean - mean
+            total = count + block_count
+            mean = mean + delta * (block_count / float(total))
+            m2 = m2 + block_m2 + (numpy.square(delta) *
+                                  (count * block_count / float(total)))
+        count += block_count
+    if count == 0:
+        raise ValueError("Can't fit a preprocessor to an empty dataset.")
+    if not numpy.issubdtype(dtype, numpy.floating):
+        dtype = numpy.dtype('float64')
+    return count, mean, m2, dtype
+
+
+def _column_means(blocks):
+    """
+    Computes the per-column mean of the rows in `blocks`, without any
+    full-size temporary.
+
+    Parameters
+    ----------
+    blocks : iterable of ndarray
+        Blocks of rows of a design matrix.
+
+    Returns
+    -------
+    count : int
+        The number of rows.
+    mean : ndarray
+        The mean of each column, in float64.
+    dtype : numpy.dtype
+        The dtype statistics should be returned in, as in
+        `_column_moments`.
+    """
+    count = 0
+    total = dtype = None
+    for block in blocks:
+        if dtype is None:
+            dtype = block.dtype
+        if block.shape[0] == 0:
+            continue
+        block_total = block.sum(axis=0, dtype='float64')
+        if total is None:
+            total = block_total
+        else:
+            total += block_total
+        count += block.shape[0]
+    if count == 0:
+        raise ValueError("Can't fit a preprocessor to an empty dataset.")
+    if not numpy.issubdtype(dtype, numpy.floating):
+        dtype = numpy.dtype('float64')
+    return count, total / count, dtype
+
+
+def _block_second_moments(block):
+    """
+    Returns the number of rows of `block`, the mean of its columns and
+    the sum of the outer products of its centered rows, in float64.
+    """
+    block = numpy.asarray(block, dtype='float64')
+    mean = block.mean(axis=0)
+    block = block - mean
+    return block.shape[0], mean, numpy.dot(block.T, block)
+
+
+def _merge_second_moments(a, b):
+    """
+    Merges two `(count, mean, m2)` triples returned by
+    `_block_second_moments`, where `m2` is the sum of the outer products
+    of the centered rows, with the pairwise update of `_column_moments`.
+    """
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    if count_a == 0:
+        return b
+    if count_b == 0:
+        return a
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / float(count))
+    m2 = m2_a + m2_b
+    m2 += numpy.outer(delta, delta) * (count_a * count_b / float(count))
+    return count, mean, m2
+
+
+def _global_moments(count, mean, m2):
+    """
+    Merges the per-column statistics returned by `_column_moments` into
+    the mean and sum of squared deviations over every element.
+    """
+    global_mean = mean.mean()
+    global_m2 = m2.sum() + count * numpy.square(mean - global_mean).sum()
+    return global_mean, global_m2
+
+
 class Preprocessor(object):
 
     """
@@ -134,7 +378,63 @@ class ExamplewisePreprocessor(Preprocessor):
 
     TODO: can these things fit themselves in their apply method?
     That seems like a difference from Block.
+
+    Subclasses that implement `_transform_rows` (and `_fit_rows`, if
+    they have parameters to fit) get an `apply` that can process the
+    design matrix in blocks of `_batch_size` rows, so that datasets that
+    don't fit in memory can be preprocessed in place.
     """
+    _batch_size = None
+
+    def apply(self, dataset, can_fit=False):
+        """
+        Fits to (if `can_fit`) and transforms the design matrix of
+        `dataset`.
+
+        If `self._batch_size` is None the whole design matrix is
+        processed at once. Otherwise it is read in blocks of that many
+        rows, once to fit and once to transform, and the result is
+        written back in place; the design matrix must then have a
+        floating point dtype and be writable.
+
+        Parameters
+        ----------
+        dataset : DenseDesignMatrix
+            The dataset to act on.
+        can_fit : bool
+            If True, the preprocessor is fit to `dataset`.
+        """
+        _apply_rows(dataset, [self], can_fit, self._batch_size)
+
+    def _fit_rows(self, blocks):
+        """
+        Fits the preprocessor to the rows of a design matrix.
+
+        The default implementation has nothing to fit.
+
+        Parameters
+        ----------
+        blocks : iterable of ndarray
+            Consecutive blocks of rows of the design matrix. They can
+            only be iterated over once.
+        """
+
+    def _transform_rows(self, X):
+        """
+        Transforms a block of rows of a design matrix.
+
+        Parameters
+        ----------
+        X : ndarray
+            Rows of a design matrix. They may be modified in place.
+
+        Returns
+        -------
+        rval : ndarray
+            The transformed rows.
+        """
+        raise NotImplementedError(str(type(self)) +
+                                  " does not implement _transform_rows.")
 
     def as_block(self):
         raise NotImplementedError(str(type(self)) +
@@ -173,10 +473,20 @@ class Pipeline(Preprocessor):
     Parameters
     ----------
     items : WRITEME
+    batch_size : int or None, optional
+        If specified and every item is an ExamplewisePreprocessor
+        supporting batches, the items are fit one after the other on
+        blocks of `batch_size` rows and the design matrix is written
+        back once, in place, at the end. Otherwise the items are applied
+        one at a time, each with its own batch size.
     """
 
-    def __init__(self, items=None):
+    def __init__(self, items=None, batch_size=None):
         self.items = items if items is not None else []
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self._batch_size = batch_size
 
     def apply(self, dataset, can_fit=False):
         """
@@ -184,6 +494,11 @@ class Pipeline(Preprocessor):
 
             WRITEME
         """
+        batch_size = getattr(self, '_batch_size', None)
+        if batch_size is not None and all(_supports_rows(item)
+                                          for item in self.items):
+            _apply_rows(dataset, self.items, can_fit, batch_size)
+            return
         for item in self.items:
             item.apply(dataset, can_fit)
 
@@ -508,16 +823,15 @@ class MakeUnitNorm(ExamplewisePreprocessor):
         WRITEME
     """
 
-    def apply(self, dataset, can_fit=False):
+    def _transform_rows(self, X):
         """
         .. todo::
 
             WRITEME
         """
-        X = dataset.get_design_matrix()
         X_norm = numpy.sqrt(numpy.sum(X ** 2, axis=1))
         X /= X_norm[:, None]
-        dataset.set_design_matrix(X)
+        return X
 
     def as_block(self):
         """
@@ -651,11 +965,19 @@ class RemoveMean(ExamplewisePreprocessor):
     axis : int or None, optional
         Axis over which to take the mean, with the exact same
         semantics as the `axis` parameter of `numpy.mean`.
+    batch_size : int or None, optional
+        If specified, fit and transform the design matrix in blocks of
+        `batch_size` rows, writing the result in place. Only supported
+        for `axis` 0 or None.
     """
 
-    def __init__(self, axis=0):
+    def __init__(self, axis=0, batch_size=None):
         self._axis = axis
         self._mean = None
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self._batch_size = batch_size
 
     def apply(self, dataset, can_fit=True):
         """
@@ -663,15 +985,37 @@ class RemoveMean(ExamplewisePreprocessor):
 
             WRITEME
         """
-        X = dataset.get_design_matrix()
-        if can_fit:
-            self._mean = X.mean(axis=self._axis)
-        else:
-            if self._mean is None:
-                raise ValueError("can_fit is False, but RemoveMean object "
-                                 "has no stored mean or standard deviation")
+        super(RemoveMean, self).apply(dataset, can_fit)
+
+    def _fit_rows(self, blocks):
+        """
+        .. todo::
+
+            WRITEME
+        """
+        if self._axis not in (0, None):
+            blocks = list(blocks)
+            if len(blocks) != 1:
+                raise NotImplementedError("RemoveMean can only be fit in "
+                                          "batches for axis 0 or None.")
+            self._mean = blocks[0].mean(axis=self._axis)
+            return
+        count, mean, dtype = _column_means(blocks)
+        if self._axis is None:
+            mean = mean.mean()
+        self._mean = numpy.cast[dtype](mean)
+
+    def _transform_rows(self, X):
+        """
+        .. todo::
+
+            WRITEME
+        """
+        if self._mean is None:
+            raise ValueError("can_fit is False, but RemoveMean object "
+                             "has no stored mean or standard deviation")
         X -= self._mean
-        dataset.set_design_matrix(X)
+        return X
 
     def as_block(self):
         """
@@ -706,31 +1050,51 @@ class Standardize(ExamplewisePreprocessor):
         dividing, to prevent standard deviations very close to zero
         from causing the feature values to blow up too much.
         Default is `1e-4`.
+    batch_size : int or None, optional
+        If specified, fit and transform the design matrix in blocks of
+        `batch_size` rows, writing the result in place.
     """
 
-    def __init__(self, global_mean=False, global_std=False, std_eps=1e-4):
+    def __init__(self, global_mean=False, global_std=False, std_eps=1e-4,
+                 batch_size=None):
         self._global_mean = global_mean
         self._global_std = global_std
         self._std_eps = std_eps
         self._mean = None
         self._std = None
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self._batch_size = batch_size
 
-    def apply(self, dataset, can_fit=False):
+    def _fit_rows(self, blocks):
         """
         .. todo::
 
             WRITEME
         """
-        X = dataset.get_design_matrix()
-        if can_fit:
-            self._mean = X.mean() if self._global_mean else X.mean(axis=0)
-            self._std = X.std() if self._global_std else X.std(axis=0)
+        count, mean, m2, dtype = _column_moments(blocks)
+        global_mean, global_m2 = _global_moments(count, mean, m2)
+        if self._global_mean:
+            self._mean = numpy.cast[dtype](global_mean)
         else:
-            if self._mean is None or self._std is None:
-                raise ValueError("can_fit is False, but Standardize object "
-                                 "has no stored mean or standard deviation")
-        new = (X - self._mean) / (self._std_eps + self._std)
-        dataset.set_design_matrix(new)
+            self._mean = numpy.cast[dtype](mean)
+        if self._global_std:
+            self._std = numpy.cast[dtype](
+                numpy.sqrt(global_m2 / (count * mean.shape[0])))
+        else:
+            self._std = numpy.cast[dtype](numpy.sqrt(m2 / count))
+
+    def _transform_rows(self, X):
+        """
+        .. todo::
+
+            WRITEME
+        """
+        if self._mean is None or self._std is None:
+            raise ValueError("can_fit is False, but Standardize object "
+                             "has no stored mean or standard deviation")
+        return (X - self._mean) / (self._std_eps + self._std)
 
     def as_block(self):
         """
@@ -883,22 +1247,25 @@ class RemapInterval(ExamplewisePreprocessor):
     """
     # TODO: Implement as_block
 
-    def __init__(self, map_from, map_to):
+    def __init__(self, map_from, map_to, batch_size=None):
         assert map_from[0] < map_from[1] and len(map_from) == 2
         assert map_to[0] < map_to[1] and len(map_to) == 2
         self.map_from = [numpy.float(x) for x in map_from]
         self.map_to = [numpy.float(x) for x in map_to]
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self._batch_size = batch_size
 
-    def apply(self, dataset, can_fit=False):
+    def _transform_rows(self, X):
         """
         .. todo::
 
             WRITEME
         """
-        X = dataset.get_design_matrix()
         X = (X - self.map_from[0]) / numpy.diff(self.map_from)
         X = X * numpy.diff(self.map_to) + self.map_to[0]
-        dataset.set_design_matrix(X)
+        return X
 
 
 class PCA_ViewConverter(object):
@@ -988,10 +1355,25 @@ class PCA(object):
     Parameters
     ----------
     num_components : WRITEME
+    solver : str, optional
+        Which PCA implementation of `pylearn2.models.pca` to fit:
+        'cov_eig' (the default) forms the full covariance matrix,
+        'randomized' uses `RandomizedPCA` and 'incremental' uses
+        `IncrementalPCA`. The latter two stream over the dataset's
+        iterator and need memory proportional to `num_components` times
+        the dimension.
+    batch_size : int, optional
+        Number of examples processed at a time by the streaming solvers
+        and when transforming the dataset. If None, the whole design
+        matrix is transformed at once.
     """
 
-    def __init__(self, num_components):
+    def __init__(self, num_components, solver='cov_eig', batch_size=None):
         self._num_components = num_components
+        if solver not in ['cov_eig', 'randomized', 'incremental']:
+            raise ValueError("Unknown PCA solver %r" % (solver,))
+        self._solver = solver
+        self._batch_size = batch_size
         self._pca = None
         # TODO: Is storing these really necessary? This computation
         # can't really be merged since we're basically creating the
@@ -1005,13 +1387,27 @@ class PCA(object):
 
             WRITEME
         """
+        solver = getattr(self, '_solver', 'cov_eig')
+        batch_size = getattr(self, '_batch_size', None)
         if self._pca is None:
             if not can_fit:
                 raise ValueError("can_fit is False, but PCA preprocessor "
                                  "object has no fitted model stored")
-            from pylearn2 import pca
-            self._pca = pca.CovEigPCA(self._num_components)
-            self._pca.train(dataset.get_design_matrix())
+            from pylearn2.models import pca
+            if solver == 'cov_eig':
+                self._pca = pca.CovEigPCA(num_components=self._num_components)
+                self._pca.train(dataset.get_design_matrix())
+            else:
+                kwargs = {}
+                if batch_size is not None:
+                    kwargs['batch_size'] = batch_size
+                if solver == 'randomized':
+                    self._pca = pca.RandomizedPCA(
+                        num_components=self._num_components, **kwargs)
+                else:
+                    self._pca = pca.IncrementalPCA(
+                        num_components=self._num_components, **kwargs)
+                self._pca.train_dataset(dataset)
             self._transform_func = function([self._input],
                                             self._pca(self._input))
             self._invert_func = function([self._output],
@@ -1022,11 +1418,18 @@ class PCA(object):
             )
 
         orig_data = dataset.get_design_matrix()
-        dataset.set_design_matrix(
-            self._transform_func(dataset.get_design_matrix())
-        )
+        if batch_size is None:
+            proc_data = self._transform_func(orig_data)
+            orig_var = orig_data.var(axis=0)
+        else:
+            proc_data = numpy.concatenate(
+                [self._transform_func(block)
+                 for _, block in _row_blocks(orig_data, batch_size)])
+            count, _, m2, _ = _column_moments(
+                block for _, block in _row_blocks(orig_data, batch_size))
+            orig_var = m2 / count
+        dataset.set_design_matrix(proc_data)
         proc_data = dataset.get_design_matrix()
-        orig_var = orig_data.var(axis=0)
         proc_var = proc_data.var(axis=0)
         assert proc_var[0] > orig_var.max()
 
@@ -1092,7 +1495,7 @@ class Downsample(object):
         dataset.set_topological_view(X)
 
 
-class GlobalContrastNormalization(Preprocessor):
+class GlobalContrastNormalization(ExamplewisePreprocessor):
 
     """
     .. todo::
@@ -1126,37 +1529,18 @@ class GlobalContrastNormalization(Preprocessor):
             assert batch_size > 0, "batch_size must be positive"
         self._batch_size = batch_size
 
-    def apply(self, dataset, can_fit=False):
+    def _transform_rows(self, X):
         """
         .. todo::
 
             WRITEME
         """
-        if self._batch_size is None:
-            X = global_contrast_normalize(dataset.get_design_matrix(),
-                                          scale=self._scale,
-                                          subtract_mean=self._subtract_mean,
-                                          use_std=self._use_std,
-                                          sqrt_bias=self._sqrt_bias,
-                                          min_divisor=self._min_divisor)
-            dataset.set_design_matrix(X)
-        else:
-            data = dataset.get_design_matrix()
-            data_size = data.shape[0]
-            last = (numpy.floor(data_size / float(self._batch_size)) *
-                    self._batch_size)
-            for i in xrange(0, data_size, self._batch_size):
-                stop = i + self._batch_size
-                log.info("GCN processing data from %d to %d" % (i, stop))
-                X = data[i:stop]
-                X = global_contrast_normalize(
-                    X,
-                    scale=self._scale,
-                    subtract_mean=self._subtract_mean,
-                    use_std=self._use_std,
-                    sqrt_bias=self._sqrt_bias,
-                    min_divisor=self._min_divisor)
-                dataset.set_design_matrix(X, start=i)
+        return global_contrast_normalize(X,
+                                         scale=self._scale,
+                                         subtract_mean=self._subtract_mean,
+                                         use_std=self._use_std,
+                                         sqrt_bias=self._sqrt_bias,
+                                         min_divisor=self._min_divisor)
 
 
 class ZCA(Preprocessor):
@@ -1180,10 +1564,19 @@ class ZCA(Preprocessor):
         When self.apply(dataset, can_fit=True) store not just the
         preprocessing matrix, but its inverse. This is necessary when
         using this preprocessor to instantiate a ZCA_Dataset.
+    batch_size : int or None, optional
+        If specified, `apply` fits (with `fit_blocks`) and transforms the
+        design matrix in blocks of `batch_size` rows, writing the result
+        in place, so that only a block and a few covariance-sized
+        matrices are held in memory.
+    num_workers : int or None, optional
+        Number of threads computing the statistics of different blocks
+        in parallel in `fit_blocks`.
     """
 
     def __init__(self, n_components=None, n_drop_components=None,
-                 filter_bias=0.1, store_inverse=True):
+                 filter_bias=0.1, store_inverse=True, batch_size=None,
+                 num_workers=None):
         warnings.warn("This ZCA preprocessor class is known to yield very "
                       "different results on different platforms. If you plan "
                       "to conduct experiments with this preprocessing on "
@@ -1211,6 +1604,15 @@ class ZCA(Preprocessor):
         # (or <save_path>.npz, if the suffix is omitted).
         self.matrices_save_path = None
 
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self.batch_size = batch_size
+        if num_workers is not None:
+            num_workers = int(num_workers)
+            assert num_workers > 0, "num_workers must be positive"
+        self.num_workers = num_workers
+
     @staticmethod
     def _gpu_matrix_dot(matrix_a, matrix_b, matrix_c=None):
         """
@@ -1399,13 +1801,92 @@ class ZCA(Preprocessor):
         log.info('computing zca of a {0} matrix'.format(X.shape))
         t1 = time.time()
 
-        bias = self.filter_bias * scipy.sparse.identity(X.shape[1],
-                                                        theano.config.floatX)
-
-        covariance = ZCA._gpu_matrix_dot(X.T, X) / X.shape[0] + bias
+        covariance = ZCA._gpu_matrix_dot(X.T, X) / X.shape[0]
         t2 = time.time()
         log.info("cov estimate took {0} seconds".format(t2 - t1))
 
+        self._fit_covariance(covariance)
+
+    def fit_blocks(self, blocks, num_workers=None):
+        """
+        Fits this `ZCA` instance to a design matrix given as a sequence
+        of blocks of rows, which is only iterated over once.
+
+        The mean and covariance are accumulated block by block in
+        float64, so memory use is bounded by a block and a few matrices
+        of the size of the covariance, however big the design matrix.
+
+        Parameters
+        ----------
+        blocks : iterable of ndarray
+            Blocks of rows of the design matrix, for example the batches
+            returned by `dataset.iterator(mode='sequential', ...)` for
+            the 'features' source.
+        num_workers : int or None, optional
+            Number of threads computing the statistics of different
+            blocks at once. Defaults to `self.num_workers`. Each thread
+            holds one block.
+        """
+        if num_workers is None:
+            num_workers = getattr(self, 'num_workers', None)
+        log.info('computing zca from blocks')
+        t1 = time.time()
+
+        moments = (0, None, None)
+        dtype = None
+        pool = None
+        if num_workers is not None and num_workers > 1:
+            pool = ThreadPool(num_workers)
+        try:
+            group = []
+            for block in blocks:
+                assert len(block.shape) == 2
+                assert not contains_nan(block)
+                if dtype is None:
+                    dtype = block.dtype
+                group.append(block)
+                # Only as many blocks as there are workers are held in
+                # memory at once
+                if len(group) == (num_workers if pool else 1):
+                    parts = (pool.map(_block_second_moments, group) if pool
+                             else [_block_second_moments(group[0])])
+                    for part in parts:
+                        moments = _merge_second_moments(moments, part)
+                    group = []
+            if group:
+                for part in pool.map(_block_second_moments, group):
+                    moments = _merge_second_moments(moments, part)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        count, mean, m2 = moments
+        if count == 0:
+            raise ValueError("Can't fit ZCA to an empty design matrix.")
+        assert dtype in ['float32', 'float64']
+        self.mean_ = numpy.cast[dtype](mean)
+        covariance = numpy.cast[theano.config.floatX](m2 / count)
+        t2 = time.time()
+        log.info("cov estimate of {0} rows took {1} seconds".format(
+            count, t2 - t1))
+
+        self._fit_covariance(covariance)
+
+    def _fit_covariance(self, covariance):
+        """
+        Computes `self.P_` (and `self.inv_P_`) from the covariance of
+        the centered data.
+
+        Parameters
+        ----------
+        covariance : ndarray
+            The covariance matrix of the data, without the filter bias.
+        """
+        bias = self.filter_bias * scipy.sparse.identity(covariance.shape[0],
+                                                        theano.config.floatX)
+        covariance = covariance + bias
+
         t1 = time.time()
         eigs, eigv = linalg.eigh(covariance)
         t2 = time.time()
@@ -1459,12 +1940,25 @@ class ZCA(Preprocessor):
 
         X = dataset.get_design_matrix()
         assert X.dtype in ['float32', 'float64']
+        batch_size = getattr(self, 'batch_size', None)
+        if batch_size is not None:
+            _check_in_place(X)
         if not self.has_fit_:
             assert can_fit
-            self.fit(X)
+            if batch_size is None:
+                self.fit(X)
+            else:
+                self.fit_blocks(block for start, block
+                                in _row_blocks(X, batch_size))
 
-        new_X = ZCA._gpu_matrix_dot(X - self.mean_, self.P_)
-        dataset.set_design_matrix(new_X)
+        if batch_size is None:
+            new_X = ZCA._gpu_matrix_dot(X - self.mean_, self.P_)
+            dataset.set_design_matrix(new_X)
+        else:
+            for start, block in _row_blocks(X, batch_size):
+                block -= self.mean_
+                _write_rows(dataset, X, start,
+                            ZCA._gpu_matrix_dot(block, self.P_))
 
     def inverse(self, X):
         """
@@ -3,6 +3,8 @@ import unittest
 from pylearn2.testing.skip import skip_if_no_data
 import numpy as np
 import os
+import tempfile
+from theano.compat.six.moves import cPickle as pickle
 
 
 def test_npy_npz():
@@ -16,3 +18,30 @@ def test_npy_npz():
     assert np.all(npy.X == npz.X)
     os.remove('test.npy')
     os.remove('test.npz')
+
+
+def test_npy_mmap():
+    """Test that a memory-mapped NpyDataset stays on disk."""
+    fd, path = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    try:
+        rng = np.random.RandomState(0)
+        # ('b', 'c', 0, 1) layout, so flattening it doesn't copy
+        topo = rng.uniform(size=(10, 3, 4, 5)).astype('float32')
+        np.save(path, topo)
+        npy = NpyDataset(file=path, mmap_mode='r', axes=('b', 'c', 0, 1))
+        npy._deferred_load()
+        assert isinstance(npy.X, np.memmap)
+        assert np.all(npy.get_topological_view() == topo)
+
+        batches = [batch for batch in npy.iterator(
+            mode='shuffled_sequential', batch_size=3,
+            data_specs=(npy.X_space, 'features'))]
+        assert sum(len(batch) for batch in batches) == 10
+
+        copied = pickle.loads(pickle.dumps(npy))
+        assert isinstance(copied.X, np.memmap)
+        assert np.all(copied.get_topological_view() == topo)
+        del npy, copied, batches
+    finally:
+        os.remove(path)
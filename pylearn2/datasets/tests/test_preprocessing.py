@@ -16,7 +16,11 @@ from pylearn2.datasets.preprocessing import (GlobalContrastNormalization,
                                              ReassembleGridPatches,
                                              LeCunLCN,
                                              RGB_YUV,
-                                             ZCA)
+                                             ZCA,
+                                             Pipeline,
+                                             RemapInterval,
+                                             RemoveMean,
+                                             Standardize)
 
 
 class testGlobalContrastNormalization:
@@ -212,6 +216,27 @@ def test_zca():
     assert is_identity(np.dot(preprocessor.P_, preprocessor.inv_P_))
 
 
+def test_zca_fit_blocks():
+    """
+    Confirm that fitting ZCA on blocks of rows, with or without worker
+    threads, matches fitting it on the whole design matrix.
+    """
+
+    rng = np.random.RandomState([1, 2, 3])
+    X = as_floatX(rng.randn(47, 10) * 3. + 1.)
+    expected = ZCA()
+    expected.fit(X)
+
+    for num_workers in [None, 3]:
+        preprocessor = ZCA()
+        preprocessor.fit_blocks((X[i:i + 10] for i in range(0, 47, 10)),
+                                num_workers=num_workers)
+        assert preprocessor.mean_.dtype == X.dtype
+        assert np.allclose(preprocessor.mean_, expected.mean_, atol=1e-5)
+        assert np.allclose(preprocessor.P_, expected.P_, atol=1e-4)
+        assert np.allclose(preprocessor.inv_P_, expected.inv_P_, atol=1e-4)
+
+
 def test_zca_dtypes():
     """
     Confirm that ZCA.fit works regardless of dtype of data and config.floatX
@@ -228,3 +253,47 @@ def test_zca_dtypes():
                 preprocessor.fit(X)
     finally:
         config.floatX = orig_floatX
+
+
+def test_batched_preprocessing():
+    """
+    Confirm that fitting and applying preprocessors in batches gives the
+    same result as doing it on the whole design matrix, with the batched
+    result written in place.
+    """
+
+    rng = np.random.RandomState([1, 2, 3])
+    X = as_floatX(rng.uniform(-3., 5., size=(23, 6)))
+
+    def make_items(batch_size=None):
+        return [RemoveMean(axis=None, batch_size=batch_size),
+                Standardize(batch_size=batch_size),
+                GlobalContrastNormalization(batch_size=batch_size),
+                RemapInterval([-1., 1.], [0., 1.], batch_size=batch_size)]
+
+    for whole, batched in zip(make_items(), make_items(batch_size=5)):
+        expected = DenseDesignMatrix(X=X.copy())
+        whole.apply(expected, can_fit=True)
+        dataset = DenseDesignMatrix(X=X.copy())
+        design_matrix = dataset.X
+        batched.apply(dataset, can_fit=True)
+        assert dataset.X is design_matrix
+        assert np.allclose(dataset.X, expected.X, atol=1e-5)
+
+    expected = DenseDesignMatrix(X=X.copy())
+    Pipeline(make_items()).apply(expected, can_fit=True)
+    dataset = DenseDesignMatrix(X=X.copy())
+    pipeline = Pipeline(make_items(), batch_size=5)
+    pipeline.apply(dataset, can_fit=True)
+    assert np.allclose(dataset.X, expected.X, atol=1e-5)
+
+    # Once fit, the pipeline can be applied to other data
+    other = DenseDesignMatrix(X=X.copy())
+    pipeline.apply(other)
+    assert np.allclose(other.X, expected.X, atol=1e-5)
+
+    expected = DenseDesignMatrix(X=X.copy())
+    ZCA().apply(expected, can_fit=True)
+    dataset = DenseDesignMatrix(X=X.copy())
+    ZCA(batch_size=5).apply(dataset, can_fit=True)
+    assert np.allclose(dataset.X, expected.X, atol=1e-4)
@@ -3,8 +3,11 @@
 
     WRITEME
 """
+import multiprocessing
+
 import numpy
 import theano
+from theano.compat.six.moves import xrange
 T = theano.tensor
 
 
@@ -48,6 +51,190 @@ def make_lpdf(mu, sigma):
     return theano.function([x], E - Z)
 
 
+def _squared_distances(x, mu, mu_sqnorm):
+    """
+    Squared euclidean distances between the rows of `x` and the rows of
+    `mu`, computed with a single matrix product.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Matrix of points of shape (n, d)
+    mu : numpy.ndarray
+        Matrix of kernel centers of shape (m, d)
+    mu_sqnorm : numpy.ndarray
+        Squared norms of the rows of `mu`
+
+    Returns
+    -------
+    dists : numpy.ndarray
+        Matrix of shape (n, m)
+    """
+    dists = numpy.dot(x, mu.T)
+    dists *= -2
+    dists += numpy.square(x).sum(axis=1)[:, numpy.newaxis]
+    dists += mu_sqnorm
+    numpy.maximum(dists, 0, out=dists)
+    return dists
+
+
+def _block_sizes(num_x, num_mu, memory):
+    """
+    Chooses how many points and kernel centers to tile together so that
+    a block of float64 distances takes at most `memory` bytes.
+    """
+    elements = max(memory // 8, 1)
+    x_block = int(min(num_x, max(numpy.sqrt(elements), 1)))
+    mu_block = int(min(num_mu, max(elements // x_block, 1)))
+    return x_block, mu_block
+
+
+def _block_lls(x, mu, mu_sqnorm, sigmas, mu_block):
+    """
+    Log-likelihoods of the rows of `x` under the Parzen windows estimator
+    centered at `mu`, for each value of `sigmas`.
+
+    The kernel centers are visited `mu_block` rows at a time and the
+    log-sum-exp over them is accumulated as a running maximum and a
+    rescaled sum, so each block of distances is used for all the sigmas.
+
+    Returns
+    -------
+    lls : numpy.ndarray
+        Matrix of shape (len(sigmas), len(x))
+    """
+    x = numpy.asarray(x, dtype='float64')
+    scales = -0.5 / numpy.square(sigmas)
+    maxes = numpy.empty((len(sigmas), len(x)))
+    maxes.fill(-numpy.inf)
+    sums = numpy.zeros((len(sigmas), len(x)))
+    for start in xrange(0, len(mu), mu_block):
+        stop = min(start + mu_block, len(mu))
+        dists = _squared_distances(x, mu[start:stop], mu_sqnorm[start:stop])
+        # The closest center maximizes the kernel for every sigma
+        min_dists = dists.min(axis=1)
+        for i, scale in enumerate(scales):
+            new_max = numpy.maximum(maxes[i], scale * min_dists)
+            a = dists * scale
+            a -= new_max[:, numpy.newaxis]
+            numpy.exp(a, out=a)
+            sums[i] *= numpy.exp(maxes[i] - new_max)
+            sums[i] += a.sum(axis=1)
+            maxes[i] = new_max
+    dim = mu.shape[1]
+    norms = (numpy.log(len(mu)) +
+             dim * numpy.log(numpy.asarray(sigmas) * numpy.sqrt(2 * numpy.pi)))
+    return maxes + numpy.log(sums) - norms[:, numpy.newaxis]
+
+
+# State shared with the worker processes of `parzen_log_likelihoods`,
+# inherited when they are forked
+_worker_args = None
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _worker_block_lls(bounds):
+    x, mu, mu_sqnorm, sigmas, mu_block = _worker_args
+    return _block_lls(x[bounds[0]:bounds[1]], mu, mu_sqnorm, sigmas,
+                      mu_block)
+
+
+def parzen_log_likelihoods(x, samples, sigmas, memory=2 ** 27,
+                           num_workers=None, batch_size=None):
+    """
+    Log-likelihoods of the rows of `x` under Parzen windows estimators
+    (aka kernel density estimators) with normal kernels centered at
+    `samples`.
+
+    Points and samples are tiled in blocks whose squared distances,
+    computed with a matrix product, fit in `memory` bytes. The log of
+    the mean over samples is accumulated block by block, and each block
+    of distances serves all the values of `sigmas`.
+
+    Parameters
+    ----------
+    x : numpy matrix
+        Points to evaluate, of shape (n, d)
+    samples : numpy matrix
+        Kernel centers, of shape (m, d)
+    sigmas : scalar or list of scalars
+        Standard deviations of the kernels
+    memory : int, optional
+        Number of bytes of a block of distances, per process
+    num_workers : int, optional
+        If given, blocks of points are evaluated by this many processes
+    batch_size : int, optional
+        Number of points per block. By default, it is derived from
+        `memory`.
+
+    Returns
+    -------
+    lls : numpy.ndarray
+        Array of shape (n,) if `sigmas` is a scalar, otherwise of shape
+        (len(sigmas), n)
+    """
+    scalar = numpy.isscalar(sigmas)
+    sigmas = numpy.atleast_1d(numpy.asarray(sigmas, dtype='float64'))
+    mu = numpy.asarray(samples, dtype='float64')
+    mu_sqnorm = numpy.square(mu).sum(axis=1)
+    x_block, mu_block = _block_sizes(len(x), len(mu), memory)
+    if batch_size is not None:
+        x_block = batch_size
+        mu_block = int(min(len(mu), max(memory // (8 * x_block), 1)))
+    bounds = [(start, min(start + x_block, len(x)))
+              for start in xrange(0, len(x), x_block)]
+    if num_workers is None or num_workers <= 1 or len(bounds) == 1:
+        lls = [_block_lls(x[start:stop], mu, mu_sqnorm, sigmas, mu_block)
+               for start, stop in bounds]
+    else:
+        pool = multiprocessing.Pool(num_workers, _init_worker,
+                                    (x, mu, mu_sqnorm, sigmas, mu_block))
+        try:
+            lls = pool.map(_worker_block_lls, bounds)
+        finally:
+            pool.terminate()
+    lls = numpy.concatenate(lls, axis=1)
+    if scalar:
+        return lls[0]
+    return lls
+
+
+def cross_validate_sigma(samples, x, sigmas, memory=2 ** 27,
+                         num_workers=None):
+    """
+    Picks the standard deviation of a Parzen windows estimator maximizing
+    the mean log-likelihood of validation points. The distances are
+    computed once for all candidate values.
+
+    Parameters
+    ----------
+    samples : numpy matrix
+        Kernel centers, of shape (m, d)
+    x : numpy matrix
+        Validation points, of shape (n, d)
+    sigmas : list of scalars
+        Candidate standard deviations
+    memory : int, optional
+        See `parzen_log_likelihoods`
+    num_workers : int, optional
+        See `parzen_log_likelihoods`
+
+    Returns
+    -------
+    sigma : float
+        The best standard deviation
+    mean_lls : numpy.ndarray
+        Mean log-likelihood of `x` for each value of `sigmas`
+    """
+    mean_lls = parzen_log_likelihoods(x, samples, list(sigmas), memory,
+                                      num_workers).mean(axis=1)
+    return sigmas[int(numpy.argmax(mean_lls))], mean_lls
+
+
 class ParzenWindows(object):
     """
     .. todo::
@@ -60,30 +247,65 @@ class ParzenWindows(object):
         See description for make_lpdf
     sigma : scalar
         See description for make_lpdf
+    memory : int, optional
+        See description for parzen_log_likelihoods
+    num_workers : int, optional
+        See description for parzen_log_likelihoods
     """
-    def __init__(self, samples, sigma):
+    def __init__(self, samples, sigma, memory=2 ** 27, num_workers=None):
         # just keeping these for debugging/examination, not needed
         self._samples = samples
         self._sigma = sigma
+        self._lpdf = None
 
-        self.lpdf = make_lpdf(samples, sigma)
+        self.memory = memory
+        self.num_workers = num_workers
 
-    def get_ll(self, x, batch_size=10):
+    @property
+    def lpdf(self):
         """
-        Evaluates the log likelihood of a set of datapoints with respect to the
-        probability distribution.
+        Theano function evaluating the log-likelihood of a batch of
+        points, see make_lpdf. Compiled on first use.
+        """
+        if self._lpdf is None:
+            self._lpdf = make_lpdf(self._samples, self._sigma)
+        return self._lpdf
+
+    def get_lls(self, x, batch_size=None):
+        """
+        Evaluates the log likelihood of each of a set of datapoints with
+        respect to the probability distribution.
 
         Parameters
         ----------
         x : numpy matrix
             The set of points for which you want to evaluate the log \
             likelihood.
+        batch_size : int, optional
+            Number of points evaluated at once. By default, it is \
+            derived from `memory`.
+
+        Returns
+        -------
+        lls : numpy.ndarray
+            Log likelihood of each point
         """
-        inds = range(x.shape[0])
-        n_batches = int(numpy.ceil(float(len(inds)) / batch_size))
+        return parzen_log_likelihoods(x, self._samples, self._sigma,
+                                      self.memory, self.num_workers,
+                                      batch_size)
 
-        lls = []
-        for i in range(n_batches):
-            lls.extend(self.lpdf(x[inds[i::n_batches]]))
+    def get_ll(self, x, batch_size=None):
+        """
+        Evaluates the log likelihood of a set of datapoints with respect to the
+        probability distribution.
 
-        return numpy.array(lls).mean()
+        Parameters
+        ----------
+        x : numpy matrix
+            The set of points for which you want to evaluate the log \
+            likelihood.
+        batch_size : int, optional
+            Number of points evaluated at once. By default, it is \
+            derived from `memory`.
+        """
+        return self.get_lls(x, batch_size).mean()
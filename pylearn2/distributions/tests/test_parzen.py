@@ -0,0 +1,29 @@
+"""
+Tests of ../parzen.py
+"""
+import numpy as np
+
+from pylearn2.distributions.parzen import (ParzenWindows, make_lpdf,
+                                           cross_validate_sigma)
+
+
+def test_blocked_ll():
+    """
+    Tests that the blocked evaluator agrees with the Theano lpdf for
+    several block shapes, and that the sigma sweep picks its best sigma.
+    """
+    rng = np.random.RandomState(0)
+    samples = rng.normal(size=(50, 5))
+    x = rng.normal(size=(31, 5))
+    expected = make_lpdf(samples, 0.7)(x)
+
+    for memory in [8 * 7 * 3, 2 ** 27]:
+        pw = ParzenWindows(samples, 0.7, memory=memory)
+        assert np.allclose(pw.get_lls(x), expected)
+    assert np.allclose(ParzenWindows(samples, 0.7).get_ll(x, batch_size=4),
+                       expected.mean())
+
+    sigmas = [0.1, 0.7, 5.]
+    sigma, mean_lls = cross_validate_sigma(samples, x, sigmas)
+    assert np.allclose(mean_lls[1], expected.mean())
+    assert sigma == sigmas[np.argmax(mean_lls)]
@@ -0,0 +1,491 @@
+"""
+Batch inference with trained models.
+
+`Predictor` loads a model, compiles its `fprop` once and streams data
+through it batch by batch, either from NumPy arrays or from any
+`Dataset.iterator`. Outputs can be collected in memory, written to a
+memory-mapped `.npy` file or to an HDF5 file.
+
+`serve` exposes a `Predictor` over a small local HTTP server so that a
+long-lived process can answer prediction requests without paying the
+compilation cost for each of them.
+
+Basic usage:
+
+.. code-block:: none
+
+    python -m pylearn2.inference predict model.pkl dataset.yaml out.npy
+    python -m pylearn2.inference serve model.pkl --port 8000
+"""
+from __future__ import print_function
+
+__authors__ = "pylearn2 developers"
+__license__ = "3-clause BSD"
+
+import argparse
+import io
+import json
+import logging
+
+import numpy as np
+from theano.compat import six
+from theano.compat.six.moves import BaseHTTPServer
+
+from pylearn2.space import CompositeSpace
+from pylearn2.utils import function, serial
+from pylearn2.utils.iteration import PrefetchingIterator
+
+
+log = logging.getLogger(__name__)
+
+tables = None
+
+
+def _ensure_tables():
+    """
+    Makes sure tables module has been imported
+    """
+
+    global tables
+    if tables is None:
+        import tables
+
+
+def _is_hdf5_path(path):
+    """
+    Returns True if `path` names an HDF5 file.
+
+    Parameters
+    ----------
+    path : str
+        File name
+
+    Returns
+    -------
+    is_hdf5 : bool
+        Whether the extension is one of `.h5`, `.hdf5` or `.hdf`
+    """
+    return path.lower().endswith(('.h5', '.hdf5', '.hdf'))
+
+
+def _slice_along(axis, ndim, start, stop):
+    """
+    Returns an index selecting `start:stop` along `axis`.
+
+    Parameters
+    ----------
+    axis : int
+        The axis to slice
+    ndim : int
+        Number of dimensions of the indexed array
+    start : int
+        First index of the slice
+    stop : int
+        One past the last index of the slice
+
+    Returns
+    -------
+    index : tuple
+        A tuple of slices usable to index NumPy arrays and PyTables
+        arrays alike
+    """
+    index = [slice(None)] * ndim
+    index[axis] = slice(start, stop)
+    return tuple(index)
+
+
+class Predictor(object):
+    """
+    Applies a trained model to data in batches.
+
+    The model's `fprop` is compiled once, when the predictor is built,
+    and reused for every batch.
+
+    Parameters
+    ----------
+    model : Model or str
+        The model, or the path of a pickle file that `serial.load` can
+        read.
+    batch_size : int, optional
+        Number of examples propagated at once.
+    transform : callable, optional
+        A function applied to the symbolic output of `fprop` before
+        compilation, e.g. `lambda Y: T.argmax(Y, axis=1)` to return
+        class labels. The transformed output must have its batch axis
+        first.
+    fixed_batch_size : bool, optional
+        If True, the model is told to use `batch_size` through
+        `set_batch_size` and the last, incomplete batch is padded.
+        This is required by models compiled for a single batch size,
+        like those using cuda-convnet. By default, it is enabled if the
+        model already has a `force_batch_size`.
+
+    Notes
+    -----
+    Only models with a single output are supported. Models with a
+    `CompositeSpace` input receive a tuple of arrays for each batch.
+    """
+
+    def __init__(self, model, batch_size=100, transform=None,
+                 fixed_batch_size=None):
+        if isinstance(model, six.string_types):
+            model = serial.load(model)
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer, got " +
+                             str(batch_size))
+        if fixed_batch_size is None:
+            fixed_batch_size = bool(getattr(model, 'force_batch_size',
+                                            False))
+        if fixed_batch_size:
+            model.set_batch_size(batch_size)
+
+        self.model = model
+        self.batch_size = batch_size
+        self.fixed_batch_size = fixed_batch_size
+        self.input_space = model.get_input_space()
+        self.input_source = model.get_input_source()
+        self.data_specs = (self.input_space, self.input_source)
+
+        inputs = self.input_space.make_theano_batch(
+            batch_size=batch_size if fixed_batch_size else None)
+        outputs = model.fprop(inputs)
+        if isinstance(outputs, (list, tuple)):
+            raise ValueError("Predictor only supports models with a single "
+                             "output, but %s.fprop returned %d outputs."
+                             % (type(model).__name__, len(outputs)))
+        if transform is not None:
+            outputs = transform(outputs)
+            self.output_axis = 0
+        else:
+            self.output_axis = model.get_output_space().get_batch_axis()
+        if not isinstance(inputs, tuple):
+            inputs = (inputs,)
+        self._fn = function(list(inputs), outputs, allow_input_downcast=True)
+
+    def _input_axes(self):
+        """
+        Returns the batch axis of each input component.
+        """
+        if isinstance(self.input_space, CompositeSpace):
+            return [space.get_batch_axis()
+                    for space in self.input_space.components]
+        return [self.input_space.get_batch_axis()]
+
+    def predict_batch(self, batch):
+        """
+        Propagates a single batch through the model.
+
+        Parameters
+        ----------
+        batch : ndarray or tuple of ndarrays
+            A batch in the format of the model's input space. It may
+            hold any number of examples up to `batch_size`.
+
+        Returns
+        -------
+        output : ndarray
+            The output of the model for `batch`
+        """
+        if not isinstance(batch, tuple):
+            batch = (batch,)
+        axes = self._input_axes()
+        size = batch[0].shape[axes[0]]
+        if size > self.batch_size and self.fixed_batch_size:
+            raise ValueError("Got a batch of %d examples but the model was "
+                             "compiled for batches of %d." %
+                             (size, self.batch_size))
+        if self.fixed_batch_size and size < self.batch_size:
+            # Repeat the last example to fill the batch.
+            padded = []
+            for value, axis in zip(batch, axes):
+                idx = np.minimum(np.arange(self.batch_size), size - 1)
+                padded.append(np.take(value, idx, axis=axis))
+            batch = tuple(padded)
+        output = self._fn(*batch)
+        if size < output.shape[self.output_axis]:
+            output = output[_slice_along(self.output_axis, output.ndim,
+                                         0, size)]
+        return output
+
+    def predict(self, X):
+        """
+        Propagates arrays of any number of examples through the model,
+        `batch_size` examples at a time.
+
+        Parameters
+        ----------
+        X : ndarray or tuple of ndarrays
+            The data, in the format of the model's input space
+
+        Returns
+        -------
+        output : ndarray
+            The output of the model for all of `X`
+        """
+        if not isinstance(X, tuple):
+            X = (X,)
+        axes = self._input_axes()
+        num_examples = X[0].shape[axes[0]]
+        outputs = []
+        for start in six.moves.xrange(0, num_examples, self.batch_size):
+            stop = min(start + self.batch_size, num_examples)
+            batch = tuple(value[_slice_along(axis, value.ndim, start, stop)]
+                          for value, axis in zip(X, axes))
+            outputs.append(self.predict_batch(batch))
+        return np.concatenate(outputs, axis=self.output_axis)
+
+    def predict_dataset(self, dataset, out=None, prefetch=1,
+                        hdf5_node='outputs'):
+        """
+        Streams a dataset through the model.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            Any dataset providing the model's input source. It is
+            visited once, in sequential order.
+        out : None, str or array-like, optional
+            Where to write the outputs. If None, they are returned in a
+            new array. If a path ending in `.h5`, `.hdf5` or `.hdf`, they
+            are written to an HDF5 file; any other path is opened as a
+            memory-mapped `.npy` file. An existing array of the right
+            shape (including a `numpy.memmap`) is filled in place.
+        prefetch : int, optional
+            Number of batches prepared ahead in a background thread
+            while the model runs. Set to 0 to disable prefetching.
+        hdf5_node : str, optional
+            Name of the array created in the HDF5 file.
+
+        Returns
+        -------
+        out : ndarray or str
+            The filled array, or the path of the HDF5 file.
+        """
+        iterator = dataset.iterator(mode='sequential',
+                                    batch_size=self.batch_size,
+                                    data_specs=self.data_specs)
+        num_examples = iterator.num_examples
+        if prefetch:
+            iterator = PrefetchingIterator(iterator, depth=prefetch)
+
+        h5file = None
+        target = out
+        start = 0
+        try:
+            for batch in iterator:
+                output = self.predict_batch(batch)
+                size = output.shape[self.output_axis]
+                if start == 0:
+                    shape = list(output.shape)
+                    shape[self.output_axis] = num_examples
+                    shape = tuple(shape)
+                    if out is None:
+                        target = np.empty(shape, dtype=output.dtype)
+                    elif isinstance(out, six.string_types):
+                        if _is_hdf5_path(out):
+                            _ensure_tables()
+                            h5file = tables.openFile(out, mode='w')
+                            atom = tables.Atom.from_dtype(output.dtype)
+                            filters = tables.Filters(complib='blosc',
+                                                     complevel=5)
+                            target = h5file.createCArray(
+                                h5file.root, hdf5_node, atom=atom,
+                                shape=shape, filters=filters)
+                        else:
+                            target = np.lib.format.open_memmap(
+                                out, mode='w+', dtype=output.dtype,
+                                shape=shape)
+                    elif tuple(out.shape) != shape:
+                        raise ValueError("Output shape is %r but should be "
+                                         "%r." % (tuple(out.shape), shape))
+                index = _slice_along(self.output_axis, output.ndim,
+                                     start, start + size)
+                target[index] = output
+                start += size
+        finally:
+            if isinstance(iterator, PrefetchingIterator):
+                iterator.close()
+            if h5file is not None:
+                h5file.close()
+
+        if isinstance(target, np.memmap):
+            target.flush()
+        if h5file is not None:
+            return out
+        return target
+
+
+def _make_handler(predictor):
+    """
+    Builds the request handler class used by `serve`.
+
+    Parameters
+    ----------
+    predictor : Predictor
+        The predictor answering the requests
+
+    Returns
+    -------
+    handler : class
+        A `BaseHTTPRequestHandler` subclass bound to `predictor`
+    """
+
+    class PredictionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """
+        Answers `POST /predict` with the model's outputs.
+
+        Requests with a JSON content type carry `{"X": [...]}` and get
+        `{"Y": [...]}` back. Any other request body is read as a `.npy`
+        file and answered with one.
+        """
+
+        def _send(self, code, body, content_type):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, code, obj):
+            self._send(code, json.dumps(obj).encode('utf-8'),
+                       'application/json')
+
+        def do_GET(self):
+            """
+            Describes the served model.
+            """
+            self._send_json(200, {
+                'model': type(predictor.model).__name__,
+                'input_space': str(predictor.input_space),
+                'input_source': str(predictor.input_source),
+                'batch_size': predictor.batch_size})
+
+        def do_POST(self):
+            """
+            Computes predictions for the posted data.
+            """
+            if self.path.rstrip('/') != '/predict':
+                self._send_json(404, {'error': 'unknown path ' + self.path})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            use_json = 'json' in self.headers.get('Content-Type', '')
+            try:
+                if use_json:
+                    X = np.asarray(json.loads(body.decode('utf-8'))['X'])
+                else:
+                    X = np.load(io.BytesIO(body))
+                Y = predictor.predict(X)
+            except Exception as e:
+                log.exception("Prediction request failed")
+                self._send_json(400, {'error': str(e)})
+                return
+            if use_json:
+                self._send_json(200, {'Y': Y.tolist()})
+            else:
+                buf = io.BytesIO()
+                np.save(buf, Y)
+                self._send(200, buf.getvalue(), 'application/octet-stream')
+
+        def log_message(self, format, *args):
+            log.info("%s - " + format, self.address_string(), *args)
+
+    return PredictionHandler
+
+
+def make_server(predictor, host='127.0.0.1', port=8000):
+    """
+    Creates an HTTP server answering prediction requests.
+
+    Parameters
+    ----------
+    predictor : Predictor or str
+        The predictor, or the path of a model pickle to build one from
+    host : str, optional
+        Interface to bind. Defaults to the loopback interface.
+    port : int, optional
+        Port to listen on. 0 picks a free port.
+
+    Returns
+    -------
+    server : BaseHTTPServer.HTTPServer
+        The server. Requests are handled one at a time, so the compiled
+        function is never called concurrently.
+    """
+    if not isinstance(predictor, Predictor):
+        predictor = Predictor(predictor)
+    return BaseHTTPServer.HTTPServer((host, port), _make_handler(predictor))
+
+
+def serve(predictor, host='127.0.0.1', port=8000):
+    """
+    Serves predictions over HTTP until interrupted.
+
+    Parameters
+    ----------
+    predictor : Predictor or str
+        The predictor, or the path of a model pickle to build one from
+    host : str, optional
+        Interface to bind. Defaults to the loopback interface.
+    port : int, optional
+        Port to listen on
+    """
+    server = make_server(predictor, host, port)
+    log.info("Serving predictions on http://%s:%d/predict" %
+             server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Apply a trained model to a dataset or serve its "
+                    "predictions over HTTP.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    predict = subparsers.add_parser('predict',
+                                    help='Write the outputs for a dataset')
+    predict.add_argument('model_filename', help='Pickled model')
+    predict.add_argument('dataset', help='YAML file describing the dataset')
+    predict.add_argument('output_filename',
+                         help='Output file (.npy, .h5 or .hdf5)')
+    predict.add_argument('--prefetch', type=int, default=1,
+                         help='Number of batches to prefetch (0 disables)')
+
+    server = subparsers.add_parser('serve', help='Serve predictions')
+    server.add_argument('model_filename', help='Pickled model')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8000)
+
+    for sub in (predict, server):
+        sub.add_argument('--batch_size', '-b', type=int, default=100)
+        sub.add_argument('--argmax', action='store_true',
+                         help='Return the index of the largest output')
+    return parser
+
+
+if __name__ == '__main__':
+    from pylearn2.config import yaml_parse
+    from theano import tensor as T
+
+    logging.basicConfig(level=logging.INFO)
+    args = make_argument_parser().parse_args()
+    transform = None
+    if args.argmax:
+        transform = lambda Y: T.argmax(Y, axis=1)
+    predictor = Predictor(args.model_filename, batch_size=args.batch_size,
+                          transform=transform)
+    if args.command == 'predict':
+        dataset = yaml_parse.load_path(args.dataset)
+        predictor.predict_dataset(dataset, out=args.output_filename,
+                                  prefetch=args.prefetch)
+    else:
+        serve(predictor, args.host, args.port)
@@ -1,15 +1,16 @@
 """K-means as a postprocessing Block subclass."""
 
 import logging
+from multiprocessing.pool import ThreadPool
 import numpy
 from theano.compat.six.moves import xrange
 from pylearn2.blocks import Block
 from pylearn2.models.model import Model
 from pylearn2.space import VectorSpace
 from pylearn2.utils import sharedX
-from pylearn2.utils.mem import improve_memory_error_message
 from pylearn2.utils import wraps
 from pylearn2.utils import contains_nan
+from pylearn2.utils.rng import make_np_rng
 import warnings
 
 try:
@@ -18,11 +19,170 @@ except ImportError:
     milk = None
     warnings.warn(""" Install milk ( http://packages.python.org/milk/ )
                     It has a better k-means implementation. Falling back to
-                    our own really slow implementation. """)
+                    our own implementation. """)
 
 logger = logging.getLogger(__name__)
 
 
+def _squared_distances(X, mu, mu_sqnorm):
+    """
+    Squared euclidean distances between the rows of `X` and the rows of
+    `mu`, computed with a single matrix product.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Matrix of samples of shape (n, d)
+    mu : numpy.ndarray
+        Matrix of centroids of shape (k, d)
+    mu_sqnorm : numpy.ndarray
+        Squared norms of the rows of `mu`
+
+    Returns
+    -------
+    dists : numpy.ndarray
+        Matrix of shape (n, k)
+    """
+    dists = numpy.dot(X, mu.T)
+    dists *= -2
+    dists += numpy.square(X).sum(axis=1)[:, numpy.newaxis]
+    dists += mu_sqnorm
+    # cancellation can make distances of nearby points slightly negative
+    numpy.maximum(dists, 0, out=dists)
+    return dists
+
+
+def assign(X, mu, block_size=4096, num_workers=None):
+    """
+    Find the closest centroid of each sample.
+
+    Distances are computed `block_size` samples at a time, so only a
+    `block_size` by `k` distance matrix is allocated per worker.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Matrix of samples of shape (n, d)
+    mu : numpy.ndarray
+        Matrix of centroids of shape (k, d)
+    block_size : int, optional
+        Number of samples per distance block
+    num_workers : int, optional
+        If greater than 1, blocks are processed by a pool of this many
+        threads. NumPy releases the GIL during the matrix products.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Index of the closest centroid of each sample
+    min_dists : numpy.ndarray
+        Squared distance of each sample to its closest centroid
+    """
+    n = X.shape[0]
+    mu_sqnorm = numpy.square(mu).sum(axis=1)
+    labels = numpy.empty(n, dtype='int64')
+    min_dists = numpy.empty(n, dtype=mu.dtype)
+
+    def assign_block(start):
+        stop = min(start + block_size, n)
+        dists = _squared_distances(X[start:stop], mu, mu_sqnorm)
+        labels[start:stop] = dists.argmin(axis=1)
+        min_dists[start:stop] = dists[numpy.arange(stop - start),
+                                      labels[start:stop]]
+
+    starts = xrange(0, n, block_size)
+    if num_workers is not None and num_workers > 1 and n > block_size:
+        pool = ThreadPool(num_workers)
+        try:
+            pool.map(assign_block, starts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for start in starts:
+            assign_block(start)
+    return labels, min_dists
+
+
+def _cluster_sums(X, labels, k, block_size=4096):
+    """
+    Sum and count the samples assigned to each centroid.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Matrix of samples of shape (n, d)
+    labels : numpy.ndarray
+        Index of the centroid of each sample
+    k : int
+        Number of centroids
+    block_size : int, optional
+        Number of samples per block
+
+    Returns
+    -------
+    sums : numpy.ndarray
+        Matrix of shape (k, d)
+    counts : numpy.ndarray
+        Number of samples assigned to each centroid
+    """
+    sums = numpy.zeros((k, X.shape[1]))
+    clusters = numpy.arange(k)
+    for start in xrange(0, X.shape[0], block_size):
+        block_labels = labels[start:start + block_size]
+        one_hot = (block_labels[:, numpy.newaxis] == clusters)
+        sums += numpy.dot(one_hot.T.astype(X.dtype),
+                          X[start:start + block_size])
+    counts = numpy.bincount(labels, minlength=k)
+    return sums, counts
+
+
+def kmeans_plus_plus(X, k, rng, block_size=4096, num_workers=None):
+    """
+    Choose initial centroids with the k-means++ seeding procedure: each
+    new centroid is a sample drawn with probability proportional to its
+    squared distance to the closest centroid chosen so far.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Matrix of samples of shape (n, d)
+    k : int
+        Number of centroids
+    rng : numpy.random.RandomState
+        Random number generator
+    block_size : int, optional
+        Number of samples per distance block
+    num_workers : int, optional
+        Number of threads used for the distance computations
+
+    Returns
+    -------
+    mu : numpy.ndarray
+        Matrix of centroids of shape (k, d)
+    """
+    n = X.shape[0]
+    if n < k:
+        raise ValueError("Cannot choose %i centroids from %i samples"
+                         % (k, n))
+    mu = numpy.empty((k, X.shape[1]), dtype=X.dtype)
+    mu[0] = X[rng.randint(n)]
+    _, min_dists = assign(X, mu[:1], block_size, num_workers)
+    for i in xrange(1, k):
+        total = min_dists.sum()
+        if total > 0:
+            idx = numpy.searchsorted(numpy.cumsum(min_dists),
+                                     rng.uniform() * total)
+            idx = min(idx, n - 1)
+        else:
+            # all samples coincide with a centroid already
+            idx = rng.randint(n)
+        mu[i] = X[idx]
+        _, dists = assign(X, mu[i:i + 1], block_size, num_workers)
+        numpy.minimum(min_dists, dists, out=min_dists)
+    return mu
+
+
 class KMeans(Block, Model):
     """
     Block that outputs a vector of probabilities that a sample belong
@@ -38,13 +198,31 @@ class KMeans(Block, Model):
         Threshold of distance to clusters under which k-means stops
         iterating.
     max_iter : int, optional
-        Maximum number of iterations. Defaults to infinity.
+        Maximum number of iterations. Defaults to infinity. In mini-batch
+        mode, this is the maximum number of passes over the dataset and
+        defaults to 100.
     verbose : bool
         WRITEME
+    init : str, optional
+        How to choose the initial centroids when none are given to
+        `train_all`: 'k-means++' (default) or 'random' samples.
+    batch_size : int, optional
+        If given, centroids are learned with mini-batch k-means, streaming
+        batches of this size from the dataset's iterator instead of
+        loading its whole design matrix.
+    block_size : int, optional
+        Number of samples for which distances to all centroids are
+        computed at once.
+    num_workers : int, optional
+        Number of threads used to assign samples to centroids.
+    rng : object, optional
+        Random number generator or seed used for initialization and
+        mini-batch ordering.
     """
 
     def __init__(self, k, nvis, convergence_th=1e-6, max_iter=None,
-                 verbose=False):
+                 verbose=False, init='k-means++', batch_size=None,
+                 block_size=4096, num_workers=None, rng=None):
         Block.__init__(self)
         Model.__init__(self)
 
@@ -61,6 +239,46 @@ class KMeans(Block, Model):
             self.max_iter = float('inf')
 
         self.verbose = verbose
+        if init not in ['k-means++', 'random']:
+            raise ValueError("KMeans init: init should be 'k-means++' or "
+                             "'random', got %r" % (init,))
+        self.init = init
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.num_workers = num_workers
+        self.rng = make_np_rng(rng, [2013, 2, 22],
+                               which_method=['randint', 'uniform'])
+
+    def _init_mu(self, X, mu=None):
+        """
+        Returns a copy of the given initial centroids, or chooses them
+        among the samples of `X`.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Matrix of samples of shape (n, d)
+        mu : numpy.ndarray, optional
+            Initial centroids
+        """
+        k = self.k
+        if mu is not None:
+            if not len(mu) == k:
+                raise Exception("You gave %i clusters"
+                                ", but k=%i were expected"
+                                % (len(mu), k))
+            return numpy.array(mu, dtype=X.dtype)
+        if self.init == 'random':
+            indices = self.rng.randint(X.shape[0], size=k)
+            return X[indices].copy()
+        return kmeans_plus_plus(X, k, self.rng, self.block_size,
+                                self.num_workers)
+
+    def _assign(self, X, mu):
+        """
+        Runs `assign` with this model's block size and number of workers.
+        """
+        return assign(X, mu, self.block_size, self.num_workers)
 
     def train_all(self, dataset, mu=None):
         """
@@ -79,37 +297,24 @@ class KMeans(Block, Model):
 
         # TODO-- why does this sometimes return X and sometimes return nothing?
 
+        if self.batch_size is not None:
+            mu = self._train_mini_batch(dataset, mu)
+            self.mu = sharedX(mu)
+            self._params = [self.mu]
+            return
+
         X = dataset.get_design_matrix()
 
         n, m = X.shape
         k = self.k
 
-        if milk is not None:
+        if milk is not None and mu is None:
             # use the milk implementation of k-means if it's available
             cluster_ids, mu = milk.kmeans(X, k)
         else:
-            # our own implementation
-
-            # taking random inputs as initial clusters if user does not provide
-            # them.
-            if mu is not None:
-                if not len(mu) == k:
-                    raise Exception("You gave %i clusters"
-                                    ", but k=%i were expected"
-                                    % (len(mu), k))
-            else:
-                indices = numpy.random.randint(X.shape[0], size=k)
-                mu = X[indices]
-
-            try:
-                dists = numpy.zeros((n, k))
-            except MemoryError as e:
-                improve_memory_error_message(e, "dying trying to allocate "
-                                                "dists matrix for {0} "
-                                                "examples and {1} "
-                                                "means".format(n, k))
-
-            old_kills = {}
+            # our own implementation, which never holds more than
+            # block_size x k distances per worker in memory
+            mu = self._init_mu(X, mu)
 
             iter = 0
             mmd = prev_mmd = float('inf')
@@ -117,21 +322,15 @@ class KMeans(Block, Model):
                 if self.verbose:
                     logger.info('kmeans iter {0}'.format(iter))
 
-                # print 'iter:',iter,' conv crit:',abs(mmd-prev_mmd)
-                # if numpy.sum(numpy.isnan(mu)) > 0:
                 if contains_nan(mu):
                     logger.info('nan found')
                     return X
 
-                # computing distances
-                for i in xrange(k):
-                    dists[:, i] = numpy.square((X - mu[i, :])).sum(axis=1)
+                labels, min_dists = self._assign(X, mu)
 
                 if iter > 0:
                     prev_mmd = mmd
 
-                min_dists = dists.min(axis=1)
-
                 # mean minimum distance:
                 mmd = min_dists.mean()
 
@@ -142,57 +341,102 @@ class KMeans(Block, Model):
                     # converged
                     break
 
-                # finding minimum distances
-                min_dist_inds = dists.argmin(axis=1)
-
                 # computing means
-                i = 0
-                blacklist = []
-                new_kills = {}
-                while i < k:
-                    b = min_dist_inds == i
-                    if not numpy.any(b):
-                        killed_on_prev_iter = True
-                        # initializes empty cluster to be the mean of the d
-                        # data points farthest from their corresponding means
-                        if i in old_kills:
-                            d = old_kills[i] - 1
-                            if d == 0:
-                                d = 50
-                            new_kills[i] = d
-                        else:
-                            d = 5
-                        mu[i, :] = 0
-                        for j in xrange(d):
-                            idx = numpy.argmax(min_dists)
-                            min_dists[idx] = 0
-                            # chose point idx
-                            mu[i, :] += X[idx, :]
-                            blacklist.append(idx)
-                        mu[i, :] /= float(d)
-                        # cluster i was empty, reset it to d far out data
-                        # points recomputing distances for this cluster
-                        dists[:, i] = numpy.square((X - mu[i, :])).sum(axis=1)
-                        min_dists = dists.min(axis=1)
-                        for idx in blacklist:
-                            min_dists[idx] = 0
-                        min_dist_inds = dists.argmin(axis=1)
-                        # done
-                        i += 1
-                    else:
-                        mu[i, :] = numpy.mean(X[b, :], axis=0)
-                        if contains_nan(mu):
-                            logger.info('nan found at {0}'.format(i))
-                            return X
-                        i += 1
-
-                old_kills = new_kills
+                sums, counts = _cluster_sums(X, labels, k, self.block_size)
+                nonempty = counts > 0
+                mu[nonempty] = sums[nonempty] / counts[nonempty, numpy.newaxis]
+
+                # empty clusters are reset to the data points farthest
+                # from their corresponding means
+                empty = numpy.where(~nonempty)[0]
+                if len(empty) > 0:
+                    far = numpy.argsort(min_dists)[::-1][:len(empty)]
+                    mu[empty[:len(far)]] = X[far]
 
                 iter += 1
 
         self.mu = sharedX(mu)
         self._params = [self.mu]
 
+    def _train_mini_batch(self, dataset, mu=None):
+        """
+        Mini-batch k-means: centroids are moved towards the samples of
+        each batch with a per-centroid learning rate of one over the
+        number of samples assigned to it so far.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            Dataset providing an iterator over 'features'
+        mu : numpy.ndarray, optional
+            Initial centroids
+
+        Returns
+        -------
+        mu : numpy.ndarray
+            Learned centroids
+        """
+        k = self.k
+        data_specs = (self.input_space, 'features')
+        max_iter = self.max_iter
+        if max_iter == float('inf'):
+            max_iter = 100
+
+        def batches():
+            return dataset.iterator(mode='shuffled_sequential',
+                                    batch_size=self.batch_size,
+                                    data_specs=data_specs,
+                                    rng=self.rng)
+
+        # initial centroids are chosen among the first few batches
+        init_batches = []
+        num_init = 0
+        for X in batches():
+            init_batches.append(X)
+            num_init += X.shape[0]
+            if num_init >= 3 * max(k, self.batch_size):
+                break
+        mu = self._init_mu(numpy.concatenate(init_batches), mu)
+        mu = mu.astype('float64')
+        del init_batches
+
+        counts = numpy.zeros(k)
+        clusters = numpy.arange(k)
+        iter = 0
+        mmd = prev_mmd = float('inf')
+        while True:
+            if self.verbose:
+                logger.info('kmeans epoch {0}'.format(iter))
+
+            total_dist = 0.
+            num_examples = 0
+            for X in batches():
+                labels, min_dists = self._assign(X, mu)
+                total_dist += min_dists.sum()
+                num_examples += X.shape[0]
+
+                one_hot = (labels[:, numpy.newaxis] == clusters)
+                batch_counts = one_hot.sum(axis=0)
+                batch_sums = numpy.dot(one_hot.T.astype(X.dtype), X)
+                counts += batch_counts
+                updated = batch_counts > 0
+                mu[updated] += ((batch_sums[updated] -
+                                 batch_counts[updated, numpy.newaxis] *
+                                 mu[updated]) /
+                                counts[updated, numpy.newaxis])
+
+            if contains_nan(mu):
+                raise ValueError("nan found in mini-batch k-means centroids")
+
+            prev_mmd = mmd
+            mmd = total_dist / num_examples
+            logger.info('cost: {0}'.format(mmd))
+            iter += 1
+            if iter >= max_iter or abs(mmd - prev_mmd) < self.convergence_th:
+                break
+
+        return mu
+
     @wraps(Model.continue_learning)
     def continue_learning(self):
         # One call to train_all currently trains the model fully,
@@ -226,12 +470,10 @@ class KMeans(Block, Model):
         -------
         WRITEME
         """
-        n, m = X.shape
-        k = self.k
         mu = self.mu
-        dists = numpy.zeros((n, k))
-        for i in xrange(k):
-            dists[:, i] = numpy.square((X - mu[i, :])).sum(axis=1)
+        if hasattr(mu, 'get_value'):
+            mu = mu.get_value()
+        dists = _squared_distances(X, mu, numpy.square(mu).sum(axis=1))
         return dists / dists.sum(axis=1).reshape(-1, 1)
 
     def get_weights(self):
@@ -4727,6 +4727,268 @@ def geometric_mean_prediction(forward_props):
     return T.nnet.softmax(average)
 
 
+def _numpy_softmax(x):
+    """
+    Row-wise softmax of a numpy matrix.
+    """
+    e = np.exp(x - x.max(axis=1)[:, np.newaxis])
+    return e / e.sum(axis=1)[:, np.newaxis]
+
+
+class DropoutEnsemble(object):
+    """
+    Computes the geometric mean prediction of an MLP with softmax outputs
+    over many dropout masks with a single compiled forward pass.
+
+    `sampled_dropout_average` and `exhaustive_dropout_average` build one
+    forward graph per mask, so graph size and compilation time grow with
+    the number of masks. Here the masks are inputs of one compiled
+    function, called for each mask and batch of examples, and the
+    pre-softmax activations are averaged in numpy as the masks go by.
+
+    Parameters
+    ----------
+    mlp : object
+        An MLP object.
+    masked_input_layers : list, optional
+        A list of layer names whose input should be masked.
+        Default is all layers (including the first hidden
+        layer, i.e. mask the input).
+    default_input_scale : float, optional
+        The amount to scale input in dropped out layers.
+    input_scales : dict, optional
+        A dictionary  mapping layer names to constants by
+        which to scale the input.
+    """
+    def __init__(self, mlp, masked_input_layers=None,
+                 default_input_scale=2., input_scales=None):
+        if masked_input_layers is None:
+            masked_input_layers = mlp.layer_names
+        mlp._validate_layer_names(masked_input_layers)
+
+        if input_scales is None:
+            input_scales = {}
+        mlp._validate_layer_names(input_scales.keys())
+
+        if any(key not in masked_input_layers for key in input_scales):
+            not_in = [key for key in input_scales
+                      if key not in masked_input_layers]
+            raise ValueError(", ".join(not_in) + " in input_scales"
+                             " but not masked")
+
+        self.mlp = mlp
+        self.masked_layers = [layer for layer in mlp.layers
+                              if layer.layer_name in masked_input_layers]
+        self.default_input_scale = default_input_scale
+        self.input_scales = input_scales
+        self._fns = {}
+
+    def _get_fn(self, per_example):
+        """
+        Compiles the function mapping a batch of examples and one mask
+        per masked layer to the pre-softmax activations of the MLP.
+
+        The masks are shaped like a batch of one example, and broadcast
+        over the batch, unless `per_example` is True.
+        """
+        if per_example in self._fns:
+            return self._fns[per_example]
+
+        state = self.mlp.get_input_space().make_theano_batch()
+        inputs = [state]
+        for layer in self.mlp.layers:
+            if layer in self.masked_layers:
+                shape = layer.get_input_space().get_origin_batch(
+                    2 if per_example else 1).shape
+                mask = T.TensorType(config.floatX,
+                                    [dim == 1 for dim in shape])()
+                inputs.append(mask)
+                scale = self.input_scales.get(layer.layer_name,
+                                              self.default_input_scale)
+                if layer.dropout_input_mask_value == 0:
+                    state = state * mask * scale
+                else:
+                    state = T.switch(mask, state * scale,
+                                     layer.dropout_input_mask_value)
+            state = layer.fprop(state)
+
+        assert isinstance(state.owner.op, T.nnet.Softmax)
+        assert len(state.owner.inputs) == 1
+        fn = function(inputs, state.owner.inputs[0],
+                      name='DropoutEnsemble.presoftmax')
+        self._fns[per_example] = fn
+        return fn
+
+    def _batch_axis(self):
+        """
+        Returns the batch axis of numeric batches of the MLP's input space.
+        """
+        space = self.mlp.get_input_space()
+        return space.axes.index('b') if hasattr(space, 'axes') else 0
+
+    def _batches(self, X, batch_size):
+        """
+        Yields `(start, stop, batch)` for consecutive batches of at most
+        `batch_size` examples of `X`, a numeric batch of the MLP's input
+        space.
+        """
+        axis = self._batch_axis()
+        num_examples = X.shape[axis]
+        for start in xrange(0, num_examples, batch_size):
+            stop = min(start + batch_size, num_examples)
+            index = [slice(None)] * X.ndim
+            index[axis] = slice(start, stop)
+            yield start, stop, X[tuple(index)]
+
+    def _sample_masks(self, rng, batch_size, default_input_include_prob,
+                      input_include_probs):
+        """
+        Draws one mask per masked layer, for a batch of `batch_size`
+        examples.
+        """
+        masks = []
+        for layer in self.masked_layers:
+            p = input_include_probs.get(layer.layer_name,
+                                        default_input_include_prob)
+            shape = layer.get_input_space().get_origin_batch(batch_size).shape
+            masks.append(np.asarray(rng.uniform(size=shape) < p,
+                                    dtype=config.floatX))
+        return masks
+
+    def predict(self, X, masks, batch_size=100):
+        """
+        Geometric mean prediction over the given dropout masks.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            A numeric batch of the MLP's input space, which is
+            processed `batch_size` examples at a time.
+        masks : iterable
+            Each element is a list with one array per masked layer,
+            shaped like a batch of one example of the layer's input
+            space, whose nonzero entries are kept. Consumed once.
+        batch_size : int, optional
+            Number of examples propagated at once.
+
+        Returns
+        -------
+        geo_mean : numpy.ndarray
+            Matrix of the predicted class probabilities.
+        """
+        fn = self._get_fn(per_example=False)
+        total = None
+        num_masks = 0
+        for mask in masks:
+            for start, stop, batch in self._batches(X, batch_size):
+                presoftmax = fn(batch, *mask)
+                if total is None:
+                    total = np.zeros((X.shape[self._batch_axis()],
+                                      presoftmax.shape[1]))
+                total[start:stop] += presoftmax
+            num_masks += 1
+        if num_masks == 0:
+            raise ValueError("No dropout masks given.")
+        return _numpy_softmax(total / num_masks)
+
+    def sampled_predict(self, X, num_masks, default_input_include_prob=0.5,
+                        input_include_probs=None, rng=(2013, 5, 17),
+                        per_example=False, batch_size=100):
+        """
+        Geometric mean prediction over randomly sampled dropout masks.
+
+        With all layers masked, the masks are the same as those drawn by
+        `sampled_dropout_average` from the same `rng`.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            A numeric batch of the MLP's input space.
+        num_masks : int
+            The number of masks to sample.
+        default_input_include_prob : float, optional
+            The probability of including an input to a masked layer, for
+            layers not listed in `input_include_probs`.
+        input_include_probs : dict, optional
+            A dictionary  mapping layer names to probabilities
+            of input inclusion for that layer.
+        rng : RandomState object or seed, optional
+            A `numpy.random.RandomState` object or a seed used to
+            create one.
+        per_example : bool, optional
+            If `True`, draw different masks for every example.
+        batch_size : int, optional
+            Number of examples propagated at once.
+
+        Returns
+        -------
+        geo_mean : numpy.ndarray
+            Matrix of the predicted class probabilities.
+        """
+        if input_include_probs is None:
+            input_include_probs = {}
+        self.mlp._validate_layer_names(list(input_include_probs.keys()))
+        if not hasattr(rng, 'uniform'):
+            rng = np.random.RandomState(rng)
+
+        if not per_example:
+            masks = (self._sample_masks(rng, 1, default_input_include_prob,
+                                        input_include_probs)
+                     for _ in xrange(num_masks))
+            return self.predict(X, masks, batch_size)
+
+        fn = self._get_fn(per_example=True)
+        outputs = []
+        for start, stop, batch in self._batches(X, batch_size):
+            total = 0.
+            for _ in xrange(num_masks):
+                mask = self._sample_masks(rng, stop - start,
+                                          default_input_include_prob,
+                                          input_include_probs)
+                total = total + fn(batch, *mask)
+            outputs.append(_numpy_softmax(total / num_masks))
+        return np.concatenate(outputs)
+
+    def exhaustive_predict(self, X, batch_size=100):
+        """
+        Geometric mean prediction over all the dropout masks of the
+        masked layers, as `exhaustive_dropout_average`.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            A numeric batch of the MLP's input space.
+        batch_size : int, optional
+            Number of examples propagated at once.
+
+        Returns
+        -------
+        geo_mean : numpy.ndarray
+            Matrix of the predicted class probabilities.
+
+        Notes
+        -----
+        This is still exponential in the size of the network, but
+        compiles a single forward pass.
+        """
+        def masks():
+            num_inputs = sum(layer.get_input_space().get_total_dimension()
+                             for layer in self.masked_layers)
+            for remaining_mask in xrange(2 ** num_inputs):
+                mask = []
+                for layer in self.masked_layers:
+                    space = layer.get_input_space()
+                    n_inputs = space.get_total_dimension()
+                    bits = [(remaining_mask >> i) & 1
+                            for i in xrange(n_inputs)]
+                    remaining_mask >>= n_inputs
+                    mask.append(np.asarray(bits, dtype=config.floatX).reshape(
+                        space.get_origin_batch(1).shape))
+                yield mask
+
+        return self.predict(X, masks(), batch_size)
+
+
 class BadInputSpaceError(TypeError):
 
     """
@@ -52,7 +52,9 @@ except ImportError:
 
 # Local imports
 from pylearn2.blocks import Block
+from pylearn2.space import CompositeSpace, VectorSpace
 from pylearn2.utils import sharedX
+from pylearn2.utils.rng import make_np_rng
 
 
 logger = logging.getLogger()
@@ -126,6 +128,40 @@ class _PCABase(Block):
         # Compute eigen{values,vectors} of the covariance matrix.
         v, W = self._cov_eigen(X)
 
+        self._set_components(v, W, mean)
+
+    def train_dataset(self, dataset, batch_size=None):
+        """
+        Compute the PCA transformation matrix from the examples of a
+        dataset.
+
+        This loads the whole design matrix and calls `train`; solvers
+        which can stream over the dataset's iterator instead override it.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            Dataset providing the design matrix
+        batch_size : int, optional
+            Number of examples per batch, for solvers which stream
+        """
+        self.train(dataset.get_design_matrix())
+
+    def _set_components(self, v, W, mean):
+        """
+        Store the eigen{values,vectors} and the mean as shared variables,
+        keeping only the components selected by `num_components` and
+        `min_variance`.
+
+        Parameters
+        ----------
+        v : numpy.ndarray
+            Eigenvalues in decreasing order
+        W : numpy.ndarray
+            Matrix containing corresponding eigenvectors in its columns
+        mean : numpy.ndarray
+            Feature means of shape (d,)
+        """
         # Build Theano shared variables
         # For the moment, I do not use borrow=True because W and v are
         # subtensors, and I want the original memory to be freed
@@ -412,6 +448,345 @@ class OnlinePCA(_PCABase):
         return v[::-1], W.T[:, ::-1]
 
 
+def _row_blocks(X, batch_size):
+    """
+    Returns a function which yields consecutive blocks of at most
+    `batch_size` rows of the design matrix `X`.
+    """
+    def blocks():
+        for i in xrange(0, X.shape[0], batch_size):
+            yield X[i:i + batch_size]
+    return blocks
+
+
+def _dataset_blocks(dataset, batch_size):
+    """
+    Returns a function which yields the batches of features of
+    `dataset`, flattened to design matrices, in order, and the number of
+    features.
+    """
+    space, source = dataset.get_data_specs()
+    if isinstance(space, CompositeSpace):
+        space = space.components[source.index('features')]
+    dim = space.get_total_dimension()
+    data_specs = (VectorSpace(dim), 'features')
+
+    def blocks():
+        return dataset.iterator(mode='sequential', batch_size=batch_size,
+                                data_specs=data_specs)
+    return blocks, dim
+
+
+def _cov_product(blocks, Q, mean=None):
+    """
+    Multiply the covariance matrix of the rows yielded by `blocks` with
+    `Q`, in one pass and without forming the covariance matrix.
+
+    Parameters
+    ----------
+    blocks : callable
+        Returns an iterable over blocks of rows of the design matrix
+    Q : numpy.ndarray
+        Matrix of shape (d, l)
+    mean : numpy.ndarray, optional
+        Feature means. If None, they are computed in the same pass.
+
+    Returns
+    -------
+    count : int
+        Number of rows
+    mean : numpy.ndarray
+        Feature means
+    CQ : numpy.ndarray
+        Product of the covariance matrix with `Q`, of shape (d, l)
+    """
+    count = 0
+    total = numpy.zeros(Q.shape[0])
+    CQ = numpy.zeros(Q.shape)
+    for block in blocks():
+        block = numpy.asarray(block, dtype='float64')
+        count += block.shape[0]
+        if mean is None:
+            total += block.sum(axis=0)
+        CQ += numpy.dot(block.T, numpy.dot(block, Q))
+    if count == 0:
+        raise ValueError("Cannot compute PCA of an empty dataset.")
+    if mean is None:
+        mean = total / count
+    # sum of (x - mean)(x - mean)^T Q == sum of x x^T Q - n mean mean^T Q
+    CQ -= count * numpy.outer(mean, numpy.dot(mean, Q))
+    CQ /= count
+    return count, mean, CQ
+
+
+class RandomizedPCA(_PCABase):
+    """
+    PCA with a randomized truncated eigendecomposition of the covariance
+    matrix [1].
+
+    The covariance matrix is never formed: a random subspace of dimension
+    `num_components + oversampling` is refined with `n_iter` power
+    iterations, each of which is one pass over the data, so memory scales
+    with the number of components rather than with the square of the
+    dimension. `train_dataset` streams over the dataset's iterator.
+
+    Parameters
+    ----------
+    oversampling : int, optional
+        Number of extra dimensions of the random subspace
+    n_iter : int, optional
+        Number of power iterations
+    batch_size : int, optional
+        Number of rows processed at a time
+    rng : object, optional
+        Random number generator or seed for the random subspace
+    kwargs : dict
+        Passed on to the superclass
+
+    References
+    ----------
+    .. [1] Halko, N., Martinsson, P. G. and Tropp, J. A. (2011). Finding
+       structure with randomness: probabilistic algorithms for
+       constructing approximate matrix decompositions.
+    """
+
+    def __init__(self, oversampling=10, n_iter=4, batch_size=1000, rng=None,
+                 **kwargs):
+        super(RandomizedPCA, self).__init__(**kwargs)
+        self.oversampling = oversampling
+        self.n_iter = n_iter
+        self.batch_size = batch_size
+        self.rng = make_np_rng(rng, [2014, 11, 3], which_method='normal')
+
+    def train(self, X, mean=None):
+        """
+        Compute the PCA transformation matrix.
+
+        If mean is provided, :math:`X` is considered centered around it;
+        in any case :math:`X` is not copied.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Matrix of shape (n, d) on which to train PCA
+        mean : numpy.ndarray, optional
+            Feature means of shape (d,)
+        """
+        if self.num_components is None:
+            self.num_components = X.shape[1]
+        v, W, mean = self._randomized_eigen(_row_blocks(X, self.batch_size),
+                                            X.shape[1], mean)
+        self._set_components(v, W, mean)
+
+    def train_dataset(self, dataset, batch_size=None):
+        """
+        Compute the PCA transformation matrix by streaming over the
+        examples of a dataset.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            Dataset whose iterator provides the 'features' source
+        batch_size : int, optional
+            Number of examples per batch. Defaults to `self.batch_size`.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        blocks, dim = _dataset_blocks(dataset, batch_size)
+        if self.num_components is None:
+            self.num_components = dim
+        v, W, mean = self._randomized_eigen(blocks, dim)
+        self._set_components(v, W, mean)
+
+    def _randomized_eigen(self, blocks, dim, mean=None):
+        """
+        Compute the leading eigen{values,vectors} of the covariance matrix
+        of the rows yielded by `blocks`.
+
+        Parameters
+        ----------
+        blocks : callable
+            Returns an iterable over blocks of rows of the design matrix
+        dim : int
+            Number of features
+        mean : numpy.ndarray, optional
+            Feature means. If None, they are computed in the first pass.
+
+        Returns
+        -------
+        v : numpy.ndarray
+            Eigenvalues in decreasing order
+        W : numpy.ndarray
+            Matrix containing corresponding eigenvectors in its columns
+        mean : numpy.ndarray
+            Feature means
+        """
+        rank = min(self.num_components + self.oversampling, dim)
+        Q = self.rng.normal(size=(dim, rank))
+        for i in xrange(self.n_iter + 1):
+            Q, _ = linalg.qr(Q, mode='economic')
+            _, mean, Q = _cov_product(blocks, Q, mean)
+
+        # Rayleigh-Ritz projection on the range of Q
+        Q, _ = linalg.qr(Q, mode='economic')
+        _, _, CQ = _cov_product(blocks, Q, mean)
+        B = numpy.dot(Q.T, CQ)
+        v, U = linalg.eigh((B + B.T) / 2.)
+        v, U = v[::-1], U[:, ::-1]
+        k = min(self.num_components, len(v))
+        return v[:k], numpy.dot(Q, U[:, :k]), mean
+
+    def _cov_eigen(self, X):
+        """
+        Compute covariance matrix eigen{values,vectors} of the centered
+        matrix `X` with the randomized solver.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Centered matrix of shape (n, d)
+
+        Returns
+        -------
+        All eigenvalues in decreasing order matrix containing corresponding
+        eigenvectors in its columns
+        """
+        v, W, _ = self._randomized_eigen(_row_blocks(X, self.batch_size),
+                                         X.shape[1], numpy.zeros(X.shape[1]))
+        return v, W
+
+
+class IncrementalPCA(_PCABase):
+    """
+    PCA with an incremental SVD over blocks of rows [1].
+
+    A rank `num_components` SVD of the centered data seen so far is
+    updated with each block of `batch_size` rows, so only one pass over
+    the data is made and memory scales with `num_components + batch_size`
+    times the dimension. `train_dataset` streams over the dataset's
+    iterator. The truncation makes the result approximate unless the
+    variance beyond the leading components is small; `RandomizedPCA` is
+    more accurate at the cost of more passes.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Number of rows per block
+    kwargs : dict
+        Passed on to the superclass
+
+    References
+    ----------
+    .. [1] Ross, D. A., Lim, J., Lin, R.-S. and Yang, M.-H. (2008).
+       Incremental learning for robust visual tracking.
+    """
+
+    def __init__(self, batch_size=1000, **kwargs):
+        super(IncrementalPCA, self).__init__(**kwargs)
+        self.batch_size = batch_size
+
+    def train(self, X, mean=None):
+        """
+        Compute the PCA transformation matrix.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Matrix of shape (n, d) on which to train PCA
+        mean : numpy.ndarray, optional
+            Ignored; the mean is always estimated along with the
+            components.
+        """
+        if self.num_components is None:
+            self.num_components = X.shape[1]
+        v, W, mean = self._incremental_svd(_row_blocks(X, self.batch_size))
+        self._set_components(v, W, mean)
+
+    def train_dataset(self, dataset, batch_size=None):
+        """
+        Compute the PCA transformation matrix in one pass over the
+        examples of a dataset.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            Dataset whose iterator provides the 'features' source
+        batch_size : int, optional
+            Number of examples per batch. Defaults to `self.batch_size`.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        blocks, dim = _dataset_blocks(dataset, batch_size)
+        if self.num_components is None:
+            self.num_components = dim
+        v, W, mean = self._incremental_svd(blocks)
+        self._set_components(v, W, mean)
+
+    def _incremental_svd(self, blocks):
+        """
+        Compute the leading eigen{values,vectors} of the covariance matrix
+        of the rows yielded by `blocks`, in one pass.
+
+        Parameters
+        ----------
+        blocks : callable
+            Returns an iterable over blocks of rows of the design matrix
+
+        Returns
+        -------
+        v : numpy.ndarray
+            Eigenvalues in decreasing order
+        W : numpy.ndarray
+            Matrix containing corresponding eigenvectors in its columns
+        mean : numpy.ndarray
+            Feature means
+        """
+        k = self.num_components
+        count = 0
+        mean = S = Vh = None
+        for block in blocks():
+            block = numpy.asarray(block, dtype='float64')
+            n = block.shape[0]
+            if n == 0:
+                continue
+            block_mean = block.mean(axis=0)
+            if count == 0:
+                M = block - block_mean
+                mean = block_mean
+            else:
+                # the last row accounts for the shift of the mean
+                shift = numpy.sqrt(count * n / float(count + n)) * \
+                    (mean - block_mean)
+                M = numpy.vstack((S[:, numpy.newaxis] * Vh,
+                                  block - block_mean,
+                                  shift))
+                mean = mean + (block_mean - mean) * (n / float(count + n))
+            count += n
+            _, S, Vh = linalg.svd(M, full_matrices=False)
+            S, Vh = S[:k], Vh[:k]
+        if count == 0:
+            raise ValueError("Cannot compute PCA of an empty dataset.")
+        return S ** 2 / count, Vh.T, mean
+
+    def _cov_eigen(self, X):
+        """
+        Compute covariance matrix eigen{values,vectors} of the centered
+        matrix `X` with incremental SVD.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Centered matrix of shape (n, d)
+
+        Returns
+        -------
+        All eigenvalues in decreasing order matrix containing corresponding
+        eigenvectors in its columns
+        """
+        v, W, _ = self._incremental_svd(_row_blocks(X, self.batch_size))
+        return v, W
+
+
 class Cov:
     """
     Covariance estimator
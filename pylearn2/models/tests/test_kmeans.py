@@ -5,7 +5,7 @@ Tests of ../kmeans.py
 import numpy as np
 
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
-from pylearn2.models.kmeans import KMeans
+from pylearn2.models.kmeans import KMeans, assign
 from pylearn2.train import Train
 
 
@@ -26,3 +26,24 @@ def test_kmeans():
 
     train = Train(model=model, dataset=dataset)
     train.main_loop()
+
+
+def test_kmeans_mini_batch():
+    """
+    Tests that full-batch and mini-batch k-means find well separated
+    clusters.
+    """
+
+    rng = np.random.RandomState(0)
+    centers = rng.randn(4, 10) * 10
+    X = np.concatenate([c + rng.randn(50, 10) for c in centers])
+
+    dataset = DenseDesignMatrix(X)
+
+    for batch_size in [None, 20]:
+        model = KMeans(k=4, nvis=10, batch_size=batch_size, block_size=30,
+                       num_workers=2)
+        model.train_all(dataset)
+        mu = model.get_weights().get_value()
+        labels, _ = assign(centers, mu)
+        assert np.array_equal(np.sort(labels), np.arange(4))
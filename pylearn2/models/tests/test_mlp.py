@@ -17,7 +17,7 @@ from pylearn2.train import Train
 from pylearn2.models.mlp import (FlattenerLayer, MLP, Linear, Softmax, Sigmoid,
                                  exhaustive_dropout_average,
                                  sampled_dropout_average, CompositeLayer,
-                                 mean_pool)
+                                 mean_pool, DropoutEnsemble)
 from pylearn2.space import VectorSpace, CompositeSpace, Conv2DSpace
 from pylearn2.utils import is_iterable, sharedX
 from pylearn2.expr.nnet import pseudoinverse_softmax_numpy
@@ -98,6 +98,33 @@ def test_exhaustive_dropout_average():
                              inp, ['h0'], 2., {'h5': 3.})
 
 
+def test_dropout_ensemble():
+    inp = theano.tensor.matrix()
+    mlp = MLP(nvis=2, layers=[Linear(2, 'h0', irange=0.8),
+                              Linear(2, 'h1', irange=0.8),
+                              Softmax(3, 'out', irange=0.8)])
+    X = np.random.RandomState(0).uniform(size=(7, 2)).astype(config.floatX)
+    ensemble = DropoutEnsemble(mlp)
+
+    f = theano.function([inp], exhaustive_dropout_average(mlp, inp))
+    np.testing.assert_allclose(ensemble.exhaustive_predict(X, batch_size=3),
+                               f(X), rtol=1e-5)
+
+    f = theano.function([inp], sampled_dropout_average(mlp, inp, 5,
+                                                       rng=(1, 2)))
+    np.testing.assert_allclose(ensemble.sampled_predict(X, 5, rng=(1, 2)),
+                               f(X), rtol=1e-5)
+
+    out = ensemble.sampled_predict(X, 4, per_example=True, batch_size=3)
+    np.testing.assert_allclose(out.sum(axis=1), 1., rtol=1e-5)
+
+    ensemble = DropoutEnsemble(mlp, ['h1'], input_scales={'h1': 3.})
+    f = theano.function([inp], exhaustive_dropout_average(
+        mlp, inp, ['h1'], input_scales={'h1': 3.}))
+    np.testing.assert_allclose(ensemble.exhaustive_predict(X), f(X),
+                               rtol=1e-5)
+
+
 def test_dropout_input_mask_value():
     # Construct a dirt-simple linear network with identity weights.
     mlp = MLP(nvis=2, layers=[IdentityLayer(2, 'h0', irange=0)])
@@ -0,0 +1,40 @@
+"""
+Tests of ../pca.py
+"""
+
+import numpy as np
+
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.models.pca import CovEigPCA, RandomizedPCA, IncrementalPCA
+
+
+def _low_rank_data(rng):
+    """Returns data with a dominant 3-dimensional subspace."""
+    basis = rng.normal(size=(3, 20)) * np.array([[10.], [5.], [2.]])
+    return (np.dot(rng.normal(size=(500, 3)), basis) +
+            0.01 * rng.normal(size=(500, 20)) + 3.).astype('float32')
+
+
+def test_streaming_pca():
+    """
+    Tests that RandomizedPCA and IncrementalPCA recover the leading
+    eigenvalues found by CovEigPCA, both from a design matrix and by
+    streaming over a dataset.
+    """
+    rng = np.random.RandomState(0)
+    X = _low_rank_data(rng)
+    dataset = DenseDesignMatrix(X=X)
+
+    exact = CovEigPCA(num_components=3)
+    exact.train(X)
+    expected = exact.v.get_value()
+
+    for cls in [RandomizedPCA, IncrementalPCA]:
+        for fit in ['train', 'train_dataset']:
+            pca = cls(num_components=3, batch_size=64)
+            if fit == 'train':
+                pca.train(X)
+            else:
+                pca.train_dataset(dataset)
+            actual = pca.v.get_value()
+            assert np.allclose(actual, expected, rtol=1e-2), (cls, fit)
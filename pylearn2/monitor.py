@@ -14,6 +14,7 @@ import time
 import warnings
 import logging
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from theano.compat import six
 
 from pylearn2.compat import OrderedDict
@@ -25,9 +26,10 @@ from theano.printing import var_descriptor
 from pylearn2.config import yaml_parse
 from pylearn2.datasets.dataset import Dataset
 from pylearn2.space import Space, CompositeSpace, NullSpace
-from pylearn2.utils import function, sharedX, safe_zip, safe_izip
+from pylearn2.utils import sharedX, safe_zip, safe_izip
+from pylearn2.utils.compile import cached_function
 from pylearn2.utils.exc import reraise_as
-from pylearn2.utils.iteration import is_stochastic
+from pylearn2.utils.iteration import is_stochastic, has_uniform_batch_size
 from pylearn2.utils.data_specs import DataSpecsMapping
 from pylearn2.utils.string_utils import number_aware_alphabetical_key
 from pylearn2.utils.timing import log_timing
@@ -78,6 +80,12 @@ class Monitor(object):
         self.t0 = time.time()
         self.theano_function_mode = None
         self.on_channel_conflict = 'error'
+        self.num_workers = None
+        self._subset_batches = None
+        self._full_every = None
+        self._subset_seed = None
+        self._subset_iterations = None
+        self._full_requested = False
 
         # Initialize self._nested_data_specs, self._data_specs_mapping,
         # and self._flat_data_specs
@@ -128,6 +136,136 @@ class Monitor(object):
             self._dirty = True
             self.theano_function_mode = mode
 
+    def set_num_workers(self, num_workers):
+        """
+        Sets the number of threads used to evaluate the monitoring
+        datasets concurrently.
+
+        Parameters
+        ----------
+        num_workers : int or None
+            If None or 1, the datasets are evaluated one after the
+            other. Otherwise, up to `num_workers` datasets are
+            evaluated at the same time.
+
+        Notes
+        -----
+        Each monitoring dataset has its own compiled accum function,
+        which only updates the channels of that dataset, so the channel
+        values are the same as with serial evaluation. Datasets are
+        still evaluated serially when some channels have prereqs, since
+        prereqs may share state across datasets.
+        """
+        if num_workers is not None and num_workers < 1:
+            raise ValueError("num_workers must be a positive integer, got " +
+                             str(num_workers))
+        self.num_workers = num_workers
+
+    def set_schedule(self, subset_batches, full_every=None,
+                     seed=(2015, 3, 17)):
+        """
+        Makes the monitor compute cheap estimates of the channels on a
+        fixed random subset of each monitoring dataset, and the exact
+        values only from time to time.
+
+        Parameters
+        ----------
+        subset_batches : int or None
+            The number of batches drawn from each monitoring dataset for
+            the estimate. The same examples are used every time. If
+            None, every call to the monitor is a full evaluation.
+        full_every : int, optional
+            Do a full evaluation every `full_every` epochs (including
+            epoch 0). If not specified, full evaluations only happen on
+            demand, through `request_full_evaluation` or
+            `__call__(full=True)`.
+        seed : int, list or tuple, optional
+            The seed used to pick the subset.
+
+        Notes
+        -----
+        The `estimate_record` of each channel tells whether each value
+        in `val_record` is a 'full' evaluation or a 'subset' estimate.
+        """
+        if subset_batches is not None and subset_batches < 1:
+            raise ValueError("subset_batches must be a positive integer, "
+                             "got " + str(subset_batches))
+        if full_every is not None and full_every < 1:
+            raise ValueError("full_every must be a positive integer, got " +
+                             str(full_every))
+        self._subset_batches = subset_batches
+        self._full_every = full_every
+        self._subset_seed = seed
+        self._subset_iterations = None
+
+    def request_full_evaluation(self):
+        """
+        Makes the next call to the monitor do a full evaluation, whatever
+        the schedule set by `set_schedule`.
+        """
+        self._full_requested = True
+
+    def _is_full_evaluation(self):
+        """
+        Returns True if the monitor should do a full evaluation at this
+        point of the schedule.
+        """
+        if getattr(self, '_subset_batches', None) is None:
+            return True
+        if self._full_requested:
+            return True
+        if self._full_every is not None and \
+           self._epochs_seen % self._full_every == 0:
+            return True
+        return False
+
+    def _subset_iteration(self, index):
+        """
+        Returns the iteration parameters used to estimate the channels
+        of a monitoring dataset on its fixed random subset.
+
+        Parameters
+        ----------
+        index : int
+            The index of the dataset in `self._datasets`.
+
+        Returns
+        -------
+        mode, batch_size, num_batches, seed, num_examples : tuple
+            The arguments to pass to `Dataset.iterator` and the number
+            of examples the resulting iterator visits.
+        """
+        d = self._datasets[index]
+        if has_uniform_batch_size(self._iteration_mode[index]):
+            mode = 'even_shuffled_sequential'
+        else:
+            mode = 'shuffled_sequential'
+        batch_size = self._full_batch_size[index]
+        num_batches = min(self._subset_batches,
+                          int(self._full_num_batches[index]))
+        it = d.iterator(mode=mode,
+                        batch_size=batch_size,
+                        num_batches=num_batches,
+                        data_specs=self._flat_data_specs,
+                        return_tuple=True,
+                        rng=self._subset_seed)
+        num_examples = np.cast[config.floatX](float(it.num_examples))
+        return mode, batch_size, num_batches, self._subset_seed, num_examples
+
+    def _compute_subset_iterations(self):
+        """
+        Computes the `_subset_iteration` parameters of every monitoring
+        dataset once, rather than building an iterator on every call to
+        the monitor. Called by `redo_theano`, or by the first subset
+        estimate after `set_schedule`.
+        """
+        if getattr(self, '_subset_batches', None) is None:
+            self._subset_iterations = None
+        else:
+            self._subset_iterations = [self._subset_iteration(index)
+                                       for index in
+                                       range(len(self._datasets))]
+
     def add_dataset(self, dataset, mode='sequential', batch_size=None,
                     num_batches=None, seed=None):
         """
@@ -206,10 +344,17 @@ class Monitor(object):
                 self._num_batches.append(n)
                 self._rng_seed.append(sd)
 
-    def __call__(self):
+    def __call__(self, full=None):
         """
         Runs the model on the monitoring dataset in order to add one
         data point to each of the channels.
+
+        Parameters
+        ----------
+        full : bool, optional
+            Whether to do a full evaluation or to estimate the channels on
+            the subset defined by `set_schedule`. By default, follows the
+            schedule.
         """
 
         # If the channels have changed at all, we need to recompile the theano
@@ -218,53 +363,44 @@ class Monitor(object):
             self.redo_theano()
 
         datasets = self._datasets
+        if full is None:
+            full = self._is_full_evaluation()
+        self._full_requested = False
+        estimate = 'full' if full else 'subset'
 
         # Set all channels' val_shared to 0
         self.begin_record_entry()
-        for d, i, b, n, a, sd, ne in safe_izip(datasets,
-                                               self._iteration_mode,
-                                               self._batch_size,
-                                               self._num_batches,
-                                               self.accum,
-                                               self._rng_seed,
-                                               self.num_examples):
-            if isinstance(d, six.string_types):
-                d = yaml_parse.load(d)
-                raise NotImplementedError()
-
-            # need to put d back into self._datasets
-            myiterator = d.iterator(mode=i,
-                                    batch_size=b,
-                                    num_batches=n,
-                                    data_specs=self._flat_data_specs,
-                                    return_tuple=True,
-                                    rng=sd)
-
-            # If self._flat_data_specs is empty, no channel needs data,
-            # so we do not need to call the iterator in order to average
-            # the monitored values across different batches, we only
-            # have to call them once.
-            if len(self._flat_data_specs[1]) == 0:
-                X = ()
-                self.run_prereqs(X, d)
-                a(*X)
-
-            else:
-                actual_ne = 0
-                for X in myiterator:
-                    # X is a flat (not nested) tuple
-                    self.run_prereqs(X, d)
-                    a(*X)
-                    actual_ne += self._flat_data_specs[0].np_batch_size(X)
-                # end for X
-                if actual_ne != ne:
-                    raise RuntimeError("At compile time, your iterator said "
-                                       "it had %d examples total, but at "
-                                       "runtime it gave us %d." %
-                                       (ne, actual_ne))
-        # end for d
+        args = list(safe_izip(datasets,
+                              self._iteration_mode,
+                              self._batch_size,
+                              self._num_batches,
+                              self.accum,
+                              self._rng_seed,
+                              self.num_examples))
+        if not full and getattr(self, '_subset_iterations', None) is None:
+            self._compute_subset_iterations()
+        for index, arg in enumerate(args):
+            if not full:
+                mode, b, n, sd, ne = self._subset_iterations[index]
+                arg = (arg[0], mode, b, n, arg[4], sd, ne)
+                args[index] = arg
+            self._num_examples_shared[index].set_value(arg[6])
+        num_workers = getattr(self, 'num_workers', None)
+        if num_workers is not None and num_workers > 1 and \
+           len(args) > 1 and not self.prereqs:
+            pool = ThreadPool(min(num_workers, len(args)))
+            try:
+                pool.map(lambda arg: self._accumulate(*arg), args)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for arg in args:
+                self._accumulate(*arg)
 
         log.info("Monitoring step:")
+        if not full:
+            log.info("\t(estimated on a subset of the monitoring data)")
         log.info("\tEpochs seen: %d" % self._epochs_seen)
         log.info("\tBatches seen: %d" % self._num_batches_seen)
         log.info("\tExamples seen: %d" % self._examples_seen)
@@ -276,6 +412,7 @@ class Monitor(object):
             channel.batch_record.append(self._num_batches_seen)
             channel.example_record.append(self._examples_seen)
             channel.epoch_record.append(self._epochs_seen)
+            channel.estimate_record.append(estimate)
             val = channel.val_shared.get_value()
             channel.val_record.append(val)
             # TODO: use logging infrastructure so that user can configure
@@ -287,6 +424,63 @@ class Monitor(object):
 
             log.info("\t%s: %s" % (channel_name, val_str))
 
+    def _accumulate(self, d, i, b, n, a, sd, ne):
+        """
+        Runs the accum function `a` over all the monitoring batches of
+        dataset `d`.
+
+        Parameters
+        ----------
+        d : Dataset
+            The monitoring dataset
+        i : str or class
+            The iteration mode
+        b : int
+            The batch size
+        n : int
+            The number of batches
+        a : theano function
+            The accum function of this dataset
+        sd : int, list or tuple
+            The seed for stochastic iteration modes
+        ne : int
+            The number of examples the iterator announced at compile time
+        """
+        if isinstance(d, six.string_types):
+            d = yaml_parse.load(d)
+            raise NotImplementedError()
+
+        # need to put d back into self._datasets
+        myiterator = d.iterator(mode=i,
+                                batch_size=b,
+                                num_batches=n,
+                                data_specs=self._flat_data_specs,
+                                return_tuple=True,
+                                rng=sd)
+
+        # If self._flat_data_specs is empty, no channel needs data,
+        # so we do not need to call the iterator in order to average
+        # the monitored values across different batches, we only
+        # have to call them once.
+        if len(self._flat_data_specs[1]) == 0:
+            X = ()
+            self.run_prereqs(X, d)
+            a(*X)
+
+        else:
+            actual_ne = 0
+            for X in myiterator:
+                # X is a flat (not nested) tuple
+                self.run_prereqs(X, d)
+                a(*X)
+                actual_ne += self._flat_data_specs[0].np_batch_size(X)
+            # end for X
+            if actual_ne != ne:
+                raise RuntimeError("At compile time, your iterator said "
+                                   "it had %d examples total, but at "
+                                   "runtime it gave us %d." %
+                                   (ne, actual_ne))
+
     def run_prereqs(self, data, dataset):
         """
         Runs all "prerequistie functions" on a batch of data. Always
@@ -348,6 +542,10 @@ class Monitor(object):
         Call this whenever the model has learned on another batch of
         examples. Report how many examples were learned on.
 
+        A batch is counted per parameter update: when the gradients of
+        several minibatches are accumulated before being applied, call
+        this once per update with the total number of examples.
+
         Parameters
         ----------
         num_examples : int
@@ -399,7 +597,7 @@ class Monitor(object):
         for channel in self.channels.values():
             updates[channel.val_shared] = np.cast[config.floatX](0.0)
         with log_timing(log, "compiling begin_record_entry"):
-            self.begin_record_entry = function(
+            self.begin_record_entry = cached_function(
                 inputs=[],
                 updates=updates,
                 mode=self.theano_function_mode,
@@ -440,13 +638,20 @@ class Monitor(object):
                                  return_tuple=True))
         self.num_examples = [np.cast[config.floatX](float(i.num_examples))
                              for i in it]
+        self._full_batch_size = [i.batch_size for i in it]
+        self._full_num_batches = [i.num_batches for i in it]
+        self._compute_subset_iterations()
+        # The number of examples each accum function averages over is
+        # shared, so that the same functions can compute either the
+        # full channel values or their estimates on a subset.
+        self._num_examples_shared = [sharedX(ne) for ne in self.num_examples]
         givens = [OrderedDict() for d in self._datasets]
         updates = [OrderedDict() for d in self._datasets]
         for i, channel in enumerate(self.channels.values()):
             index = self._datasets.index(channel.dataset)
             d = self._datasets[index]
             g = givens[index]
-            cur_num_examples = self.num_examples[index]
+            cur_num_examples = self._num_examples_shared[index]
             u = updates[index]
 
             # Flatten channel.graph_input and the appropriate part of
@@ -510,11 +715,12 @@ class Monitor(object):
                 # monitor the model parameters, or some shared variable updated
                 # by the training algorithm, so we need to ignore the unused
                 # input error
-                self.accum.append(function(theano_args,
-                                           givens=g,
-                                           updates=u,
-                                           mode=self.theano_function_mode,
-                                           name=function_name))
+                self.accum.append(cached_function(
+                    theano_args,
+                    givens=g,
+                    updates=u,
+                    mode=self.theano_function_mode,
+                    name=function_name))
             for a in self.accum:
                 if mode is not None and hasattr(mode, 'record'):
                     for elem in a.maker.fgraph.outputs:
@@ -1025,6 +1231,9 @@ class MonitorChannel(object):
             self.example_record = old_channel.example_record[:-1]
             self.epoch_record = old_channel.epoch_record[:-1]
             self.time_record = old_channel.time_record[:-1]
+            # Whether each value is a 'full' evaluation or a 'subset'
+            # estimate.
+            self.estimate_record = old_channel.estimate_record[:-1]
         else:
             # Value of the desired quantity at measurement time.
             self.val_record = []
@@ -1035,6 +1244,9 @@ class MonitorChannel(object):
             self.example_record = []
             self.epoch_record = []
             self.time_record = []
+            # Whether each value is a 'full' evaluation or a 'subset'
+            # estimate.
+            self.estimate_record = []
 
     def __str__(self):
         """
@@ -1111,6 +1323,7 @@ class MonitorChannel(object):
             'batch_record': self.batch_record,
             'time_record': self.time_record,
             'epoch_record': self.epoch_record,
+            'estimate_record': self.estimate_record,
             'val_record': self.val_record
         }
 
@@ -1134,6 +1347,9 @@ class MonitorChannel(object):
             self.epoch_record = range(len(self.val_record))
         if 'time_record' not in d:
             self.time_record = [None] * len(self.val_record)
+        # Patch old pickle files that predate subset estimates
+        if 'estimate_record' not in d:
+            self.estimate_record = ['full'] * len(self.val_record)
 
 
 def push_monitor(model, name, transfer_experience=False,
@@ -13,7 +13,9 @@ import argparse
 import copy
 import logging
 import gzip
+import multiprocessing
 import numpy as np
+import os
 from os import listdir
 from os import path
 import random
@@ -25,6 +27,10 @@ import warnings
 logging.basicConfig(format="[%(levelname)s]:%(message)s")
 logger = logging.getLogger(__name__)
 
+# Bump this when the layout of the column caches written by parse_columns
+# changes, so that stale caches are re-parsed.
+COLUMNS_CACHE_VERSION = 1
+
 def parse_bim_line(line):
     """
     Parse a bim line.
@@ -106,7 +112,7 @@ def write_haps_line(SNP_name, entry, omit_info=False, info_only=False):
     else:
         line = ""
     if not info_only:
-        line += " ".join(entry["raw_values"])
+        line += " ".join(str(v) for v in entry["raw_values"])
     return line
 
 def parse_tped_line(line):
@@ -289,23 +295,312 @@ def parse_labels_file(label_file):
 
     return labels
 
-def parse_file(file_name):
+def _read_lines(file_name, open_method):
     """
-    Read a file into a dictionary.
-    Extensions are .bim, .haps, .tped, or .gen
-    Keys are SNP names, entries depend on the filetype.
+    Reads the non-empty lines of a file in one go.
+
+    Returns
+    -------
+    lines: list of str
+    line_numbers: array-like
+        The line number of each non-empty line.
+    """
+    with open_method(file_name, "r") as f:
+        lines = f.read().splitlines()
+    line_numbers = np.array([i for i, line in enumerate(lines)
+                             if line.strip()], dtype=np.int64)
+    lines = [lines[i] for i in line_numbers]
+    return lines, line_numbers
+
+def _split_fields(lines, num_fields, ext):
+    """
+    Splits the first num_fields fields of each line from the subject data
+    that follows.
+
+    Returns
+    -------
+    columns: list of tuples
+        One tuple of str per leading field.
+    rest: list of str
+        The unsplit subject data of each line.
+    """
+    fields = [line.split(None, num_fields) for line in lines]
+    for i, elems in enumerate(fields):
+        if len(elems) < num_fields:
+            raise ValueError("Could not parse %s line \"%s\" (too few fields)"
+                             % (ext, lines[i]))
+        if len(elems) == num_fields:
+            elems.append("")
+    if len(fields) == 0:
+        return [()] * num_fields, []
+    columns = list(zip(*fields))
+    return columns[:num_fields], list(columns[num_fields])
+
+def _parse_int_block(rest, ext, dtype=np.int8):
+    """
+    Parses the whitespace separated integer subject data of every line at
+    once into an array with one row per line.
+    """
+    values = np.fromstring(" ".join(rest), dtype=dtype, sep=" ")
+    if len(rest) == 0 or values.size % len(rest) != 0:
+        raise ValueError("Could not parse %s subject data (%d values for %d "
+                         "lines)" % (ext, values.size, len(rest)))
+    values = values.reshape((len(rest), -1))
+    # With single spaces between single characters, every line has
+    # 2 * width - 1 characters. A line of that length can't hold more than
+    # width values, so if all lines have it and the total is right, every
+    # line holds exactly width values. Otherwise each line is counted.
+    width = values.shape[1]
+    lengths = np.array([len(r) for r in rest], dtype=np.int64)
+    if (np.any(lengths != 2 * width - 1) and
+            any(len(r.split()) != width for r in rest)):
+        raise ValueError("Could not parse %s subject data (inconsistent line "
+                         "lengths)" % ext)
+    return values
+
+def _check_alleles(alleles, ext):
+    """
+    Checks that every allele is one of T, C, A or G.
+    """
+    valid = np.zeros(alleles.shape, dtype=bool)
+    for allele in "TCAG":
+        valid |= alleles == allele
+    if not np.all(valid):
+        raise ValueError("Could not parse %s file (allele not in TCAG)" % ext)
+
+def _snp_array(columns, line_numbers):
+    """
+    Makes a structured array of per-SNP fields.
+
+    Parameters
+    ----------
+    columns: list of (str, array-like) pairs
+        Field names and values.
+    line_numbers: array-like
+    """
+    columns = columns + [("line_number", line_numbers)]
+    columns = [(name, np.asarray(values)) for name, values in columns]
+    dtype = [(name, values.dtype) for name, values in columns]
+    snps = np.empty(len(line_numbers), dtype=dtype)
+    for name, values in columns:
+        snps[name] = values
+    return snps
+
+def parse_bim_columns(lines, line_numbers):
+    """
+    Parse the lines of a bim file in bulk.
+    Format should be: chromosome SNP_name 0 location allele_1 allele_2.
+    allele_1 != allele_2.
+
+    Returns
+    -------
+    columns: dict
+        SNP array with name, chromosome, location, allele_1 and allele_2
+        fields.
+    """
+    (chromosome, name, zero, location, allele_1, allele_2), rest =\
+        _split_fields(lines, 6, "bim")
+    try:
+        assert all(r == "" for r in rest), "Too many fields"
+        assert np.all(np.array(zero, dtype=np.int64) == 0),\
+            "Third index is not 0"
+        allele_1 = np.array(allele_1)
+        allele_2 = np.array(allele_2)
+        assert np.all(allele_1 != allele_2), "Allele 1 and 2 are equal."
+        _check_alleles(allele_1, "bim")
+        _check_alleles(allele_2, "bim")
+        snps = _snp_array([("name", np.array(name)),
+                           ("chromosome",
+                            np.array(chromosome, dtype=np.int64)),
+                           ("location", np.array(location, dtype=np.int64)),
+                           ("allele_1", allele_1),
+                           ("allele_2", allele_2)], line_numbers)
+    except AssertionError as e:
+        raise ValueError("Could not parse bim file (%s)" % e)
+    return {"snps": snps}
+
+def parse_haps_columns(lines, line_numbers):
+    """
+    Parse the lines of a haps file in bulk.
+    Format should be: chromosome SNP_name location minor(index)
+    major(index) + subject data. Subject data are pairs 00->0, 01->1, 10->1,
+    11->2
+
+    Returns
+    -------
+    columns: dict
+        SNP array with name, chromosome, location, minor and major fields,
+        "raw_values" with the haplotypes and "values" with their sums, both
+        with one row per SNP.
+    """
+    (chromosome, name, location, minor, major), rest =\
+        _split_fields(lines, 5, "haps")
+    try:
+        raw_values = _parse_int_block(rest, "haps")
+        assert raw_values.shape[1] % 2 == 0, "Line length error"
+        assert np.all((raw_values == 0) | (raw_values == 1)), "Value error"
+        minor = np.array(minor, dtype=np.int8)
+        major = np.array(major, dtype=np.int8)
+        assert np.all(((minor == 1) & (major == 2)) |
+                      ((minor == 2) & (major == 1))), "Minor major error"
+        snps = _snp_array([("name", np.array(name)),
+                           ("chromosome",
+                            np.array(chromosome, dtype=np.int64)),
+                           ("location", np.array(location, dtype=np.int64)),
+                           ("minor", minor),
+                           ("major", major)], line_numbers)
+    except AssertionError as e:
+        raise ValueError("Could not parse haps file (%s)" % e)
+    values = raw_values[:, ::2] + raw_values[:, 1::2]
+    return {"snps": snps, "values": values, "raw_values": raw_values}
+
+def parse_tped_columns(lines, line_numbers):
+    """
+    Parse the lines of a tped file in bulk.
+    Line format should be: chromosome SNP_name 0 location + subject data.
+    Subject data should be pairs in "TCAG".
+
+    Returns
+    -------
+    columns: dict
+        SNP array with name, chromosome and location fields, and "values"
+        with the alleles of each subject, two columns per subject.
+    """
+    (chromosome, name, zero, location), rest = _split_fields(lines, 4, "tped")
+    try:
+        assert np.all(np.array(zero, dtype=np.int64) == 0),\
+            "Third element is not 0"
+        values = np.array(" ".join(rest).split())
+        assert len(rest) > 0 and values.size % len(rest) == 0,\
+            "Line length error"
+        values = values.reshape((len(rest), -1))
+        assert values.shape[1] % 2 == 0, "Line length error"
+        _check_alleles(values, "tped")
+        snps = _snp_array([("name", np.array(name)),
+                           ("chromosome",
+                            np.array(chromosome, dtype=np.int64)),
+                           ("location", np.array(location, dtype=np.int64))],
+                          line_numbers)
+    except AssertionError as e:
+        raise ValueError("Could not parse tped file (%s)" % e)
+    return {"snps": snps, "values": values}
+
+def parse_gen_columns(lines, line_numbers):
+    """
+    Parse the lines of a gen file in bulk.
+    Format should be snp_%d name location minor_allele major_allele +
+    subject data.
+    Subject data is in format binary triples where the number of on bits
+    sums to 1, e.g., 001 or 100.
+
+    Returns
+    -------
+    columns: dict
+        SNP array with name, location, allele_1 and allele_2 fields, and
+        "values" with the index of the on bit of each subject.
+    """
+    (snp, name, location, allele_1, allele_2), rest =\
+        _split_fields(lines, 5, "gen")
+    try:
+        assert all("snp" in s for s in snp), "First element not snp number."
+        triples = _parse_int_block(rest, "gen")
+        assert triples.shape[1] % 3 == 0, "Incorrect line length"
+        triples = triples.reshape((triples.shape[0], -1, 3))
+        assert np.all((triples == 0) | (triples == 1)) and\
+            np.all(triples.sum(axis=2) == 1),\
+            "Line segment value does not add to 1"
+        allele_1 = np.array(allele_1)
+        allele_2 = np.array(allele_2)
+        assert np.all(allele_1 != allele_2), "Alleles are equal."
+        _check_alleles(allele_1, "gen")
+        _check_alleles(allele_2, "gen")
+        snps = _snp_array([("name", np.array(name)),
+                           ("location", np.array(location, dtype=np.int64)),
+                           ("allele_1", allele_1),
+                           ("allele_2", allele_2)], line_numbers)
+    except AssertionError as e:
+        raise ValueError("Could not parse gen file (%s)" % e)
+    values = triples.argmax(axis=2).astype(np.int8)
+    return {"snps": snps, "values": values}
+
+def _columns_cache_path(file_name, cache_dir=None):
+    """
+    Path of the column cache of a SNP file.
+    Caches go in a hidden directory next to the file by default, so they are
+    not picked up by parse_chr_directory.
+    """
+    directory, base_name = path.split(path.abspath(file_name))
+    if cache_dir is None:
+        cache_dir = path.join(directory, ".snp_cache")
+    return path.join(cache_dir, base_name + ".npz")
+
+def _load_columns_cache(cache_file, file_name):
+    """
+    Loads a column cache if it is up to date with file_name, else returns None.
+    """
+    if not path.isfile(cache_file):
+        return None
+    stat = os.stat(file_name)
+    try:
+        cache = np.load(cache_file)
+        try:
+            if (int(cache["version"]) != COLUMNS_CACHE_VERSION or
+                float(cache["mtime"]) != stat.st_mtime or
+                int(cache["size"]) != stat.st_size):
+                return None
+            columns = dict((k, cache[k]) for k in cache.files
+                           if k not in ["version", "mtime", "size"])
+        finally:
+            cache.close()
+    except (IOError, OSError, ValueError, KeyError) as e:
+        logger.warning("Could not read SNP cache %s (%s)" % (cache_file, e))
+        return None
+    columns["ext"] = str(columns["ext"])
+    return columns
+
+def _save_columns_cache(cache_file, file_name, columns):
+    """
+    Saves a column cache for file_name, tagged with its mtime and size.
+    Failing to write the cache is not an error.
+    """
+    stat = os.stat(file_name)
+    tmp_file = "%s.tmp%d" % (cache_file, os.getpid())
+    try:
+        if not path.isdir(path.dirname(cache_file)):
+            os.makedirs(path.dirname(cache_file))
+        with open(tmp_file, "wb") as f:
+            np.savez(f, version=COLUMNS_CACHE_VERSION, mtime=stat.st_mtime,
+                     size=stat.st_size, **columns)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError) as e:
+        logger.warning("Could not write SNP cache %s (%s)" % (cache_file, e))
+
+def parse_columns(file_name, cache=False, cache_dir=None):
+    """
+    Read a SNP file into columns.
+    Extensions are .bim, .haps, .tped, .gen, or .info
+    The whole file is parsed at once into NumPy arrays. Optionally, the
+    result is cached in a .npz file that is reused as long as the file's
+    modification time and size don't change.
 
     Parameters
     ----------
     file_name: str
         Location of file to parse.
+    cache: bool, optional
+        Whether to read and write the .npz cache. Off by default, as the
+        cache is written next to the data unless cache_dir is given.
+    cache_dir: str, optional
+        Directory for the cache. Defaults to .snp_cache next to the file.
 
     Returns
     -------
-    parse_dict: dictionary
-        Dictionary with SNP name keys.
+    columns: dict
+        "ext" with the extension, "snps" with a structured array of the SNP
+        fields (with "name" and "line_number") and, except for bim files,
+        "values" with one row of subject data per SNP.
+        See the parse_*_columns functions.
     """
-    logger.info("Parsing %s" % file_name)
     exts = ["bim", "haps", "tped", "gen", "info"]
     ext = file_name.split(".")[-1]
     if ext == "gzip":
@@ -314,32 +609,169 @@ def parse_file(file_name):
     else:
         open_method = open
 
-    if ext == "ped":
-        return
     if ext not in exts:
         raise NotImplementedError("Extension not supported (%s), must be in %s" % (ext, exts))
 
+    if cache:
+        cache_file = _columns_cache_path(file_name, cache_dir)
+        columns = _load_columns_cache(cache_file, file_name)
+        if columns is not None:
+            logger.info("Loaded %s from cache %s" % (file_name, cache_file))
+            return columns
 
+    logger.info("Parsing %s" % file_name)
     method_dict = {
-        "bim": parse_bim_line,
-        "haps": parse_haps_line,
-        "info": parse_haps_line,
-        "tped": parse_tped_line,
-        "gen": parse_gen_line,
+        "bim": parse_bim_columns,
+        "haps": parse_haps_columns,
+        "info": parse_haps_columns,
+        "tped": parse_tped_columns,
+        "gen": parse_gen_columns,
         }
 
-    parse_dict = {}
-    parse_dict["ext"] = ext
-    with open_method(file_name, "r") as f:
-        for i, line in enumerate(f.readlines()):
-            entry = method_dict[ext](line)
-            entry[1]["line_number"] = i
-            if entry[0] in parse_dict:
-                raise ValueError("Found a duplicate SNP(%s) in .%s file." % (entry[0], ext))
-            parse_dict[entry[0]] = entry[1]
+    lines, line_numbers = _read_lines(file_name, open_method)
+    columns = method_dict[ext](lines, line_numbers)
+    del lines
+
+    names = np.sort(columns["snps"]["name"])
+    duplicates = names[1:][names[1:] == names[:-1]]
+    if duplicates.size > 0:
+        raise ValueError("Found a duplicate SNP(%s) in .%s file."
+                         % (duplicates[0], ext))
+
+    columns["ext"] = ext
+    if cache:
+        _save_columns_cache(cache_file, file_name, columns)
+    return columns
+
+def _columns_to_dict(columns):
+    """
+    Converts the columns from parse_columns to a parse_file dictionary.
+    Subject data entries are views of the column arrays.
+    """
+    ext = columns["ext"]
+    snps = columns["snps"]
+    values = columns.get("values")
+    parse_dict = {"ext": ext}
+    int_fields = ["chromosome", "location", "minor", "major", "line_number"]
+    for i in range(snps.shape[0]):
+        entry = dict((field, int(snps[field][i]) if field in int_fields
+                      else str(snps[field][i]))
+                     for field in snps.dtype.names if field != "name")
+        if ext in ["haps", "info"]:
+            entry["values"] = values[i]
+            entry["raw_values"] = columns["raw_values"][i]
+        elif ext == "tped":
+            entry["values"] = list(zip(values[i, ::2], values[i, 1::2]))
+        elif ext == "gen":
+            entry["values"] = values[i]
+        parse_dict[str(snps["name"][i])] = entry
     return parse_dict
 
-def read_chr_directory(directory):
+def parse_file(file_name, cache=False):
+    """
+    Read a file into a dictionary.
+    Extensions are .bim, .haps, .tped, or .gen
+    Keys are SNP names, entries depend on the filetype.
+    The file is read with parse_columns.
+
+    Parameters
+    ----------
+    file_name: str
+        Location of file to parse.
+    cache: bool, optional
+        Whether to use the .npz cache of parse_columns.
+
+    Returns
+    -------
+    parse_dict: dictionary
+        Dictionary with SNP name keys.
+    """
+    ext = file_name.split(".")[-1]
+    if ext == "gzip":
+        ext = file_name.split(".")[-2]
+    if ext == "ped":
+        return
+    return _columns_to_dict(parse_columns(file_name, cache=cache))
+
+def _snp_rows(columns, names):
+    """
+    Returns the rows of the SNPs called names in parse_columns columns.
+    """
+    snp_names = columns["snps"]["name"]
+    names = np.asarray(names)
+    if names.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(snp_names)
+    if order.size == 0:
+        raise ValueError("SNP %s not found in .%s data"
+                         % (names[0], columns["ext"]))
+    positions = np.searchsorted(snp_names, names, sorter=order)
+    rows = order[np.minimum(positions, order.size - 1)]
+    missing = snp_names[rows] != names
+    if np.any(missing):
+        raise ValueError("SNP %s not found in .%s data"
+                         % (names[missing][0], columns["ext"]))
+    return rows
+
+def _select_snps(columns, rows):
+    """
+    Returns parse_columns columns with only the SNPs of rows, an index or
+    boolean array.
+    """
+    num_snps = columns["snps"].shape[0]
+    return dict((k, v[rows] if isinstance(v, np.ndarray) and v.ndim > 0
+                 and v.shape[0] == num_snps else v)
+                for k, v in columns.items())
+
+def _is_columns(data_dict):
+    """
+    Whether data_dict holds parse_columns columns rather than a
+    parse_file dictionary.
+    """
+    return isinstance(data_dict.get("snps"), np.ndarray)
+
+def _read_chr_columns(directory, file_dict, cache=False):
+    """
+    Reads the files of a chromosome directory into columns.
+    See read_chr_directory.
+    """
+    snp_dict = {"directory": directory}
+    for ext in file_dict:
+        file_name = path.join(directory, file_dict[ext])
+        snp_dict[ext] = parse_columns(file_name, cache=cache)
+
+    if "tped" in snp_dict:
+        tped_names = snp_dict["tped"]["snps"]["name"]
+        for ext in ["haps", "bim"]:
+            names = snp_dict[ext]["snps"]["name"]
+            snp_dict[ext] = _select_snps(snp_dict[ext],
+                                         np.in1d(names, tped_names))
+
+    if "haps" in snp_dict:
+        assert "bim" in snp_dict
+        bim_snps = snp_dict["bim"]["snps"]
+        bim_snps = bim_snps[bim_snps["name"] != "rsdummy"]
+        haps_snps = snp_dict["haps"]["snps"][
+            _snp_rows(snp_dict["haps"], bim_snps["name"])]
+        swap = (haps_snps["minor"] == 2) & (haps_snps["major"] == 1)
+        alleles = [("minor_allele", np.where(swap, bim_snps["allele_2"],
+                                             bim_snps["allele_1"])),
+                   ("major_allele", np.where(swap, bim_snps["allele_1"],
+                                             bim_snps["allele_2"]))]
+        for ext in ["haps", "tped"]:
+            if ext not in snp_dict:
+                continue
+            columns = snp_dict[ext]
+            rows = _snp_rows(columns, bim_snps["name"])
+            for field, values in alleles:
+                column = np.zeros(columns["snps"].shape[0],
+                                  dtype=values.dtype)
+                column[rows] = values
+                columns[field] = column
+
+    return snp_dict
+
+def read_chr_directory(directory, as_columns=False, cache=False):
     """
     Read a directory with SNP data.
     Extras data and other details from SNP files.
@@ -348,6 +780,14 @@ def read_chr_directory(directory):
     ----------
     directory: str
         Path to SNP directory.
+    as_columns: bool, optional
+        If True, each file is kept as the columns of parse_columns, with
+        "minor_allele" and "major_allele" arrays added to the haps and tped
+        columns, instead of one dictionary entry per SNP. The pull_*
+        functions accept either. Directories with a .dat file are always
+        read into dictionaries.
+    cache: bool, optional
+        Whether to use the .npz cache of parse_columns.
 
     Returns
     -------
@@ -357,12 +797,15 @@ def read_chr_directory(directory):
 
     directory = path.abspath(directory)
     file_dict = parse_chr_directory(directory)
+    if as_columns and "dat" not in file_dict:
+        return _read_chr_columns(directory, file_dict, cache=cache)
+
     snp_dict = {"directory": directory}
     for ext in file_dict:
         file_name = path.join(directory, file_dict[ext])
         if ext == "dat":
             continue
-        parse_dict = parse_file(file_name)
+        parse_dict = parse_file(file_name, cache=cache)
         snp_dict[ext] = parse_dict
 
     if "dat" in file_dict:
@@ -596,8 +1039,8 @@ def read_dataset_directory(directory, chromosomes=22,
 def pull_dataset(dataset_dict, chromosomes=22, shuffle=True):
     """
     Pull complete dataset from a dataset directory.
-    TODO: currently concatenates the data. Needs to save each chromosome dataset to a different
-    numpy file instead. Or return lists or dicts of array-likes
+    This holds every chromosome in memory and concatenates cases and controls.
+    See extract_dataset to save each chromosome to its own file instead.
 
     Parameters
     ----------
@@ -653,14 +1096,248 @@ def pull_dataset(dataset_dict, chromosomes=22, shuffle=True):
 
     if shuffle:
         logger.info("Shuffling data")
-        idx = range(len(labels))
-        random.shuffle(idx)
+        idx = np.random.permutation(len(labels))
         labels = [labels[i] for i in idx]
         for key in data_dict:
             data_dict[key] = data_dict[key][idx]
 
     return data_dict, labels
 
+def read_chr_with_references(chr_dir, snps_ref_dir=None, align_ref_dir=None,
+                             nofill=False):
+    """
+    Reads a chromosome directory and sets its SNPs and alignment from
+    reference chromosome directories.
+    This does for a single chromosome what read_dataset_directory does with
+    reference datasets.
+
+    Parameters
+    ----------
+    chr_dir: str
+        Chromosome directory to read.
+    snps_ref_dir: str, optional
+        Chromosome directory to use SNPs from.
+    align_ref_dir: str, optional
+        Chromosome directory to align alleles to.
+    nofill: bool, optional
+        Don't fill SNPs missing from the data with the reference priors.
+
+    Returns
+    -------
+    chr_dict: dict
+        See read_chr_directory.
+    """
+    # Setting SNPs and alignment works on dictionaries, otherwise the data
+    # is pulled straight from the columns.
+    chr_dict = read_chr_directory(
+        chr_dir, as_columns=snps_ref_dir is None and align_ref_dir is None)
+
+    if snps_ref_dir is not None:
+        snps_ref_chr_dict = read_chr_directory(snps_ref_dir)
+        for ext in ["tped", "haps", "cases"]:
+            if ext in snps_ref_chr_dict:
+                snps_ref_chr_dict = snps_ref_chr_dict[ext]
+                break
+        else:
+            raise ValueError()
+        for ext in ["tped", "haps", "cases", "controls"]:
+            if ext not in chr_dict:
+                continue
+            chr_dict[ext] = set_A_with_B(chr_dict[ext], snps_ref_chr_dict,
+                                         nofill=nofill)
+
+    if align_ref_dir is not None:
+        align_ref_chr_dict = read_chr_directory(align_ref_dir)
+        if "controls" in chr_dict:
+            pass
+        elif "tped" in chr_dict:
+            assert "tped" in align_ref_chr_dict
+            chr_dict["tped"] = align_A_to_B(chr_dict["tped"],
+                                            align_ref_chr_dict["tped"])
+        elif "haps" not in chr_dict:
+            raise ValueError()
+
+    return chr_dict
+
+def pull_chromosome(chr_dict, out_file, seed=None):
+    """
+    Pull the data of one chromosome into a .npy file.
+    The file is written through a memory map, with cases and controls put
+    directly in their (shuffled) rows instead of being concatenated.
+
+    Parameters
+    ----------
+    chr_dict: dict
+        See read_chr_directory.
+    out_file: str
+        .npy file to write the data to.
+    seed: int, optional
+        If not None, the rows are shuffled with the permutation of a
+        RandomState with this seed, which is the same for every chromosome
+        with the same number of samples.
+
+    Returns
+    -------
+    counts: list of int
+        Number of controls and cases for gen data, else number of samples.
+    snp_names: list of str
+        The SNP names, in the order of the columns.
+    """
+    if "cases" in chr_dict:
+        cases = chr_dict["cases"]
+        controls = chr_dict["controls"]
+        if not have_same_SNP_order(cases, controls):
+            raise ValueError("Cases and controls have different SNPs.")
+        parts = [pull_gen_data(controls), pull_gen_data(cases)]
+        data_dict = cases
+    else:
+        if "tped" in chr_dict:
+            data_dict = chr_dict["tped"]
+            parts = [pull_tped_data(data_dict)]
+        else:
+            data_dict = chr_dict["haps"]
+            parts = [pull_haps_data(data_dict)]
+    if _is_columns(data_dict):
+        snp_names = sorted(str(name) for name in data_dict["snps"]["name"])
+    else:
+        snp_names = sorted(k for k in data_dict if k != "ext")
+
+    counts = [part.shape[0] for part in parts]
+    num_samples = sum(counts)
+    if len(set(part.shape[1] for part in parts)) != 1:
+        raise ValueError("Cases and controls have difference number of "
+                         "columns.")
+
+    # Row i of the data goes to row rows[i] of the file.
+    if seed is None:
+        rows = np.arange(num_samples)
+    else:
+        rows = np.argsort(np.random.RandomState(seed).permutation(num_samples))
+
+    out = np.lib.format.open_memmap(out_file, mode="w+", dtype=np.int8,
+                                    shape=(num_samples, parts[0].shape[1]))
+    start = 0
+    for part in parts:
+        out[rows[start:start + part.shape[0]]] = part
+        start += part.shape[0]
+    out.flush()
+    del out
+
+    return counts, snp_names
+
+def _extract_chromosome(job):
+    """
+    Reads, pulls and saves one chromosome. Used by extract_dataset.
+    """
+    c, chr_dir, out_dir, snps_ref_dir, align_ref_dir, nofill, seed = job
+    logger.info("Extracting chromosome %d from %s" % (c, chr_dir))
+    chr_dict = read_chr_with_references(chr_dir, snps_ref_dir=snps_ref_dir,
+                                        align_ref_dir=align_ref_dir,
+                                        nofill=nofill)
+    counts, snp_names = pull_chromosome(
+        chr_dict, path.join(out_dir, "chr%d.npy" % c), seed=seed)
+    save_snp_names(path.join(out_dir, "chr%d.snps" % c), snp_names)
+    return c, counts
+
+def extract_dataset(directory, out_dir, chromosomes=22, snps_reference=None,
+                    align_reference=None, nofill=False, shuffle=True,
+                    seed=None, num_workers=None):
+    """
+    Extracts a SNP dataset directory to one .npy file per chromosome.
+    Each chromosome is read, pulled and written on its own, optionally in a
+    pool of processes, so only the chromosomes being processed are in
+    memory. The resulting chr%d.npy files can be memory-mapped by
+    datasets.SNP.MultiChromosome.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to read dataset from.
+    out_dir: str
+        Directory to write chr%d.npy, chr%d.snps and labels.npy to.
+    chromosomes: int, optional
+        Number of chromosomes to process.
+    snps_reference: str, optional
+        Reference dataset directory to use SNPs from.
+    align_reference: str, optional
+        Reference dataset directory to align alleles to.
+    nofill: bool, optional
+        Don't fill SNPs missing from the data with the reference priors.
+    shuffle: bool, optional
+        Shuffle the samples, the same way for every chromosome.
+    seed: int, optional
+        Seed of the shuffling. Random if not given.
+    num_workers: int, optional
+        Number of processes. Chromosomes are processed serially if None.
+
+    Returns
+    -------
+    labels: array-like
+        The labels, also saved in labels.npy.
+    """
+    dir_dict = parse_dataset_directory(directory, chromosomes=chromosomes)
+    ref_dir_dicts = [parse_dataset_directory(reference,
+                                             chromosomes=chromosomes)
+                     if reference is not None else None
+                     for reference in [snps_reference, align_reference]]
+    if shuffle and seed is None:
+        seed = random.randint(0, 2 ** 31 - 1)
+    elif not shuffle:
+        seed = None
+
+    jobs = [(c, dir_dict[c], out_dir) +
+            tuple(d[c] if d is not None else None for d in ref_dir_dicts) +
+            (nofill, seed)
+            for c in range(1, chromosomes + 1)]
+    if num_workers is None or num_workers <= 1:
+        results = [_extract_chromosome(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        try:
+            results = pool.map(_extract_chromosome, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    counts = results[0][1]
+    for c, chr_counts in results:
+        if chr_counts != counts:
+            raise ValueError("Chromosome %d has inconsistent subjects "
+                             "(%s vs %s)" % (c, chr_counts, counts))
+
+    if "labels" in dir_dict:
+        labels = np.array(parse_labels_file(dir_dict["labels"]))
+        if labels.shape[0] != sum(counts):
+            raise ValueError("Data and labels have different number of "
+                             "samples (%d vs %d)"
+                             % (sum(counts), labels.shape[0]))
+    else:
+        num_controls, num_cases = counts
+        labels = np.array([0] * num_controls + [1] * num_cases)
+    if seed is not None:
+        permutation = np.random.RandomState(seed).permutation(labels.shape[0])
+        labels = labels[permutation]
+
+    logger.info("Saving labels to %s" % out_dir)
+    np.save(path.join(out_dir, "labels.npy"), labels)
+    return labels
+
+def _pull_columns(columns, reference_names=None):
+    """
+    Pull data from haps, tped or gen columns (see parse_columns), with one
+    column per SNP in the order of the sorted SNP names.
+    """
+    if reference_names is None:
+        rows = np.argsort(columns["snps"]["name"])
+    else:
+        rows = _snp_rows(columns, sorted(list(reference_names)))
+    values = columns["values"][rows]
+    if columns["ext"] == "tped":
+        minor = columns["minor_allele"][rows]
+        values = (values != minor[:, None]).reshape((rows.shape[0], -1, 2))
+        values = values.sum(axis=2)
+    return np.ascontiguousarray(values.T, dtype=np.int8)
+
 def pull_haps_data(haps_dict, reference_names=None):
     """
     Pull data from a haps dictionary.
@@ -668,7 +1345,8 @@ def pull_haps_data(haps_dict, reference_names=None):
     Parameters
     ----------
     haps_dict: dict
-        A haps dictionary (see read_haps_line)
+        A haps dictionary (see read_haps_line), or haps columns (see
+        read_chr_directory).
     reference_names: list, optional
         List of SNP names to use as reference.
 
@@ -677,6 +1355,8 @@ def pull_haps_data(haps_dict, reference_names=None):
     data: array-like
     """
     logger.info("Getting haps data.")
+    if _is_columns(haps_dict):
+        return _pull_columns(haps_dict, reference_names)
     samples = haps_dict[haps_dict.keys()[0]]["values"].shape[0]
 
     if reference_names == None:
@@ -697,7 +1377,8 @@ def pull_tped_data(tped_dict, reference_names=None):
     Parameters
     ----------
     tped_dict: dict
-        A tped dictionary (see read_tped_line)
+        A tped dictionary (see read_tped_line), or tped columns (see
+        read_chr_directory).
     reference_names: list, optional
         List of SNP names to use as reference.
 
@@ -706,6 +1387,8 @@ def pull_tped_data(tped_dict, reference_names=None):
     data: array-like
     """
     logger.info("Getting tped data.")
+    if _is_columns(tped_dict):
+        return _pull_columns(tped_dict, reference_names)
     samples = len(tped_dict[tped_dict.keys()[0]]["values"])
 
     if reference_names == None:
@@ -715,12 +1398,9 @@ def pull_tped_data(tped_dict, reference_names=None):
     data = np.zeros((samples, len(reference_names)), dtype=np.int8)
     for i, SNP_name in enumerate(reference_names):
         assert SNP_name != "ext"
-        minor, major = [tped_dict[SNP_name][m] for m in ["minor_allele", "major_allele"]]
-        values = tped_dict[SNP_name]["values"]
-
-        for j, value in enumerate(values):
-            x, y = tuple(0 if v == minor else 1 for v in value)
-            data[j, i] = x + y
+        minor = tped_dict[SNP_name]["minor_allele"]
+        values = np.asarray(tped_dict[SNP_name]["values"])
+        data[:, i] = (values != minor).sum(axis=1)
 
     return data
 
@@ -731,7 +1411,8 @@ def pull_gen_data(gen_dict, reference_names=None):
     Parameters
     ----------
     gen_dict: dict
-        A gen dictionary (see read_gen_line)
+        A gen dictionary (see read_gen_line), or gen columns (see
+        read_chr_directory).
     reference_names: list, optional
         List of SNP names to use as reference.
 
@@ -740,6 +1421,8 @@ def pull_gen_data(gen_dict, reference_names=None):
     data: array-like
     """
     logger.info("Getting gen data")
+    if _is_columns(gen_dict):
+        return _pull_columns(gen_dict, reference_names)
 
     if reference_names is None:
         reference_names = [k for k in gen_dict.keys() if k != "ext"]
@@ -1143,6 +1826,8 @@ def have_same_SNP_order(dict_A, dict_B):
     """
     Checks if two dictionaries have the same SNP order.
     """
+    if _is_columns(dict_A) and _is_columns(dict_B):
+        return np.array_equal(dict_A["snps"]["name"], dict_B["snps"]["name"])
     have_same_order = [k for k in dict_A.keys() if k != "ext"] == [k for k in dict_B.keys() if k != "ext"]
     return have_same_order
 
@@ -1173,6 +1858,9 @@ def make_argument_parser():
                                 help="Reference dataset to use SNPs from.")
     extract_parser.add_argument("-a", "--align_to", default=None)
     extract_parser.add_argument("--nofill", action="store_true")
+    extract_parser.add_argument("-w", "--workers", default=None, type=int,
+                                help="Extract chromosomes in parallel with "
+                                "this many processes.")
 
     separate_parser = subparsers.add_parser("separate", help="Separate haps for GWA sim")
     separate_parser.set_defaults(which="separate")
@@ -1308,6 +1996,16 @@ if __name__ == "__main__":
         else:
             print "A and B do not have similar priors."
 
+    elif args.which == "extract" and args.workers is not None:
+        out_dir = serial.preprocess("${PYLEARN2_NI_PATH}/" + args.out_dir)
+        assert path.isdir(out_dir), out_dir
+        extract_dataset(args.directory, out_dir,
+                        chromosomes=args.chromosomes,
+                        snps_reference=args.use_snps,
+                        align_reference=args.align_to,
+                        nofill=args.nofill,
+                        num_workers=args.workers)
+
     elif args.which == "extract":
         data_dict, snp_ref_data_dict, ref_data_dict = read_dataset_directory(
             args.directory,
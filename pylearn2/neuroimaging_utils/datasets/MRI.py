@@ -8,12 +8,14 @@ import logging
 from nipy import load_image
 from nipy.core.api import Image
 import numpy as np
+import os
 from os import path
 
 from pylearn2 import corruption
 from pylearn2.datasets import control
 from pylearn2.datasets import Dataset
 from pylearn2.datasets import dense_design_matrix
+from pylearn2.datasets.dense_design_matrix import ensure_tables
 
 from pylearn2.neuroimaging_utils.datasets import dataset_info
 
@@ -134,14 +136,22 @@ class MRI(dense_design_matrix.DenseDesignMatrix):
 
         if self.shuffle:
             self.shuffle_rng = make_np_rng(None, [1 ,2 ,3], which_method="shuffle")
-            for i in xrange(m):
-                j = self.shuffle_rng.randint(m)
-                tmp = X[i].copy()
-                X[i] = X[j]
-                X[j] = tmp
-                tmp = y[i:i+1].copy()
-                y[i] = y[j]
-                y[j] = tmp
+            if self.shuffle == "permutation":
+                # Uniform permutation in a single copy. Gives a different
+                # order than the default row swaps, so it is opt-in.
+                index = self.shuffle_rng.permutation(X.shape[0])
+                X = X[index]
+                y = y[index]
+            else:
+                m = X.shape[0]
+                for i in xrange(m):
+                    j = self.shuffle_rng.randint(m)
+                    tmp = X[i].copy()
+                    X[i] = X[j]
+                    X[j] = tmp
+                    tmp = y[i:i+1].copy()
+                    y[i] = y[j]
+                    y[j] = tmp
 
         max_labels = np.amax(y) + 1
         logger.info("%d labels found." % max_labels)
@@ -655,6 +665,8 @@ class MRI_Big(dense_design_matrix.DenseDesignMatrixPyTables):
             self.mask = mask
 
         # Make the h5 file if not present or if reprocess flag is set.
+        ensure_tables()
+        tables = dense_design_matrix.tables
         if not os.path.isfile(data_path) or reprocess:
             self.filters = tables.Filters(complib='blosc', complevel=5)
             self.make_data(which_set, serial.preprocess(p),
@@ -672,10 +684,16 @@ class MRI_Big(dense_design_matrix.DenseDesignMatrixPyTables):
         self.h5file.flush()
 
     def make_data(self, which_set, p, center=False, variance_normalize=False,
-                  shuffle=False, save_dummy=False):
+                  shuffle=False, save_dummy=False, batch_size=100):
         """
         Function to make h5 file.
         Note: parameters the same as __init__ function.
+
+        The source topological view is memory-mapped and processed
+        `batch_size` samples at a time: one pass gathers the voxel means
+        and standard deviations if centering or variance normalizing, and
+        a second pass masks, normalizes and writes the (shuffled) samples,
+        so memory use doesn't grow with the number of subjects.
         """
 
         print "Making h5 file for %s" % which_set #TODO(dhjelm): switch to logging.
@@ -690,10 +708,11 @@ class MRI_Big(dense_design_matrix.DenseDesignMatrixPyTables):
             data_path = serial.preprocess(p + 'test.h5')
             label_path = serial.preprocess(p + 'test_labels.npy')
 
-        data_path = "".join(data_path.split(".")[0] + '_dummy.h5')
+        if save_dummy:
+            data_path = "".join(data_path.split(".")[0] + '_dummy.h5')
 
         # Get the topological view and labels.
-        topo_view = np.load(source_path)
+        topo_view = np.load(source_path, mmap_mode='r')
         y = np.load(label_path)
         num_labels = np.amax(y) + 1
 
@@ -705,31 +724,64 @@ class MRI_Big(dense_design_matrix.DenseDesignMatrixPyTables):
         else:
             size = rows * columns * depth
 
-        self.view_converter = MRIViewConverter((rows, columns, depth))
-        X = self.view_converter.topo_view_to_design_mat(topo_view, self.mask)
+        self.view_converter = MRIViewConverter((rows, columns, depth),
+                                               mask=self.mask)
 
-        # TODO(dhjelm): one_hot is going away.
-        one_hot = np.zeros((size, num_labels), dtype=config.floatX)
-        for i in xrange(y.shape[0]):
-            one_hot[i, y[i] - 1] = 1.
-
-        if center:
-            X -= X.mean(axis=0)
+        def design_mat(start, stop, index=None):
+            if index is None:
+                topo_batch = topo_view[start:stop]
+            else:
+                # Read the rows in file order, then put them back in the
+                # order of the permutation.
+                order = np.argsort(index[start:stop])
+                topo_batch = np.empty((stop - start,) + topo_view.shape[1:],
+                                      dtype=topo_view.dtype)
+                topo_batch[order] = topo_view[index[start:stop][order]]
+            X = self.view_converter.topo_view_to_design_mat(topo_batch)
+            return X.astype('float64')
 
-        if variance_normalize:
-            X /= X.std(axis=0)
+        # TODO(dhjelm): one_hot is going away.
+        one_hot = np.zeros((samples, num_labels), dtype=config.floatX)
+        one_hot[np.arange(samples), y - 1] = 1.
+
+        mean = None
+        std = None
+        if center or variance_normalize:
+            # Voxel means and variances, merged across batches.
+            count = 0
+            for start in xrange(0, samples, batch_size):
+                X = design_mat(start, min(start + batch_size, samples))
+                batch_mean = X.mean(axis=0)
+                batch_m2 = np.square(X - batch_mean).sum(axis=0)
+                if count == 0:
+                    mean, m2 = batch_mean, batch_m2
+                else:
+                    delta = batch_mean - mean
+                    total = count + X.shape[0]
+                    mean = mean + delta * (X.shape[0] / float(total))
+                    m2 = m2 + batch_m2 + (np.square(delta) *
+                                          (count * X.shape[0] / float(total)))
+                count += X.shape[0]
+            std = np.sqrt(m2 / count)
 
         rng = make_np_rng(None, 322, which_method="shuffle")
+        index = None
         if shuffle:
-            index = range(samples)
+            index = np.arange(samples)
             rng.shuffle(index)
-            X = X[index, :]
             one_hot = one_hot[index, :]
 
-        assert not np.any(np.isnan(X))
-
         h5file, node = self.init_hdf5(data_path, ([samples, size], [samples, num_labels]))
-        MRI_Big.fill_hdf5(h5file, X, one_hot, node)
+        for start in xrange(0, samples, batch_size):
+            stop = min(start + batch_size, samples)
+            X = design_mat(start, stop, index)
+            if center:
+                X -= mean
+            if variance_normalize:
+                X /= std
+            assert not np.any(np.isnan(X))
+            MRI_Big.fill_hdf5(h5file, X.astype(config.floatX),
+                              one_hot[start:stop], node, start=start)
         h5file.close()
 
     def get_nifti(self, W):
@@ -891,12 +943,10 @@ class MRIViewConverter(dense_design_matrix.DefaultViewConverter):
         if self.mask is not None:
             m = topo_array.shape[0]
             mask_idx = np.where(self.mask.transpose([self.axes.index(ax) - 1
-                                                for ax in ('c', 0, 1)]).flatten() == 1)[0].tolist()
-            design_matrix = np.zeros((m, len(mask_idx)), dtype=topo_array.dtype)
-            for i in range(m):
-                topo_array_c01 = topo_array[i].transpose([self.axes.index(ax) - 1
-                                                          for ax in ('c', 0, 1)])
-                design_matrix[i] = topo_array_c01.flatten()[mask_idx]
+                                                for ax in ('c', 0, 1)]).flatten() == 1)[0]
+            topo_array_bc01 = topo_array.transpose([self.axes.index(ax)
+                                                    for ax in ('b', 'c', 0, 1)])
+            design_matrix = topo_array_bc01.reshape((m, -1))[:, mask_idx]
         else:
             topo_array_bc01 = topo_array.transpose([self.axes.index(ax)
                                                     for ax in ('b', 'c', 0, 1)])
@@ -70,9 +70,63 @@ class MultiChromosomeLayer(mlp.CompositeLayer):
         rval = OrderedDict()
         return rval
         
+class HalvedSNPs(object):
+    """
+    Read-only view of a (possibly memory-mapped) array of SNP codes in
+    {0, 1, 2} that returns floatX values in {0, .5, 1}, converting only
+    the rows that are indexed.
+
+    Parameters
+    ----------
+    X: array-like
+        The SNP codes, one example per row.
+    index_map: array-like of int, optional
+        Rows of X that make up the view, e.g. to balance classes without
+        copying the data. Defaults to all the rows.
+    """
+    def __init__(self, X, index_map=None):
+        self.X = X
+        if index_map is not None:
+            index_map = np.asarray(index_map)
+        self.index_map = index_map
+
+    @property
+    def shape(self):
+        if self.index_map is None:
+            return self.X.shape
+        return (len(self.index_map),) + self.X.shape[1:]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+        rows = idx[0]
+        if self.index_map is not None:
+            rows = self.index_map[rows]
+        X = self.X[(rows,) + idx[1:]]
+        return np.cast[config.floatX](X) / 2.
+
+    def __array__(self, dtype=None):
+        X = self[:]
+        if dtype is not None:
+            X = X.astype(dtype)
+        return X
+
 class MultiChromosome(Dataset):
     """
     Class to read multiple chromosome data.
+
+    With mmap=True, the chr%d.npy files (see read_snps.extract_dataset) are
+    memory-mapped and wrapped in HalvedSNPs views, which halve the int8
+    codes of the rows that are read, so the chromosomes are never all
+    loaded in memory. Xs and get_data() hold the same values with or
+    without mmap.
     """
     _default_seed = (18, 4, 646)
     def __init__(self,
@@ -80,7 +134,8 @@ class MultiChromosome(Dataset):
                  dataset_name="snp",
                  read_only=False, balance_classes=False,
                  start=None, stop=None, shuffle=False,
-                 add_noise=False, rng=_default_seed, flip_labels=False):
+                 add_noise=False, rng=_default_seed, flip_labels=False,
+                 mmap=False):
         print "Loading %r chromosomes for %s" % (chromosomes, dataset_name)
         if start is not None and stop is not None:
             print "Start: %d, stop: %d" % (start, stop)
@@ -138,21 +193,29 @@ class MultiChromosome(Dataset):
             sizes = [h5file.getNode("/", "Sizes")[c] for c in range(chromosomes)]
 
         else:
-            print "Format is on-memory for %s" % dataset_name
+            if mmap:
+                print "Format is memory-mapped for %s" % dataset_name
+            else:
+                print "Format is on-memory for %s" % dataset_name
             sizes = []
             for c in range(0, chromosomes):
-                X = np.load(data_files[c])[start:stop, :]
+                X = np.load(data_files[c],
+                            mmap_mode="r" if mmap else None)[start:stop, :]
 
                 assert "%d" % (c+1) in data_files[c]
 
-                if balanced_idx is not None:
+                if mmap:
+                    X = HalvedSNPs(X, index_map=balanced_idx)
+                elif balanced_idx is not None:
                     X = X[balanced_idx]
 
                 assert X.shape[0] == self.y.shape[0],\
                     "Data and labels have different number of samples (%d vs %d)" %\
                     (X.shape[0], self.y.shape[0])
 
-                self.Xs = self.Xs + (X / 2.0,)
+                if not mmap:
+                    X = X / 2.0
+                self.Xs = self.Xs + (X,)
                 sizes.append(X.shape[1])
 
         print "%s samples are %d" % (dataset_name, self.y.shape[0])
@@ -209,7 +272,7 @@ class MultiChromosome(Dataset):
             subset_iterator=subset_iterator,
             data_specs=data_specs,
             return_tuple=return_tuple,
-            convert=self.convert)
+            convert=list(self.convert) if self.convert is not None else None)
     
     def get_data_specs(self):
         """
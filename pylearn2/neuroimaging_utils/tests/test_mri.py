@@ -5,11 +5,15 @@ Module to test MRI datasets.
 import logging
 import numpy as np
 from os import path
+import shutil
+import tempfile
 
 from pylearn2.neuroimaging_utils.datasets.MRI import MRI_Standard
 from pylearn2.neuroimaging_utils.datasets.MRI import MRI_Transposed
 from pylearn2.neuroimaging_utils.datasets.MRI import MRI_Big
+from pylearn2.neuroimaging_utils.datasets.MRI import MRIViewConverter
 from pylearn2.utils import serial
+from pylearn2.utils.rng import make_np_rng
 
 import sys
 
@@ -21,6 +25,53 @@ def check_datasets(exp, act):
     assert np.all(exp == act),\
         "Datasets do not match: \n%r\n%r" % (exp, act)
 
+def test_make_data_batches():
+    """
+    Test that MRI_Big.make_data writes a synthetic volume processed in
+    batches the same as processed in memory at once.
+    """
+    from pylearn2.datasets import dense_design_matrix
+    dense_design_matrix.ensure_tables()
+    tables = dense_design_matrix.tables
+
+    rng = np.random.RandomState(1)
+    samples, rows, columns, depth = 7, 3, 4, 2
+    topo_view = rng.randn(samples, rows, columns, depth)
+    y = rng.randint(1, 3, size=samples)
+    mask = (rng.rand(rows, columns, depth) > .3).astype(int)
+
+    X = MRIViewConverter((rows, columns, depth),
+                         mask=mask).topo_view_to_design_mat(topo_view)
+    X = X - X.mean(axis=0)
+    X /= X.std(axis=0)
+    index = np.arange(samples)
+    make_np_rng(None, 322, which_method="shuffle").shuffle(index)
+    X = X[index]
+    one_hot = np.zeros((samples, 3))
+    one_hot[np.arange(samples), y - 1] = 1.
+    one_hot = one_hot[index]
+
+    directory = tempfile.mkdtemp()
+    try:
+        p = directory + "/"
+        np.save(p + "train.npy", topo_view)
+        np.save(p + "train_labels.npy", y)
+        mri = MRI_Big.__new__(MRI_Big)
+        mri.mask = mask
+        mri.filters = tables.Filters()
+        for batch_size in [3, samples]:
+            mri.make_data("train", p, center=True, variance_normalize=True,
+                          shuffle=True, batch_size=batch_size)
+            h5file = tables.openFile(p + "train.h5")
+            try:
+                assert np.allclose(h5file.root.Data.X[:], X, atol=1e-5)
+                assert np.all(h5file.root.Data.y[:] == one_hot)
+            finally:
+                h5file.close()
+    finally:
+        shutil.rmtree(directory)
+
+
 class TestMRI:
     def setUp(self):
         self.p = serial.preprocess("${PYLEARN2_NI_PATH}/smri/")
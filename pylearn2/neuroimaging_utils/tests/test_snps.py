@@ -1,5 +1,10 @@
 
 import numpy as np
+import os
+from os import path
+import shutil
+import tempfile
+from pylearn2.neuroimaging_utils.dataset_utils import read_snps
 from pylearn2.neuroimaging_utils.datasets import SNP
 from pylearn2.neuroimaging_utils.research import randomize_snps
 
@@ -21,3 +26,80 @@ def test_randomization(batch_size=5):
         for x in chrom_data.eval().flatten():
             assert x in [0, .5, 1], x
 
+
+def test_parse_columns():
+    directory = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState([2015, 3, 2])
+        haps = rng.randint(0, 2, size=(20, 10))
+        haps_file = path.join(directory, "chr1.haps")
+        with open(haps_file, "w") as f:
+            for i in range(20):
+                f.write("1 rs%d %d 1 2 %s\n"
+                        % (i, 1000 + i, " ".join(str(h) for h in haps[i])))
+
+        columns = read_snps.parse_columns(haps_file)
+        assert columns["ext"] == "haps"
+        assert np.all(columns["values"] == haps[:, ::2] + haps[:, 1::2])
+        assert np.all(columns["snps"]["location"] == np.arange(1000, 1020))
+        assert not path.exists(read_snps._columns_cache_path(haps_file))
+
+        # The second parse comes from the cache
+        read_snps.parse_columns(haps_file, cache=True)
+        assert path.isfile(read_snps._columns_cache_path(haps_file))
+        cached = read_snps.parse_columns(haps_file, cache=True)
+        assert np.all(cached["values"] == columns["values"])
+
+        # Every line must have the same number of values
+        try:
+            read_snps._parse_int_block(["0 1 0 1", "0 1 0", "0 1 0 1 0"],
+                                       "haps")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Lines of different lengths were parsed")
+
+        haps_dict = read_snps.parse_file(haps_file)
+        with open(haps_file, "r") as f:
+            for line in f.readlines():
+                SNP_name, entry = read_snps.parse_haps_line(line)
+                assert np.all(haps_dict[SNP_name]["values"] == entry["values"])
+                assert haps_dict[SNP_name]["location"] == entry["location"]
+    finally:
+        shutil.rmtree(directory)
+
+def test_extract_dataset():
+    directory = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState([2015, 3, 3])
+        num_subjects = 6
+        for c in [1, 2]:
+            chr_dir = path.join(directory, "chr%d" % c)
+            os.mkdir(chr_dir)
+            with open(path.join(chr_dir, "chr%d.bim" % c), "w") as bim:
+                with open(path.join(chr_dir, "chr%d.haps" % c), "w") as haps:
+                    for i in range(5 * c):
+                        bim.write("%d\trs%d_%d\t0\t%d\tA\tG\n" % (c, c, i, i))
+                        values = rng.randint(0, 2, size=2 * num_subjects)
+                        haps.write("%d rs%d_%d %d 1 2 %s\n"
+                                   % (c, c, i, i,
+                                      " ".join(str(v) for v in values)))
+        with open(path.join(directory, "diagnosis_ref.txt"), "w") as f:
+            f.write("0 0 1 1 0 0 1 1 1 1 0 0")
+
+        out_dir = path.join(directory, "out")
+        os.mkdir(out_dir)
+        labels = read_snps.extract_dataset(directory, out_dir, chromosomes=2,
+                                           shuffle=False, num_workers=2)
+
+        dataset_dict, _, _ = read_snps.read_dataset_directory(directory,
+                                                              chromosomes=2)
+        data_dict, expected_labels = read_snps.pull_dataset(
+            dataset_dict, chromosomes=2, shuffle=False)
+        assert np.all(labels == expected_labels)
+        assert np.all(np.load(path.join(out_dir, "labels.npy")) == labels)
+        for c in [1, 2]:
+            data = np.load(path.join(out_dir, "chr%d.npy" % c), mmap_mode="r")
+            assert np.all(data == data_dict[c])
+    finally:
+        shutil.rmtree(directory)
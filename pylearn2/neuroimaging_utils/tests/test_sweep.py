@@ -0,0 +1,114 @@
+"""
+Tests for pylearn2.neuroimaging_utils.tools.sweep
+"""
+
+import os
+import shutil
+import tempfile
+
+from pylearn2.neuroimaging_utils.tools import sweep
+from pylearn2.neuroimaging_utils.tools.jobman_generators import list_generator
+
+
+def _make_db():
+    """Returns a SweepDB in a new temporary directory, and the directory."""
+    directory = tempfile.mkdtemp()
+    return sweep.SweepDB(os.path.join(directory, "sweep.db")), directory
+
+
+def test_expand_grid():
+    """Test that every combination is expanded without touching defaults."""
+    defaults = {"learning_rate": 0.1, "layer": {"dim": 10, "irange": 0.05}}
+    grid = list(sweep.expand_grid(defaults,
+                                  list_generator("learning_rate", [0.1, 0.01]),
+                                  list_generator("layer.dim", [10, 20, 30])))
+    assert len(grid) == 6
+    combinations = set((h["learning_rate"], h["layer"]["dim"]) for h in grid)
+    assert combinations == set((lr, dim) for lr in [0.1, 0.01]
+                               for dim in [10, 20, 30])
+    for hyperparams in grid:
+        assert hyperparams["layer"]["irange"] == 0.05
+    assert defaults == {"learning_rate": 0.1,
+                        "layer": {"dim": 10, "irange": 0.05}}
+    assert list(sweep.expand_grid(defaults)) == [defaults]
+
+
+def test_trial_id():
+    """Test that trial ids only depend on the hyperparameter values."""
+    a = sweep.trial_id({"x": 1, "y": {"z": 2, "w": 3}})
+    b = sweep.trial_id({"y": {"w": 3, "z": 2}, "x": 1})
+    c = sweep.trial_id({"x": 1, "y": {"z": 2, "w": 4}})
+    assert a == b
+    assert a != c
+    assert len(a) == 16
+
+
+def test_fill_yaml():
+    """Test filling file parameters, then nested hyperparameters."""
+    template = ("!obj:pylearn2.train.Train {\n"
+                "model: %(model)s,\n"
+                "learning_rate: %(learning_rate)f,\n"
+                "save_path: %(save_path)s.pkl,\n"
+                "}")
+    hyperparams = {"learning_rate": 0.5,
+                   "model": {"__builder__": "pylearn2.models.mlp.MLP",
+                             "nvis": 5}}
+    filled = sweep.fill_yaml(template, hyperparams, {"save_path": "/tmp/t"})
+    assert "save_path: /tmp/t.pkl," in filled
+    assert "learning_rate: 0.500000," in filled
+    assert "model: !obj:pylearn2.models.mlp.MLP {\nnvis: 5,\n}," in filled
+
+
+def test_best_values():
+    """Test that only trials which reached the epoch are compared."""
+    db, directory = _make_db()
+    try:
+        for epoch, value in enumerate([5., 3., 4., 1.]):
+            db.record_channels("a", epoch, {"valid_y_misclass": value,
+                                            "train_y_misclass": 0.})
+        for epoch, value in enumerate([2., 6.]):
+            db.record_channels("b", epoch, {"valid_y_misclass": value})
+
+        assert db.best_values("valid_y_misclass", 1) == {"a": 3., "b": 2.}
+        assert db.best_values("valid_y_misclass", 1, minimize=False) == {
+            "a": 5., "b": 6.}
+        # b never reached epoch 2, and a's later value is not used
+        assert db.best_values("valid_y_misclass", 2) == {"a": 3.}
+        assert db.best_values("valid_y_misclass", 3) == {"a": 1.}
+        assert db.best_values("valid_y_misclass", 4) == {}
+        assert db.best_values("train_y_misclass", 1) == {"a": 0.}
+
+        # Recording an epoch again replaces its value
+        db.record_channels("b", 1, {"valid_y_misclass": 1.})
+        assert db.best_values("valid_y_misclass", 1) == {"a": 3., "b": 1.}
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_median_stopping():
+    """Test stopping trials behind the median of the others."""
+    db, directory = _make_db()
+    try:
+        final = {"a": 1., "b": 2., "c": 3., "d": 4., "e": 5.}
+        for name, value in final.items():
+            db.record_channels(name, 0, {"cost": 10., "accuracy": 0.})
+            db.record_channels(name, 1, {"cost": value, "accuracy": value})
+        stopping = sweep.MedianStopping("cost", grace_epochs=1, min_trials=3)
+
+        assert not stopping(db, "e", 0)
+        assert not stopping(db, "a", 1)
+        assert not stopping(db, "b", 1)
+        assert stopping(db, "c", 1)
+        assert stopping(db, "d", 1)
+        assert stopping(db, "e", 1)
+        # Unknown trials and trials without enough others are kept
+        assert not stopping(db, "f", 1)
+        assert not sweep.MedianStopping("cost", grace_epochs=1,
+                                        min_trials=5)(db, "e", 1)
+
+        maximize = sweep.MedianStopping("accuracy", minimize=False,
+                                        grace_epochs=1, min_trials=3)
+        assert maximize(db, "a", 1)
+        assert not maximize(db, "e", 1)
+    finally:
+        shutil.rmtree(directory)
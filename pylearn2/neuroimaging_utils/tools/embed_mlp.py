@@ -11,12 +11,14 @@ import numpy as np
 
 from pylearn2.config import yaml_parse
 from pylearn2.datasets import control
+from pylearn2.neuroimaging_utils.tools.mri_analysis import apply_batched
 from pylearn2.utils import serial
 
 from theano import function
 
 
-def main(model_path, k, out=None, level=None, iterations=100):
+def main(model_path, k, out=None, level=None, iterations=100,
+         num_examples=1000, batch_size=100):
     model = serial.load(model_path)
     print model.layers
 
@@ -35,8 +37,9 @@ def main(model_path, k, out=None, level=None, iterations=100):
             Y = model.layers[l].fprop(Y)
 
     predictor = function([X], Y)
-    y = predictor(dataset.X[:1000])
-    yhat = dataset.y.flatten()[:1000]
+    y = apply_batched(predictor, dataset.X[:num_examples],
+                      batch_size=batch_size)
+    yhat = dataset.y.flatten()[:num_examples]
     embeddings = dc.d_and_c(y, K=k, maxiter=iterations)
     print yhat.shape
     print y.shape
@@ -69,9 +72,12 @@ def make_argument_parser():
     parser.add_argument("model", help="path for the model .pkl file.")
     parser.add_argument("--level", default=-1, help="Level to fprop to.")
     parser.add_argument("--iterations", default=100, help="Number of divide and concur iters")
+    parser.add_argument("--num_examples", default=1000, help="Number of examples to embed.")
+    parser.add_argument("--batch_size", default=100, help="Batch size for the fprop.")
     return parser
 
 if __name__ == '__main__':
     parser = make_argument_parser()
     args = parser.parse_args()
-    main(args.model, int(args.k), args.out, int(args.level), int(args.iterations))
+    main(args.model, int(args.k), args.out, int(args.level), int(args.iterations),
+         int(args.num_examples), int(args.batch_size))
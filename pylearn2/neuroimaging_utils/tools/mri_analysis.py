@@ -34,7 +34,13 @@ from pylearn2.utils import sharedX
 from scipy.stats import ttest_1samp
 from scipy.stats import ttest_ind
 import sys
+from theano.compat import six
+from theano.compat.six.moves import xrange
+from theano import config
+from theano import function
+from theano import tensor as T
 import warnings
+import weakref
 
 
 logging.basicConfig(format="[%(levelname)s]:%(message)s")
@@ -47,61 +53,142 @@ except ImportError:
         pass
     logger.warn("NICE not found, so hopefully you're not trying to load a NICE model.")
 
-def get_activations(model, dataset):
+_encoders = weakref.WeakKeyDictionary()
+
+def get_encoder(model):
     """
-    Get latent variable activations given a dataset.
+    Get a compiled function from a batch of the design matrix to latent
+    variable activations.
+    The function is compiled once per model and cached.
 
     Parameters
     ----------
     model: pylearn2.Model
         Model from which to get activations.
-    dataset: pylearn2.datasets.DenseDesignMatrix
-        Dataset from which to generate activations.
 
     Returns
     -------
-    activations: numpy array-like
+    encoder: theano function
     """
 
-    logger.info("Getting activations for model of type %s and model %s"
-                % (type(model), dataset.dataset_name))
-    data = dataset.get_design_matrix()
+    if model in _encoders:
+        return _encoders[model]
+
+    logger.info("Compiling encoder for model of type %s" % type(model))
+    X = T.matrix("X", dtype=config.floatX)
     if isinstance(model, NICE):
-        if isinstance(dataset, MRI_Transposed):
-            S = model.encoder.layers[-1].D.get_value()
-            sigma = np.exp(-S)
-            num_features = model.nvis
-            y = np.zeros((1, num_features))
-            Y = sharedX(y)
-            mean_activations = model.encoder.inv_fprop(Y).eval()
-            z = np.zeros((num_features, num_features))
-            for i, j in enumerate(range(num_features)):
-                z[i, j] = 2 * sigma[j]
-            Z = sharedX(z)
-            activations = (model.encoder.inv_fprop(Z).eval() - mean_activations)            
-        else:
-            X = sharedX(data)
-            activations = model.encode(X).eval()
+        H = model.encode(X)
     elif isinstance(model, VAE):
-        X = sharedX(data)
         epsilon = model.sample_from_epsilon((X.shape[0], model.nhid))
         epsilon *= 0
         phi = model.encode_phi(X)
-        activations = model.sample_from_q_z_given_x(epsilon=epsilon, phi=phi).eval()
-        assert activations.shape[1] == model.nhid
+        H = model.sample_from_q_z_given_x(epsilon=epsilon, phi=phi)
     elif isinstance(model, RBM):
-        X = sharedX(data)
         hidden_layer = model.hidden_layers[0]
-        _, activations = hidden_layer.mf_update(X, state_above=None)
-        activations = activations.eval()
+        _, H = hidden_layer.mf_update(X, state_above=None)
     else:
         raise NotImplementedError("Cannot get activations for model of type %r. "
                                   "Needs to be implemented"
                                   % type(model))
 
+    encoder = function([X], H)
+    _encoders[model] = encoder
+    return encoder
+
+def apply_batched(f, data, batch_size=1000, out=None):
+    """
+    Apply a compiled function to the rows of a design matrix in batches.
+
+    Parameters
+    ----------
+    f: theano function
+        Function of a batch of rows which returns one row per example.
+    data: numpy array-like
+        Design matrix. Anything with a `shape` whose rows can be sliced,
+        such as a numpy array, memmap or PyTables array.
+    batch_size: int, optional
+        Number of rows passed to `f` at a time.
+    out: numpy array or str, optional
+        Where to write the output. An array is filled in place, and a str
+        is used as the path of a new .npy file which is memory-mapped.
+        If None, a new array is allocated.
+
+    Returns
+    -------
+    out: numpy array-like
+    """
+
+    num_examples = data.shape[0]
+    if num_examples == 0:
+        raise ValueError("Cannot apply function to empty data.")
+    for start in xrange(0, num_examples, batch_size):
+        stop = min(start + batch_size, num_examples)
+        batch = f(np.asarray(data[start:stop], dtype=config.floatX))
+        if start == 0:
+            shape = (num_examples,) + batch.shape[1:]
+            if out is None:
+                out = np.empty(shape, dtype=batch.dtype)
+            elif isinstance(out, six.string_types):
+                out = np.lib.format.open_memmap(out, mode="w+",
+                                                dtype=batch.dtype,
+                                                shape=shape)
+            elif out.shape != shape:
+                raise ValueError("Output shape is %r but should be %r."
+                                 % (out.shape, shape))
+        out[start:stop] = batch
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+def get_activations(model, dataset, batch_size=1000, out=None):
+    """
+    Get latent variable activations given a dataset.
+
+    Parameters
+    ----------
+    model: pylearn2.Model
+        Model from which to get activations.
+    dataset: pylearn2.datasets.DenseDesignMatrix
+        Dataset from which to generate activations.
+    batch_size: int, optional
+        Number of examples encoded at a time.
+    out: numpy array or str, optional
+        Preallocated output or path of a .npy file to memory-map.
+        See `apply_batched`.
+
+    Returns
+    -------
+    activations: numpy array-like
+    """
+
+    logger.info("Getting activations for model of type %s and model %s"
+                % (type(model), dataset.dataset_name))
+    if isinstance(model, NICE) and isinstance(dataset, MRI_Transposed):
+        S = model.encoder.layers[-1].D.get_value()
+        sigma = np.exp(-S)
+        num_features = model.nvis
+        y = np.zeros((1, num_features))
+        Y = sharedX(y)
+        mean_activations = model.encoder.inv_fprop(Y).eval()
+        z = np.zeros((num_features, num_features))
+        for i, j in enumerate(range(num_features)):
+            z[i, j] = 2 * sigma[j]
+        Z = sharedX(z)
+        activations = (model.encoder.inv_fprop(Z).eval() - mean_activations)
+        if out is not None:
+            activations = apply_batched(lambda x: x, activations,
+                                        batch_size=batch_size, out=out)
+    else:
+        encoder = get_encoder(model)
+        activations = apply_batched(encoder, dataset.get_design_matrix(),
+                                    batch_size=batch_size, out=out)
+        if isinstance(model, VAE):
+            assert activations.shape[1] == model.nhid
+
     return activations
 
-def get_sz_info(dataset, activations):
+def get_sz_info(dataset, activations=None, model=None, batch_size=1000):
     """
     Get schizophrenia classification experiment related info from activations.
     Info is a 2-sided t test for each latent variable of healthy vs control.
@@ -112,8 +199,13 @@ def get_sz_info(dataset, activations):
         Dataset must be in dataset_info.sz_datasets.
         Labels must be in {0, 1}. Singleton labels not tested ({0}) and will
         likely not work.
-    activations: numpy array_like
+    activations: numpy array_like, optional
         Activations from which to ttest sz statistics.
+        If None, they are extracted from `model` with `get_activations`.
+    model: pylearn2.Model, optional
+        Model to get activations from if `activations` is None.
+    batch_size: int, optional
+        Batch size for `get_activations`.
 
     Returns
     -------
@@ -126,20 +218,23 @@ def get_sz_info(dataset, activations):
                          "please edit \"datasets/dataset_info.py\""
                          "if you are sure this is an sz classification related"
                          "dataset" % dataset.dataset_name)
+    if activations is None:
+        if model is None:
+            raise ValueError("Must provide either activations or a model.")
+        activations = get_activations(model, dataset, batch_size=batch_size)
     logger.info("t testing features for relevance to Sz.")
     labels = dataset.y
     assert labels is not None
-    for label in labels:
-        assert label == 0 or label == 1
-    sz_idx = [i for i in range(len(labels)) if labels[i] == 1]
-    h_idx = [i for i in range(len(labels)) if labels[i] == 0]
+    labels = np.asarray(labels).flatten()
+    assert np.all((labels == 0) | (labels == 1))
+    sz_idx = np.where(labels == 1)[0]
+    h_idx = np.where(labels == 0)[0]
 
     sz_acts = activations[sz_idx]
     h_acts = activations[h_idx]
 
-    ttests = []
-    for sz_act, h_act in zip(sz_acts.T, h_acts.T):
-        ttests.append(ttest_ind(h_act, sz_act))
+    t, p = ttest_ind(h_acts, sz_acts, axis=0)
+    ttests = list(zip(np.atleast_1d(t), np.atleast_1d(p)))
 
     return ttests
 
@@ -289,7 +384,8 @@ def load_feature_dict(feature_dict, stat, stat_name):
     return feature_dict
 
 def get_features(model, zscore=True, transposed_features=False,
-                 dataset=None, feature_dict=None, max_features=100):
+                 dataset=None, feature_dict=None, max_features=100,
+                 batch_size=1000):
     """
     Extracts the features given a number of model types.
     Included are special methods for VAE and NICE. Also if the data is transposed,
@@ -303,6 +399,8 @@ def get_features(model, zscore=True, transposed_features=False,
         Whether the model was trained in transpose.
     dataset: pylearn2 Dataset class.
         Dataset to process transposed features.
+    batch_size: int, optional.
+        Number of examples encoded at a time for transposed features.
 
     Returns
     -------
@@ -339,9 +437,10 @@ def get_features(model, zscore=True, transposed_features=False,
         if transposed_features:
             if dataset is None:
                 raise ValueError("Must provide a dataset to transpose features (None provided)")
-            data = dataset.get_design_matrix()
-            X = sharedX(data)
-            features = model.encode(X).T.eval()[idx]
+            activations = apply_batched(get_encoder(model),
+                                        dataset.get_design_matrix(),
+                                        batch_size=batch_size)
+            features = activations[:, idx].T
             assert features.shape[0] == len(idx), features.shape
         else:
             y = np.zeros((1, num_features))
@@ -0,0 +1,577 @@
+"""
+Module to run hyperparameter sweeps locally, without a jobman database.
+
+The hyperparameter grid is expanded from the generators of
+`jobman_generators`, each trial is loaded with `yaml_parse.load` and trained
+with `Train` in a bounded pool of worker processes, and the monitoring
+channels and results of every trial are recorded in an SQLite file as they
+come in. Trials falling behind the others can be stopped early.
+
+An experiment module, as used by `jobman_analysis`, provides `yaml_file`,
+`default_hyperparams()` and `extract_results(model)`, and optionally
+`generators()`, returning the generators to expand, and
+`results_of_interest`.
+"""
+
+import argparse
+import contextlib
+import copy
+import hashlib
+import imp
+import json
+import logging
+import math
+import multiprocessing as mp
+import os
+from os import path
+import signal
+import socket
+import sqlite3
+import time
+import traceback
+
+from pylearn2.config import yaml_parse
+from pylearn2.neuroimaging_utils.tools.jobman_generators import (
+    nested_generator)
+from pylearn2.train_extensions import TrainExtension
+from pylearn2.utils import serial
+
+
+logging.basicConfig(format="[%(module)s:%(levelname)s]:%(message)s")
+logger = logging.getLogger(__name__)
+
+# Same status codes as jobman
+WAITING, RUNNING, DONE, FAILED, STOPPED = range(5)
+STATUS_NAMES = ["waiting", "running", "done", "failed", "stopped"]
+
+
+class YamlDict(dict):
+    """
+    Dictionary which prints as a YAML mapping, like jobman's `ydict`.
+
+    The special key "__builder__" is printed as the `!obj:` tag of the
+    mapping.
+    """
+    def __str__(self):
+        args_dict = dict(self)
+        builder = args_dict.pop("__builder__", "")
+        ret_list = ["!obj:%s {" % builder if builder else "{"]
+        for key, val in sorted(args_dict.items()):
+            ret_list.append("%s: %s," % (key, val))
+        ret_list.append("}")
+        return "\n".join(ret_list)
+
+
+def to_yaml_dict(d):
+    """
+    Converts nested dictionaries to nested `YamlDict`.
+    """
+    if isinstance(d, dict):
+        return YamlDict((k, to_yaml_dict(v)) for k, v in d.items())
+    return d
+
+
+def set_param(hyperparams, key, value):
+    """
+    Sets the entry of nested dictionary `hyperparams` at dotted `key`.
+    """
+    split_keys = key.split(".")
+    entry = hyperparams
+    for k in split_keys[:-1]:
+        entry = entry[k]
+    entry[split_keys[-1]] = value
+
+
+def expand_grid(default_hyperparams, *generators):
+    """
+    Yields a copy of `default_hyperparams` for each combination of the
+    values yielded by `generators`.
+
+    Parameters
+    ----------
+    default_hyperparams: dict
+        Nested hyperparameters shared by all trials.
+    generators: generators of (dotted key, value) pairs
+        See `jobman_generators`. Generators are consumed.
+    """
+    for items in nested_generator(*[list(g) for g in generators]):
+        hyperparams = copy.deepcopy(default_hyperparams)
+        for key, value in items:
+            set_param(hyperparams, key, value)
+        yield hyperparams
+
+
+def trial_id(hyperparams):
+    """
+    Identifier of a trial, stable across runs of the sweep.
+    """
+    params = json.dumps(hyperparams, sort_keys=True).encode("utf-8")
+    return hashlib.md5(params).hexdigest()[:16]
+
+
+def fill_yaml(yaml_template, hyperparams, file_params):
+    """
+    Fills a YAML template with file parameters, then hyperparameters.
+    """
+    for param, value in file_params.items():
+        yaml_template = yaml_template.replace("%%(%s)s" % param, value)
+    return yaml_template % to_yaml_dict(hyperparams)
+
+
+class SweepDB(object):
+    """
+    SQLite record of the trials of a sweep.
+
+    Each process opens its own connection, so trials record their progress
+    directly from their worker.
+
+    Parameters
+    ----------
+    db_path: str
+        Path of the SQLite file, created if needed.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS trials ("
+                         "id TEXT PRIMARY KEY, params TEXT, "
+                         "status INTEGER, host TEXT, pid INTEGER, "
+                         "start_time REAL, stop_time REAL, "
+                         "results TEXT, error TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS channels ("
+                         "trial_id TEXT, epoch INTEGER, name TEXT, "
+                         "value REAL, PRIMARY KEY (trial_id, epoch, name))")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add_trial(self, trial_id, hyperparams):
+        """
+        Adds a waiting trial, unless it is already recorded.
+        """
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO trials (id, params, status) "
+                         "VALUES (?, ?, ?)",
+                         (trial_id, json.dumps(hyperparams, sort_keys=True),
+                          WAITING))
+
+    def set_status(self, trial_id, status, **fields):
+        """
+        Sets the status and other columns of a trial.
+        """
+        fields["status"] = status
+        keys = sorted(fields.keys())
+        with self._connect() as conn:
+            conn.execute("UPDATE trials SET %s WHERE id = ?"
+                         % ", ".join("%s = ?" % k for k in keys),
+                         [fields[k] for k in keys] + [trial_id])
+
+    def reset_running(self):
+        """
+        Puts back trials left running by an interrupted sweep.
+        """
+        with self._connect() as conn:
+            conn.execute("UPDATE trials SET status = ? WHERE status = ?",
+                         (WAITING, RUNNING))
+
+    def record_channels(self, trial_id, epoch, values):
+        """
+        Records the channel values of a trial at an epoch.
+        """
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO channels "
+                             "VALUES (?, ?, ?, ?)",
+                             [(trial_id, epoch, name, float(value))
+                              for name, value in values.items()])
+
+    def record_results(self, trial_id, results):
+        """
+        Records the final results of a trial.
+        """
+        with self._connect() as conn:
+            conn.execute("UPDATE trials SET results = ? WHERE id = ?",
+                         (json.dumps(results, default=float), trial_id))
+
+    def best_values(self, name, epoch, minimize=True):
+        """
+        Returns the best value of channel `name` up to `epoch` for every
+        trial which reached `epoch`, as a dictionary.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT trial_id, %s(value) FROM channels "
+                "WHERE name = ? AND epoch <= ? GROUP BY trial_id "
+                "HAVING MAX(epoch) >= ?" % ("MIN" if minimize else "MAX"),
+                (name, epoch, epoch)).fetchall()
+        return dict(rows)
+
+    def trials(self, status=None):
+        """
+        Returns the trials, with `status` if given, as dictionaries.
+        """
+        query = "SELECT * FROM trials"
+        args = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            args = (status,)
+        with self._connect() as conn:
+            cursor = conn.execute(query + " ORDER BY id", args)
+            keys = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        trials = []
+        for row in rows:
+            trial = dict(zip(keys, row))
+            trial["params"] = json.loads(trial["params"])
+            if trial["results"] is not None:
+                trial["results"] = json.loads(trial["results"])
+            trials.append(trial)
+        return trials
+
+
+class MedianStopping(object):
+    """
+    Stops a trial whose best value of a channel so far is worse than the
+    `quantile` of the best values of the other trials at the same epoch.
+
+    Parameters
+    ----------
+    channel_name: str
+        Monitoring channel to compare trials on.
+    minimize: bool, optional
+        Whether lower values of the channel are better.
+    grace_epochs: int, optional
+        Trials are never stopped before this epoch.
+    min_trials: int, optional
+        Number of other trials which must have reached the epoch.
+    quantile: float, optional
+        A trial is stopped if it does worse than this fraction of the
+        others.
+    """
+    def __init__(self, channel_name, minimize=True, grace_epochs=5,
+                 min_trials=3, quantile=0.5):
+        self.channel_name = channel_name
+        self.minimize = minimize
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+        self.quantile = quantile
+
+    def __call__(self, db, trial_id, epoch):
+        """
+        Whether trial `trial_id` should stop at `epoch`.
+        """
+        if epoch < self.grace_epochs:
+            return False
+        best = db.best_values(self.channel_name, epoch, self.minimize)
+        if trial_id not in best:
+            return False
+        value = best.pop(trial_id)
+        if len(best) < self.min_trials:
+            return False
+        others = sorted(best.values(), reverse=not self.minimize)
+        index = int(math.ceil(self.quantile * len(others))) - 1
+        threshold = others[min(max(index, 0), len(others) - 1)]
+        if self.minimize:
+            return value > threshold
+        return value < threshold
+
+
+class SweepRecorder(TrainExtension):
+    """
+    Records the monitoring channels of a trial after each epoch and stops
+    it early when `stopping` says so.
+
+    Parameters
+    ----------
+    db_path: str
+        Path of the sweep's SQLite file.
+    trial_id: str
+        Identifier of the trial.
+    channel_names: list of str, optional
+        Channels to record. All channels are recorded by default.
+    stopping: callable, optional
+        Called as `stopping(db, trial_id, epoch)`, e.g. `MedianStopping`.
+    """
+    def __init__(self, db_path, trial_id, channel_names=None, stopping=None):
+        self.db = SweepDB(db_path)
+        self.trial_id = trial_id
+        self.channel_names = channel_names
+        self.stopping = stopping
+        self.stopped = False
+
+    def on_monitor(self, model, dataset, algorithm):
+        monitor = model.monitor
+        epoch = monitor.get_epochs_seen()
+        names = self.channel_names
+        if names is None:
+            names = monitor.channels.keys()
+        self.db.record_channels(
+            self.trial_id, epoch,
+            dict((name, monitor.channels[name].val_record[-1])
+                 for name in names))
+        if (self.stopping is not None and
+                self.stopping(self.db, self.trial_id, epoch)):
+            logger.info("Stopping trial %s at epoch %d"
+                        % (self.trial_id, epoch))
+            self.stopped = True
+            raise StopIteration()
+
+
+class ResourceLimitExceeded(Exception):
+    """
+    Raised in a trial when it uses up its CPU time.
+    """
+
+
+def _raise_cpu_limit(signum, frame):
+    raise ResourceLimitExceeded("CPU time limit exceeded")
+
+
+def set_limits(memory_limit=None, cpu_time_limit=None):
+    """
+    Limits the resources of the current process.
+
+    Parameters
+    ----------
+    memory_limit: int, optional
+        Address space limit, in bytes. Allocations beyond it raise
+        MemoryError.
+    cpu_time_limit: int, optional
+        CPU time limit, in seconds. Going beyond it raises
+        `ResourceLimitExceeded`.
+    """
+    import resource
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if cpu_time_limit is not None:
+        signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time_limit, hard))
+
+
+def run_trial(db_path, trial_id, yaml_string, extract_results=None,
+              channel_names=None, stopping=None, memory_limit=None,
+              cpu_time_limit=None, time_budget=None):
+    """
+    Trains a trial and records its outcome. Run in a worker process.
+
+    Parameters
+    ----------
+    db_path: str
+        Path of the sweep's SQLite file.
+    trial_id: str
+        Identifier of the trial.
+    yaml_string: str
+        Filled YAML of a `Train` object.
+    extract_results: callable, optional
+        Maps the trained model to a dictionary of results.
+    channel_names, stopping: optional
+        See `SweepRecorder`.
+    memory_limit, cpu_time_limit: int, optional
+        See `set_limits`.
+    time_budget: int, optional
+        Wall clock seconds after which training is interrupted.
+    """
+    db = SweepDB(db_path)
+    db.set_status(trial_id, RUNNING, host=socket.gethostname(),
+                  pid=os.getpid(), start_time=time.time())
+    try:
+        set_limits(memory_limit, cpu_time_limit)
+        train = yaml_parse.load(yaml_string)
+        recorder = SweepRecorder(db_path, trial_id, channel_names, stopping)
+        train.extensions.append(recorder)
+        train.main_loop(time_budget=time_budget)
+        if extract_results is not None:
+            db.record_results(trial_id, extract_results(train.model))
+    except BaseException:
+        logger.error("Trial %s failed" % trial_id)
+        db.set_status(trial_id, FAILED, stop_time=time.time(),
+                      error=traceback.format_exc())
+        return
+    db.set_status(trial_id, STOPPED if recorder.stopped else DONE,
+                  stop_time=time.time())
+
+
+class Sweep(object):
+    """
+    Runs every trial of a hyperparameter grid in a bounded pool of
+    processes, one process per trial.
+
+    Rerunning a sweep on the same SQLite file skips finished trials and
+    restarts the ones left running.
+
+    Parameters
+    ----------
+    yaml_template: str
+        YAML of a `Train` object with %(name)s fields for the
+        hyperparameters and for the file parameters.
+    db_path: str
+        Path of the SQLite file recording the sweep.
+    out_dir: str
+        The `save_path` file parameter of each trial is
+        `out_dir/<trial id>`.
+    default_hyperparams: dict
+        Nested hyperparameters shared by all trials.
+    generators: list of generators, optional
+        Generators of (dotted key, value) pairs, see `jobman_generators`.
+    file_params: dict, optional
+        Other file parameters shared by all trials.
+    extract_results: callable, optional
+        Maps a trained model to a dictionary of results.
+    num_workers: int, optional
+        Number of trials run at once. Defaults to the number of CPUs.
+    channel_names, stopping: optional
+        See `SweepRecorder`.
+    memory_limit, cpu_time_limit: int, optional
+        Per-trial limits, see `set_limits`.
+    time_budget: int, optional
+        Per-trial wall clock seconds.
+    poll_interval: float, optional
+        Seconds between checks of the running trials.
+    """
+    def __init__(self, yaml_template, db_path, out_dir, default_hyperparams,
+                 generators=(), file_params=None, extract_results=None,
+                 num_workers=None, channel_names=None, stopping=None,
+                 memory_limit=None, cpu_time_limit=None, time_budget=None,
+                 poll_interval=1.):
+        self.yaml_template = yaml_template
+        self.db = SweepDB(db_path)
+        self.out_dir = out_dir
+        self.extract_results = extract_results
+        self.num_workers = num_workers or mp.cpu_count()
+        self.channel_names = channel_names
+        self.stopping = stopping
+        self.memory_limit = memory_limit
+        self.cpu_time_limit = cpu_time_limit
+        self.time_budget = time_budget
+        self.poll_interval = poll_interval
+
+        self.trials = []
+        for hyperparams in expand_grid(default_hyperparams, *generators):
+            t_id = trial_id(hyperparams)
+            params = {"save_path": path.join(out_dir, t_id)}
+            params.update(file_params or {})
+            self.trials.append(
+                (t_id, fill_yaml(yaml_template, hyperparams, params)))
+            self.db.add_trial(t_id, hyperparams)
+
+    def run(self):
+        """
+        Runs the trials which are not finished yet.
+        """
+        self.db.reset_running()
+        waiting = set(t["id"] for t in self.db.trials(WAITING))
+        pending = [t for t in self.trials if t[0] in waiting]
+        logger.info("Running %d of %d trials on %d workers"
+                    % (len(pending), len(self.trials), self.num_workers))
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.num_workers:
+                    t_id, yaml_string = pending.pop(0)
+                    process = mp.Process(
+                        target=run_trial,
+                        args=(self.db.db_path, t_id, yaml_string,
+                              self.extract_results, self.channel_names,
+                              self.stopping, self.memory_limit,
+                              self.cpu_time_limit, self.time_budget))
+                    process.start()
+                    running[t_id] = process
+                time.sleep(self.poll_interval)
+                for t_id, process in list(running.items()):
+                    if process.is_alive():
+                        continue
+                    process.join()
+                    del running[t_id]
+                    if process.exitcode != 0:
+                        # Killed before it could record its failure
+                        self.db.set_status(
+                            t_id, FAILED, stop_time=time.time(),
+                            error="Exit code %d" % process.exitcode)
+                    logger.info("Trial %s finished" % t_id)
+        finally:
+            for process in running.values():
+                process.terminate()
+
+
+def summary(db, results_of_interest=()):
+    """
+    Returns a text table of the trials of a sweep.
+    """
+    lines = ["\t".join(["id", "status"] + list(results_of_interest))]
+    for trial in db.trials():
+        results = trial["results"] or {}
+        lines.append("\t".join(
+            [trial["id"], STATUS_NAMES[trial["status"]]] +
+            [str(results.get(k, "")) for k in results_of_interest]))
+    return "\n".join(lines)
+
+
+def main(args):
+    logger.info("Loading module %s" % args.experiment)
+    experiment_module = imp.load_source("module.name", args.experiment)
+    db_path = serial.preprocess(args.db_path)
+    results_of_interest = getattr(experiment_module, "results_of_interest",
+                                  [])
+    if args.summary:
+        print(summary(SweepDB(db_path), results_of_interest))
+        return
+
+    out_dir = serial.preprocess(args.out_dir)
+    if not path.isdir(out_dir):
+        os.makedirs(out_dir)
+    if hasattr(experiment_module, "generators"):
+        generators = experiment_module.generators()
+    else:
+        generators = []
+    stopping = None
+    if args.stop_channel is not None:
+        stopping = MedianStopping(args.stop_channel,
+                                  grace_epochs=args.grace_epochs)
+    megabyte = 1024 * 1024
+    sweep = Sweep(open(experiment_module.yaml_file).read(), db_path, out_dir,
+                  experiment_module.default_hyperparams(),
+                  generators=generators,
+                  file_params=getattr(experiment_module, "file_params", None),
+                  extract_results=getattr(experiment_module,
+                                          "extract_results", None),
+                  num_workers=args.num_workers,
+                  stopping=stopping,
+                  memory_limit=(args.memory_limit * megabyte
+                                if args.memory_limit else None),
+                  cpu_time_limit=args.cpu_time_limit,
+                  time_budget=args.time_budget)
+    sweep.run()
+    print(summary(sweep.db, results_of_interest))
+
+
+def make_argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("experiment")
+    parser.add_argument("db_path")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("-o", "--out_dir", default="${PYLEARN2_OUTS}")
+    parser.add_argument("-n", "--num_workers", type=int, default=None)
+    parser.add_argument("-m", "--memory_limit", type=int, default=None,
+                        help="Per-trial memory limit, in MB")
+    parser.add_argument("-c", "--cpu_time_limit", type=int, default=None,
+                        help="Per-trial CPU time limit, in seconds")
+    parser.add_argument("-t", "--time_budget", type=int, default=None,
+                        help="Per-trial wall clock limit, in seconds")
+    parser.add_argument("-s", "--stop_channel", default=None,
+                        help="Stop trials behind the median on this channel")
+    parser.add_argument("-g", "--grace_epochs", type=int, default=5)
+    parser.add_argument("--summary", action="store_true")
+    return parser
+
+if __name__ == "__main__":
+    parser = make_argument_parser()
+    args = parser.parse_args()
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    main(args)
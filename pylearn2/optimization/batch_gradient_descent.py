@@ -22,6 +22,7 @@ import theano.tensor as T
 
 from pylearn2.compat import OrderedDict
 from pylearn2.utils import function
+from pylearn2.utils.compile import cached_function
 from pylearn2.utils import grad
 from pylearn2.utils import safe_zip
 from pylearn2.utils import sharedX
@@ -140,7 +141,7 @@ class BatchGradientDescent(object):
         if self.accumulate:
             self._compute_grad = Accumulator(inputs, updates=updates)
         else:
-            self._compute_grad = function(
+            self._compute_grad = cached_function(
                 inputs,
                 updates=updates,
                 mode=self.theano_function_mode,
@@ -154,8 +155,9 @@ class BatchGradientDescent(object):
         if self.accumulate:
             self.obj = Accumulator(inputs, obj)
         else:
-            self.obj = function(inputs, obj, mode=self.theano_function_mode,
-                                name='BatchGradientDescent.obj')
+            self.obj = cached_function(inputs, obj,
+                                       mode=self.theano_function_mode,
+                                       name='BatchGradientDescent.obj')
 
         if self.verbose:
             logger.info('done')
@@ -183,7 +185,7 @@ class BatchGradientDescent(object):
             mul = scaled_alpha * g
             diff = cached - mul
             goto_updates[param] = diff
-        self._cache_values = function(
+        self._cache_values = cached_function(
             [],
             updates=cache_updates,
             mode=self.theano_function_mode,
@@ -191,7 +193,7 @@ class BatchGradientDescent(object):
         assert isinstance(param_constrainers, (list, tuple))
         for param_constrainer in param_constrainers:
             param_constrainer(goto_updates)
-        self._goto_alpha = function(
+        self._goto_alpha = cached_function(
             [alpha],
             updates=goto_updates,
             mode=self.theano_function_mode,
@@ -211,11 +213,11 @@ class BatchGradientDescent(object):
             self.new_weight * norm + (1.-self.new_weight) * self.ave_grad_size
 
         self._normalize_grad = \
-            function([],
-                     norm,
-                     updates=normalize_grad_updates,
-                     mode=self.theano_function_mode,
-                     name='BatchGradientDescent._normalize_grad')
+            cached_function([],
+                            norm,
+                            updates=normalize_grad_updates,
+                            mode=self.theano_function_mode,
+                            name='BatchGradientDescent._normalize_grad')
 
         if self.conjugate:
             grad_shared = self.param_to_grad_shared.values()
@@ -226,11 +228,12 @@ class BatchGradientDescent(object):
                     sharedX(elem.get_value(), 'old_'+elem.name)
 
             self._store_old_grad = \
-                function([norm],
-                         updates=OrderedDict([(grad_to_old_grad[g_], g_ * norm)
-                                             for g_ in grad_to_old_grad]),
-                         mode=self.theano_function_mode,
-                         name='BatchGradientDescent._store_old_grad')
+                cached_function(
+                    [norm],
+                    updates=OrderedDict([(grad_to_old_grad[g_], g_ * norm)
+                                         for g_ in grad_to_old_grad]),
+                    mode=self.theano_function_mode,
+                    name='BatchGradientDescent._store_old_grad')
 
             grad_ordered = list(grad_to_old_grad.keys())
             old_grad_ordered = [grad_to_old_grad[g_] for g_ in grad_ordered]
@@ -271,9 +274,9 @@ class BatchGradientDescent(object):
                         + var_descriptor(u) + '\n')
 
             self._make_conjugate = \
-                function([], updates=make_conjugate_updates,
-                         mode=self.theano_function_mode,
-                         name='BatchGradientDescent._make_conjugate')
+                cached_function([], updates=make_conjugate_updates,
+                                mode=self.theano_function_mode,
+                                name='BatchGradientDescent._make_conjugate')
 
             if mode is not None and hasattr(mode, 'record'):
                 for output in self._make_conjugate.maker.fgraph.outputs:
@@ -30,6 +30,9 @@ optional arguments:
 """
 
 import argparse
+import hashlib
+import multiprocessing
+import os
 import warnings
 import numpy
 import logging
@@ -224,6 +227,11 @@ def compute_log_ais_weights(batch_size, free_energy_fn, sample_fn, betas):
     -------
     log_ais_w : theano.tensor.vector
         Vector containing log ais-weights
+
+    See Also
+    --------
+    make_ais_step, run_ais : the same computation with a single function
+        call per temperature
     """
     # Initialize log-ais weights
     log_ais_w = numpy.zeros(batch_size, dtype=floatX)
@@ -274,6 +282,25 @@ def estimate_from_weights(log_ais_w):
     return dlogz, var_dlogz
 
 
+def effective_sample_size(log_ais_w):
+    """
+    Effective number of independent samples of a set of importance
+    weights, (sum_m w^{(m)})^2 / sum_m (w^{(m)})^2
+
+    Parameters
+    ----------
+    log_ais_w : numpy.ndarray
+        Vector containing log_ais_w^{(m)}
+
+    Returns
+    -------
+    ess : scalar
+        Effective sample size, between 1 and len(log_ais_w)
+    """
+    w = numpy.exp(log_ais_w - numpy.max(log_ais_w))
+    return numpy.sum(w) ** 2 / numpy.sum(w ** 2)
+
+
 def compute_log_za(b_list, pa_bias, marginalize_odd=True):
     """
     Compute the exact partition function of model p_A(h1)
@@ -303,6 +330,356 @@ def compute_log_za(b_list, pa_bias, marginalize_odd=True):
     return log_za
 
 
+def init_base_samples(nsamples, b_list, pa_bias, rng):
+    """
+    Draws exact samples of the base model p_A into the negative chains
+
+    Parameters
+    ----------
+    nsamples : array-like object of theano shared variables
+        Negative samples
+    b_list : array-like object of theano shared variables
+        Biases of the DBM
+    pa_bias : array-like object of theano shared variables
+        Biases for the A model
+    rng : numpy.random.RandomState
+        Random number generator
+    """
+    for i, nsample_i in enumerate(nsamples):
+        batch_size = nsample_i.get_value().shape[0]
+        bias = pa_bias if i == 1 else b_list[i].get_value()
+        hi_mean_vec = 1. / (1. + numpy.exp(-bias))
+        hi_mean = numpy.tile(hi_mean_vec, (batch_size, 1))
+        r = rng.random_sample(hi_mean.shape)
+        hi_sample = numpy.array(hi_mean > r, dtype=floatX)
+        nsample_i.set_value(hi_sample)
+
+
+def make_ais_step(W_list, b_list, nsamples, pa_bias, marginalize_odd=True,
+                  theano_rng=None):
+    """
+    Builds a function performing one AIS transition per call: it adds the
+    free-energy difference of the current samples between temperatures
+    beta_k and beta_{k+1} to the log AIS weights, and samples the chains
+    from p_{k+1}, without transferring anything to the host.
+
+    Parameters
+    ----------
+    W_list : array-like object of theano shared variables
+        Weight matrices of the DBM. Its first element is ignored, since in the
+        Pylearn2 framework a visible layer does not have a weight matrix.
+    b_list : array-like object of theano shared variables
+        Biases of the DBM
+    nsamples : array-like object of theano shared variables
+        Negative samples, i.e. the states of the AIS chains
+    pa_bias : array-like object of theano shared variables
+        Biases for the A model
+    marginalize_odd : boolean
+        Whether to marginalize odd layers
+    theano_rng : theano RandomStreams
+        Random number generator
+
+    Returns
+    -------
+    step_fn : theano.function
+        Function of (beta_k, beta_{k+1}) updating `log_ais_w` and
+        `nsamples`
+    log_ais_w : theano shared variable
+        Vector of log AIS weights of the chains, initialized at zero
+    """
+    bp = T.scalar('bp')
+    bp1 = T.scalar('bp1')
+    batch_size = nsamples[0].get_value().shape[0]
+    log_ais_w = theano.shared(numpy.zeros(batch_size), name='log_ais_w')
+
+    delta = (free_energy_at_beta(W_list, b_list, nsamples, bp, pa_bias,
+                                 marginalize_odd=marginalize_odd) -
+             free_energy_at_beta(W_list, b_list, nsamples, bp1, pa_bias,
+                                 marginalize_odd=marginalize_odd))
+    updates = OrderedDict()
+    updates[log_ais_w] = log_ais_w + T.cast(delta, log_ais_w.dtype)
+    new_nsamples = neg_sampling(W_list, b_list, nsamples, beta=bp1,
+                                pa_bias=pa_bias,
+                                marginalize_odd=marginalize_odd,
+                                theano_rng=theano_rng)
+    for (nsample, new_nsample) in zip(nsamples, new_nsamples):
+        updates[nsample] = new_nsample
+    step_fn = theano.function([bp, bp1], [], updates=updates,
+                              name='ais_step')
+
+    return step_fn, log_ais_w
+
+
+def _save_ais_checkpoint(checkpoint, index, state, key=None):
+    """
+    Atomically saves the AIS temperature index, the values of the shared
+    variables in `state` and the `key` they belong to to `checkpoint`
+    """
+    arrays = dict(('state%d' % i, var.get_value())
+                  for i, var in enumerate(state))
+    if key is not None:
+        arrays['key'] = numpy.array(key)
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'wb') as f:
+        numpy.savez(f, index=index, **arrays)
+    os.rename(tmp, checkpoint)
+
+
+def _ais_checkpoint_key(arrays, *params):
+    """
+    Returns a hash of the contents of `arrays` and of `params`, identifying
+    the AIS run an AIS checkpoint belongs to
+    """
+    md5 = hashlib.md5(repr(params).encode('utf-8'))
+    for array in arrays:
+        array = numpy.ascontiguousarray(array)
+        md5.update(repr((array.dtype.str, array.shape)).encode('utf-8'))
+        md5.update(array.data)
+    return md5.hexdigest()
+
+
+def run_ais(step_fn, log_ais_w, nsamples, betas, theano_rng=None,
+            checkpoint=None, checkpoint_freq=1000, key=None):
+    """
+    Anneals the chains through all the temperatures of `betas`.
+
+    Parameters
+    ----------
+    step_fn : theano.function
+        Transition function built by `make_ais_step`
+    log_ais_w : theano shared variable
+        Log AIS weights updated by `step_fn`
+    nsamples : array-like object of theano shared variables
+        States of the chains updated by `step_fn`
+    betas : array-like object of scalars
+        Inverse temperature parameters
+    theano_rng : theano RandomStreams, optional
+        Random number generator used by `step_fn`, whose state is
+        checkpointed as well
+    checkpoint : str, optional
+        Path of a .npz file where the weights, the chains and the
+        random state are saved every `checkpoint_freq` temperatures and
+        once all the temperatures are done. If it exists, AIS resumes from
+        it.
+    checkpoint_freq : int, optional
+        Number of temperatures between checkpoints
+    key : str, optional
+        Identifies the model and the annealing schedule, see
+        `_ais_checkpoint_key`. It is saved with the checkpoint, and an
+        existing checkpoint saved with another key is ignored.
+
+    Returns
+    -------
+    log_ais_w : numpy.ndarray
+        Vector containing log ais-weights
+    """
+    state = list(nsamples) + [log_ais_w]
+    if theano_rng is not None:
+        state += [rstate for rstate, _ in theano_rng.state_updates]
+
+    start = 0
+    if checkpoint is not None and os.path.exists(checkpoint):
+        saved = numpy.load(checkpoint)
+        try:
+            saved_key = str(saved['key']) if 'key' in saved.files else None
+            if key is not None and saved_key != key:
+                logging.warning('Ignoring AIS checkpoint %s, which belongs '
+                                'to another model or annealing schedule'
+                                % checkpoint)
+            else:
+                start = int(saved['index'])
+                for i, var in enumerate(state):
+                    var.set_value(saved['state%d' % i])
+                logging.info('Resuming AIS from temperature %f'
+                             % betas[start])
+        finally:
+            saved.close()
+
+    for i in xrange(start, len(betas) - 1):
+        step_fn(betas[i], betas[i+1])
+        if i % 1e3 == 0:
+            logging.info('Temperature %f ' % betas[i+1])
+        if checkpoint is not None and (i + 1) % checkpoint_freq == 0:
+            _save_ais_checkpoint(checkpoint, i + 1, state, key)
+
+    if (checkpoint is not None and start < len(betas) - 1 and
+            (len(betas) - 1) % checkpoint_freq != 0):
+        _save_ais_checkpoint(checkpoint, len(betas) - 1, state, key)
+
+    return log_ais_w.get_value()
+
+
+def ais_chain_group(W_values, b_values, pa_bias, betas, batch_size, seed,
+                    marginalize_odd=True, checkpoint=None,
+                    checkpoint_freq=1000):
+    """
+    Runs AIS on a group of `batch_size` chains, with their own random
+    number generators, and returns their log AIS weights.
+
+    Parameters
+    ----------
+    W_values : list of numpy.ndarray
+        Weight matrices of the hidden layers of the DBM
+    b_values : list of numpy.ndarray
+        Biases of the DBM
+    pa_bias : numpy.ndarray
+        Biases for the A model
+    betas : array-like object of scalars
+        Inverse temperature parameters
+    batch_size : int
+        Number of chains
+    seed : int
+        Seed of the chains
+    marginalize_odd : boolean
+        Whether to marginalize odd layers
+    checkpoint, checkpoint_freq : optional
+        See `run_ais`. The checkpoint is only resumed from if it was saved
+        for the same parameters, temperatures, number of chains and seed.
+
+    Returns
+    -------
+    log_ais_w : numpy.ndarray
+        Vector containing log ais-weights
+    """
+    group_rng = numpy.random.RandomState(seed)
+    group_theano_rng = RandomStreams(group_rng.randint(2**30))
+    W_list = [None] + [theano.shared(W) for W in W_values]
+    b_list = [theano.shared(b) for b in b_values]
+    nsamples = [utils.sharedX(numpy.zeros((batch_size, b.shape[0])),
+                              name='nsamples%i' % i)
+                for i, b in enumerate(b_values)]
+    init_base_samples(nsamples, b_list, pa_bias, group_rng)
+    step_fn, log_ais_w = make_ais_step(W_list, b_list, nsamples, pa_bias,
+                                       marginalize_odd, group_theano_rng)
+    key = None
+    if checkpoint is not None:
+        key = _ais_checkpoint_key(list(W_values) + list(b_values) +
+                                  [pa_bias, betas],
+                                  batch_size, seed, bool(marginalize_odd))
+    return run_ais(step_fn, log_ais_w, nsamples, betas, group_theano_rng,
+                   checkpoint, checkpoint_freq, key)
+
+
+def _make_worker_pool(num_workers):
+    """
+    Returns a pool of `num_workers` processes running Theano on the CPU,
+    or None if no such pool can be made.
+
+    Forked processes inherit the CUDA context of this process, which they
+    cannot use. When Theano runs on a GPU, the workers are therefore
+    spawned as fresh interpreters with the device set to the CPU, which
+    requires Python 3.4 or later.
+    """
+    if theano.config.device == 'cpu':
+        return multiprocessing.Pool(num_workers)
+    if not hasattr(multiprocessing, 'get_context'):
+        warnings.warn("Worker processes cannot use the GPU and can only be "
+                      "forked on this version of Python, so the AIS chains "
+                      "are run in the current process.")
+        return None
+    flags = os.environ.get('THEANO_FLAGS')
+    os.environ['THEANO_FLAGS'] = ','.join(f for f in [flags, 'device=cpu']
+                                          if f)
+    try:
+        # The workers are started, and import Theano, right away
+        return multiprocessing.get_context('spawn').Pool(num_workers)
+    finally:
+        if flags is None:
+            del os.environ['THEANO_FLAGS']
+        else:
+            os.environ['THEANO_FLAGS'] = flags
+
+
+def _ais_chain_group(args):
+    """
+    Unpacks the arguments of `ais_chain_group`, for `Pool.map`
+    """
+    return ais_chain_group(*args)
+
+
+def compute_log_ais_weights_parallel(W_list, b_list, pa_bias, betas,
+                                     batch_size, num_groups=1,
+                                     num_workers=None, marginalize_odd=True,
+                                     checkpoint=None, checkpoint_freq=1000,
+                                     seed=None):
+    """
+    Compute log of the AIS weights of `num_groups` independent groups of
+    `batch_size` chains, spread over a pool of `num_workers` processes.
+
+    Parameters
+    ----------
+    W_list : array-like object of theano shared variables
+        Weight matrices of the DBM. Elements which are None (such as a
+        placeholder for the visible layer) are ignored.
+    b_list : array-like object of theano shared variables
+        Biases of the DBM
+    pa_bias : numpy.ndarray
+        Biases for the A model
+    betas : array-like object of scalars
+        Inverse temperature parameters
+    batch_size : int
+        Number of chains per group
+    num_groups : int, optional
+        Number of groups of chains
+    num_workers : int, optional
+        Number of processes. By default, groups are run one after the
+        other in the current process. The workers always run Theano on
+        the CPU: when Theano runs on a GPU, they are started with the
+        'spawn' method (Python 3.4 or later, otherwise the groups run in
+        the current process), so the calling script must be importable
+        without side effects, i.e. guarded by `if __name__ == '__main__'`.
+    marginalize_odd : boolean, optional
+        Whether to marginalize odd layers
+    checkpoint : str, optional
+        Prefix of the checkpoint file of each group,
+        '<checkpoint>.<group>.npz', from which an interrupted run resumes.
+        The files are removed once all the groups are done. See
+        `ais_chain_group`.
+    checkpoint_freq : int, optional
+        See `run_ais`
+    seed : int, optional
+        Seed of the first group, the others using the following
+        integers. Drawn from the module's rng by default.
+
+    Returns
+    -------
+    log_ais_w : numpy.ndarray
+        Vector containing the log ais-weights of all the chains
+    """
+    W_values = [W.get_value() for W in W_list if W is not None]
+    b_values = [b.get_value() for b in b_list]
+    if seed is None:
+        seed = rng.randint(2**30)
+
+    tasks = []
+    for group in xrange(num_groups):
+        group_checkpoint = None
+        if checkpoint is not None:
+            group_checkpoint = '%s.%d.npz' % (checkpoint, group)
+        tasks.append((W_values, b_values, pa_bias, betas, batch_size,
+                      seed + group, marginalize_odd, group_checkpoint,
+                      checkpoint_freq))
+
+    pool = None
+    if num_workers is not None and num_workers > 1:
+        pool = _make_worker_pool(num_workers)
+    if pool is None:
+        log_ais_w = [_ais_chain_group(task) for task in tasks]
+    else:
+        try:
+            log_ais_w = pool.map(_ais_chain_group, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    if checkpoint is not None:
+        for task in tasks:
+            if os.path.exists(task[7]):
+                os.remove(task[7])
+
+    return numpy.concatenate(log_ais_w)
+
+
 def compute_likelihood_given_logz(nsamples, psamples, batch_size, energy_fn,
                                   inference_fn, log_z, test_x):
     """
@@ -511,7 +888,9 @@ def _e_step(psamples, W_list, b_list, n_steps=100, eps=1e-5):
 
 def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
                         batch_size=100, large_ais=False, log_z=None,
-                        pos_mf_steps=50, pos_sample_steps=0):
+                        pos_mf_steps=50, pos_sample_steps=0, num_groups=1,
+                        num_workers=None, checkpoint=None,
+                        checkpoint_freq=1000):
     """
     Compute estimate of log-partition function and likelihood of trainset and
     testset
@@ -538,6 +917,15 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
     pos_sample_steps: same thing as pos_mf_steps
         when both pos_mf_steps > 0 and pos_sample_steps > 0,
         pos_mf_steps has a priority
+    num_groups : integer
+        Number of independent groups of `batch_size` AIS chains
+    num_workers : integer
+        Number of processes running the groups of AIS chains
+    checkpoint : str
+        Prefix of the files where the AIS state of each group is
+        periodically saved, and from which AIS resumes
+    checkpoint_freq : integer
+        Number of temperatures between AIS checkpoints
 
     Returns
     -------
@@ -606,35 +994,10 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
     mean_pos = numpy.maximum(mean_pos, 1e-5)
     pa_bias = -numpy.log(1./mean_pos[0] - 1.)
 
-    # Build Theano function to sample from interpolating distributions.
-    updates = OrderedDict()
-    new_nsamples = neg_sampling(W_list, b_list, nsamples, beta=beta,
-                                pa_bias=pa_bias,
-                                marginalize_odd=marginalize_odd,
-                                theano_rng=theano_rng)
-    for (nsample, new_nsample) in zip(nsamples, new_nsamples):
-        updates[nsample] = new_nsample
-    sample_fn = theano.function([beta], [], updates=updates,
-                                name='sample_func')
-
-    # Build function to compute free-energy of p_k(h1).
-    fe_bp_h1 = free_energy_at_beta(W_list, b_list, nsamples, beta,
-                                   pa_bias, marginalize_odd=marginalize_odd)
-    free_energy_fn = theano.function([beta], fe_bp_h1)
-
     ###########
     ## RUN AIS
     ###########
 
-    # Generate exact sample for the base model.
-    for i, nsample_i in enumerate(nsamples):
-        bias = pa_bias if i == 1 else b_list[i].get_value()
-        hi_mean_vec = 1. / (1. + numpy.exp(-bias))
-        hi_mean = numpy.tile(hi_mean_vec, (batch_size, 1))
-        r = rng.random_sample(hi_mean.shape)
-        hi_sample = numpy.array(hi_mean > r, dtype=floatX)
-        nsample_i.set_value(hi_sample)
-
     # Default configuration for interpolating distributions
     if large_ais:
         betas = numpy.cast[floatX](
@@ -648,8 +1011,11 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
                          numpy.linspace(0.9, 1.0, 1e4))))
 
     if log_z is None:
-        log_ais_w = compute_log_ais_weights(batch_size, free_energy_fn,
-                                            sample_fn, betas)
+        log_ais_w = compute_log_ais_weights_parallel(
+            W_list, b_list, pa_bias, betas, batch_size,
+            num_groups=num_groups, num_workers=num_workers,
+            marginalize_odd=marginalize_odd, checkpoint=checkpoint,
+            checkpoint_freq=checkpoint_freq)
         dlogz, var_dlogz = estimate_from_weights(log_ais_w)
         log_za = compute_log_za(b_list, pa_bias, marginalize_odd)
         log_z = log_za + dlogz
@@ -657,6 +1023,8 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
         logging.info('log_za = %f' % log_za)
         logging.info('dlogz = %f' % dlogz)
         logging.info('var_dlogz = %f' % var_dlogz)
+        logging.info('effective sample size = %f of %d chains'
+                     % (effective_sample_size(log_ais_w), len(log_ais_w)))
 
     train_ll = compute_likelihood_given_logz(nsamples, psamples, batch_size,
                                              energy_fn, inference_fn, log_z,
@@ -682,6 +1050,12 @@ if __name__ == '__main__':
     parser.add_argument("dataset", help="the dataset used for computing the " +
                         "metric", choices=datasets.keys())
     parser.add_argument("model_path", help="path to the pickled DBM model")
+    parser.add_argument("--num_groups", type=int, default=1,
+                        help="number of independent groups of AIS chains")
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="number of processes running the AIS chains")
+    parser.add_argument("--checkpoint", default=None,
+                        help="prefix of the AIS checkpoint files")
     args = parser.parse_args()
 
     metric = metrics[args.metric]
@@ -696,4 +1070,6 @@ if __name__ == '__main__':
     trainset = dataset(which_set='train')
     testset = dataset(which_set='test')
 
-    metric(W_list, b_list, trainset, testset, pos_mf_steps=5)
+    metric(W_list, b_list, trainset, testset, pos_mf_steps=5,
+           num_groups=args.num_groups, num_workers=args.num_workers,
+           checkpoint=args.checkpoint)
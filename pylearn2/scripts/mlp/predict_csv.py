@@ -15,8 +15,7 @@ Optionally it is possible to specify if the prediction is regression or
 classification (default is classification). The predicted variables are
 integer by default.
 Based on this script: http://fastml.com/how-to-get-predictions-from-pylearn2/.
-This script doesn't use batches. If you run out of memory it could be 
-resolved by implementing a batch version.
+Predictions are computed in batches with `pylearn2.inference.Predictor`.
 
 """
 from __future__ import print_function
@@ -29,9 +28,9 @@ import os
 import argparse
 import numpy as np
 
+from pylearn2.inference import Predictor
 from pylearn2.utils import serial
 from theano import tensor as T
-from theano import function
 
 
 def make_argument_parser():
@@ -62,6 +61,9 @@ def make_argument_parser():
                         dest='has_row_label',
                         action='store_true',
                         help='Indicates the first column in the input file is row labels')
+    parser.add_argument('--batch_size', '-B',
+                        type=int, default=100,
+                        help='Number of rows to predict at once')
     parser.add_argument('--delimiter', '-D',
                         default=',',
                         help="Specifies the CSV delimiter for the test file. Usual values are \
@@ -69,7 +71,8 @@ def make_argument_parser():
     return parser
 
 def predict(model_path, test_path, output_path, predictionType="classification", outputType="int",
-            headers=False, first_col_label=False, delimiter=","):
+            headers=False, first_col_label=False, delimiter=",",
+            batch_size=100):
     """
     Predict from a pkl file.
 
@@ -89,6 +92,8 @@ def predict(model_path, test_path, output_path, predictionType="classification",
         Indicates whether the first row in the input file is feature labels
     first_col_label : bool, optional
         Indicates whether the first column in the input file is row labels (e.g. row numbers)
+    batch_size : int, optional
+        Number of rows propagated through the model at once.
     """
 
     print("loading model...")
@@ -102,13 +107,11 @@ def predict(model_path, test_path, output_path, predictionType="classification",
 
     print("setting up symbolic expressions...")
 
-    X = model.get_input_space().make_theano_batch()
-    Y = model.fprop(X)
-
+    transform = None
     if predictionType == "classification":
-        Y = T.argmax(Y, axis=1)
+        transform = lambda Y: T.argmax(Y, axis=1)
 
-    f = function([X], Y, allow_input_downcast=True)
+    predictor = Predictor(model, batch_size=batch_size, transform=transform)
 
     print("loading data and predicting...")
 
@@ -120,7 +123,7 @@ def predict(model_path, test_path, output_path, predictionType="classification",
     if first_col_label:
         x = x[:,1:]
 
-    y = f(x)
+    y = predictor.predict(x)
 
     print("writing predictions...")
 
@@ -139,7 +142,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
     ret = predict(args.model_filename, args.test_filename, args.output_filename,
         args.prediction_type, args.output_type,
-        args.has_headers, args.has_row_label, args.delimiter)
+        args.has_headers, args.has_row_label, args.delimiter,
+        args.batch_size)
     if not ret:
         sys.exit(-1)
 
@@ -1,9 +1,14 @@
 """
 Test dbm_metrics script
 """
+import os
+import shutil
+import tempfile
+
 import numpy
 import theano
 from theano import tensor as T
+from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
 from pylearn2.models.dbm.dbm import DBM
 from pylearn2.models.dbm.layer import BinaryVector, BinaryVectorMaxPool
 from pylearn2.scripts.dbm import dbm_metrics
@@ -12,6 +17,7 @@ from pylearn2.datasets.mnist import MNIST
 from nose.plugins.skip import SkipTest
 from pylearn2.datasets.exc import NoDataPathError
 from pylearn2.testing import no_debug_mode
+from pylearn2.utils import sharedX
 
 
 @no_debug_mode
@@ -85,5 +91,99 @@ def test_ais():
     assert (real_ais_train_ll - train_ll) < 2.0
     assert (real_ais_test_ll - test_ll) < 2.0
 
+def _small_rbm(seed=1234, nvis=4, nhid=4):
+    """
+    Returns the weights, biases and base-rate biases of a small random RBM,
+    and a short annealing schedule.
+    """
+    rng = numpy.random.RandomState(seed)
+    floatX = theano.config.floatX
+    W_values = [numpy.asarray(rng.randn(nvis, nhid), dtype=floatX)]
+    b_values = [numpy.asarray(rng.randn(nvis), dtype=floatX),
+                numpy.asarray(rng.randn(nhid), dtype=floatX)]
+    pa_bias = numpy.asarray(rng.randn(nvis), dtype=floatX)
+    betas = numpy.asarray(numpy.linspace(0, 1, 11), dtype=floatX)
+    return W_values, b_values, pa_bias, betas
+
+
+def _interrupted_chain_group(W_values, b_values, pa_bias, betas, batch_size,
+                             seed, stop, checkpoint, key):
+    """
+    Runs the chains of `dbm_metrics.ais_chain_group` up to temperature
+    `stop` only, saving a checkpoint with the given key.
+    """
+    group_rng = numpy.random.RandomState(seed)
+    group_theano_rng = RandomStreams(group_rng.randint(2**30))
+    W_list = [None] + [theano.shared(W) for W in W_values]
+    b_list = [theano.shared(b) for b in b_values]
+    nsamples = [sharedX(numpy.zeros((batch_size, b.shape[0])))
+                for b in b_values]
+    dbm_metrics.init_base_samples(nsamples, b_list, pa_bias, group_rng)
+    step_fn, log_ais_w = dbm_metrics.make_ais_step(
+        W_list, b_list, nsamples, pa_bias, True, group_theano_rng)
+    dbm_metrics.run_ais(step_fn, log_ais_w, nsamples, betas[:stop + 1],
+                        group_theano_rng, checkpoint, stop, key)
+
+
+@no_debug_mode
+def test_ais_chain_groups():
+    """
+    Test that independent groups of chains give the same weights as
+    single-group runs with the same seeds.
+    """
+    W_values, b_values, pa_bias, betas = _small_rbm()
+    W_list = [theano.shared(W) for W in W_values]
+    b_list = [theano.shared(b) for b in b_values]
+    log_ais_w = dbm_metrics.compute_log_ais_weights_parallel(
+        W_list, b_list, pa_bias, betas, 5, num_groups=2, seed=42)
+    assert log_ais_w.shape == (10,)
+    expected = [dbm_metrics.ais_chain_group(W_values, b_values, pa_bias,
+                                            betas, 5, seed)
+                for seed in [42, 43]]
+    assert numpy.allclose(log_ais_w, numpy.concatenate(expected))
+
+
+@no_debug_mode
+def test_ais_checkpoint():
+    """
+    Test resuming AIS from a checkpoint, and ignoring a checkpoint that
+    belongs to another run.
+    """
+    W_values, b_values, pa_bias, betas = _small_rbm()
+    expected = dbm_metrics.ais_chain_group(W_values, b_values, pa_bias,
+                                           betas, 5, 42)
+    key = dbm_metrics._ais_checkpoint_key(
+        list(W_values) + list(b_values) + [pa_bias, betas], 5, 42, True)
+    directory = tempfile.mkdtemp()
+    try:
+        checkpoint = os.path.join(directory, 'ais.npz')
+
+        # resumed from the middle of the annealing schedule
+        _interrupted_chain_group(W_values, b_values, pa_bias, betas, 5, 42,
+                                 5, checkpoint, key)
+        assert int(numpy.load(checkpoint)['index']) == 5
+        log_ais_w = dbm_metrics.ais_chain_group(
+            W_values, b_values, pa_bias, betas, 5, 42, checkpoint=checkpoint)
+        assert numpy.allclose(log_ais_w, expected)
+
+        # a checkpoint of another run is not resumed from
+        _interrupted_chain_group(W_values, b_values, pa_bias, betas, 5, 7,
+                                 5, checkpoint, 'another run')
+        log_ais_w = dbm_metrics.ais_chain_group(
+            W_values, b_values, pa_bias, betas, 5, 42, checkpoint=checkpoint)
+        assert numpy.allclose(log_ais_w, expected)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_effective_sample_size():
+    """Test the effective sample size of equal and degenerate weights."""
+    assert numpy.allclose(
+        dbm_metrics.effective_sample_size(numpy.zeros(10) + 3.), 10.)
+    log_ais_w = numpy.zeros(10)
+    log_ais_w[3] = 1000.
+    assert numpy.allclose(dbm_metrics.effective_sample_size(log_ais_w), 1.)
+
+
 if __name__ == '__main__':
     test_ais()
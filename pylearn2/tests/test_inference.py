@@ -0,0 +1,88 @@
+"""
+Tests for pylearn2.inference
+"""
+import io
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+from theano import tensor as T
+from theano.compat.six.moves import urllib
+
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.inference import Predictor, make_server
+from pylearn2.models.mlp import MLP, Softmax, Tanh
+from pylearn2.utils import function
+
+
+def _make_model():
+    """Builds a small random MLP."""
+    return MLP(nvis=5, layers=[Tanh(layer_name='h', dim=4, irange=.5),
+                               Softmax(layer_name='y', n_classes=3,
+                                       irange=.5)])
+
+
+def test_predictor():
+    """Test Predictor on arrays, datasets and output files."""
+    model = _make_model()
+    rng = np.random.RandomState(0)
+    X = rng.randn(23, 5).astype(T.config.floatX)
+    X_sym = model.get_input_space().make_theano_batch()
+    expected = function([X_sym], model.fprop(X_sym))(X)
+
+    predictor = Predictor(model, batch_size=10)
+    assert np.allclose(predictor.predict(X), expected)
+
+    padded = Predictor(model, batch_size=10, fixed_batch_size=True)
+    assert np.allclose(padded.predict(X), expected)
+
+    labels = Predictor(model, batch_size=10,
+                       transform=lambda Y: T.argmax(Y, axis=1))
+    assert np.all(labels.predict(X) == expected.argmax(axis=1))
+
+    dataset = DenseDesignMatrix(X=X)
+    for prefetch in [0, 2]:
+        assert np.allclose(predictor.predict_dataset(dataset,
+                                                     prefetch=prefetch),
+                           expected)
+
+    handle, path = tempfile.mkstemp(suffix='.npy')
+    os.close(handle)
+    try:
+        predictor.predict_dataset(dataset, out=path)
+        assert np.allclose(np.load(path), expected)
+    finally:
+        os.remove(path)
+
+
+def test_server():
+    """Test the HTTP front end with JSON and .npy requests."""
+    model = _make_model()
+    predictor = Predictor(model, batch_size=4)
+    X = np.random.RandomState(0).randn(6, 5).astype(T.config.floatX)
+    expected = predictor.predict(X)
+
+    server = make_server(predictor, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://%s:%d/predict' % server.server_address[:2]
+    try:
+        request = urllib.request.Request(
+            url, json.dumps({'X': X.tolist()}).encode('utf-8'),
+            {'Content-Type': 'application/json'})
+        reply = json.loads(urllib.request.urlopen(request).read()
+                           .decode('utf-8'))
+        assert np.allclose(reply['Y'], expected)
+
+        buf = io.BytesIO()
+        np.save(buf, X)
+        request = urllib.request.Request(
+            url, buf.getvalue(), {'Content-Type': 'application/octet-stream'})
+        reply = np.load(io.BytesIO(urllib.request.urlopen(request).read()))
+        assert np.allclose(reply, expected)
+    finally:
+        server.shutdown()
+        server.server_close()
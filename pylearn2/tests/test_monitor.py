@@ -25,7 +25,7 @@ from pylearn2.utils.iteration import _iteration_schemes, has_uniform_batch_size
 from pylearn2.utils import py_integer_types
 from pylearn2.utils.serial import from_string
 from pylearn2.utils.serial import to_string
-from pylearn2.utils import sharedX
+from pylearn2.utils import sharedX, safe_izip
 from pylearn2.testing.prereqs import ReadVerifyPrereq
 
 
@@ -497,6 +497,77 @@ def test_prereqs_multidataset():
     to_string(monitor)
 
 
+def test_num_workers():
+
+    # Test that evaluating the monitoring datasets concurrently gives
+    # the same channel values as the serial path
+
+    NUM_DATASETS = 4
+    NUM_FEATURES = 3
+
+    def run(num_workers):
+        model = DummyModel(NUM_FEATURES)
+        monitor = Monitor.get_monitor(model)
+        monitor.set_num_workers(num_workers)
+        for i in xrange(NUM_DATASETS):
+            dataset = DummyDataset(num_examples=10 * (i + 1),
+                                   num_features=NUM_FEATURES)
+            dataset.X[:] *= i
+            monitor.add_dataset(dataset, 'sequential', batch_size=3)
+            vis_batch = T.matrix()
+            monitor.add_channel(name=str(i),
+                                ipt=vis_batch,
+                                val=vis_batch.mean(),
+                                dataset=dataset,
+                                data_specs=(model.get_input_space(),
+                                            model.get_input_source()))
+        monitor()
+        monitor()
+        return [monitor.channels[str(i)].val_record
+                for i in xrange(NUM_DATASETS)]
+
+    assert run(None) == run(3)
+    assert_raises(ValueError, Monitor(DummyModel(1)).set_num_workers, 0)
+
+
+def test_schedule():
+
+    # Test that the monitor alternates between full evaluations and
+    # estimates on a fixed subset, and records which is which
+
+    num_features = 2
+    monitor = Monitor(DummyModel(num_features))
+    dataset = DummyDataset(20, num_features)
+    monitor.add_dataset(dataset=dataset, mode='sequential', batch_size=4)
+    vis_batch = T.matrix()
+    data_specs = (monitor.model.get_input_space(),
+                  monitor.model.get_input_source())
+    monitor.add_channel(name='mean', ipt=vis_batch, val=vis_batch.mean(),
+                        dataset=dataset, data_specs=data_specs)
+    monitor.set_schedule(subset_batches=2, full_every=3)
+
+    for i in xrange(4):
+        monitor()
+        monitor.report_epoch()
+    monitor.request_full_evaluation()
+    monitor()
+    monitor()
+
+    channel = monitor.channels['mean']
+    assert channel.estimate_record == ['full', 'subset', 'subset', 'full',
+                                       'full', 'subset']
+    X = dataset.get_design_matrix()
+    for estimate, val in safe_izip(channel.estimate_record,
+                                   channel.val_record):
+        if estimate == 'full':
+            assert np.allclose(val, X.mean())
+        else:
+            assert val == channel.val_record[1]
+            assert not np.allclose(val, X.mean())
+
+    assert_raises(ValueError, monitor.set_schedule, 0)
+
+
 def test_reject_bad_add_dataset():
 
     model = DummyModel(1)
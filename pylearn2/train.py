@@ -52,10 +52,19 @@ class Train(object):
         If `True`, will save the model to save_path even if there is
         already something there. Otherwise, will raise an error if the
         `save_path` is already occupied.
+    async_save : int, optional
+        If specified, the saves made during training only snapshot the
+        parameter values (see `serial.get_param_snapshot`) and write
+        them to `params_save_path` (`<save_path stem>_params.npz`, see
+        `serial.save_params`) from a background thread, with at most
+        `async_save` saves in flight. Training only blocks when that
+        bound is hit. The model itself is still saved to `save_path`,
+        synchronously, once training is over.
     """
 
     def __init__(self, dataset, model, algorithm=None, save_path=None,
-                 save_freq=0, extensions=None, allow_overwrite=True):
+                 save_freq=0, extensions=None, allow_overwrite=True,
+                 async_save=None):
         self.allow_overwrite = allow_overwrite
         self.first_save = True
         self.dataset = dataset
@@ -77,6 +86,13 @@ class Train(object):
                     tokens = os.environ['PYLEARN2_TRAIN_FILE_FULL_STEM'], 'pkl'
                 self.save_path = '.'.join(tokens)
         self.save_freq = save_freq
+        if async_save is not None and save_freq > 0:
+            self.saver = serial.AsyncSaver(async_save)
+            base, ext = os.path.splitext(self.save_path)
+            self.params_save_path = base + '_params.npz'
+            self.first_params_save = True
+        else:
+            self.saver = None
 
         if hasattr(self.dataset, 'yaml_src'):
             self.model.dataset_yaml_src = self.dataset.yaml_src
@@ -261,7 +277,13 @@ already been reported."""
         # resumed after a crash
         for extension in self.extensions:
             extension.on_save(self.model, self.dataset, self.algorithm)
-        if self.save_path is not None:
+        saver = getattr(self, 'saver', None)
+        if saver is not None and not self.model.monitor.training_succeeded:
+            self.save_params_async()
+        elif self.save_path is not None:
+            if saver is not None:
+                with log_timing(log, 'Waiting for background saves'):
+                    saver.wait()
             with log_timing(log, 'Saving to ' + self.save_path):
                 if self.first_save and (not self.allow_overwrite) \
                    and os.path.exists(self.save_path):
@@ -278,6 +300,21 @@ already been reported."""
                     self.dataset._serialization_guard = None
             self.first_save = False
 
+    def save_params_async(self):
+        """
+        Snapshots the parameter values of the model and writes them to
+        `params_save_path` in the background.
+        """
+        if self.first_params_save and (not self.allow_overwrite) \
+           and os.path.exists(self.params_save_path):
+            raise IOError("Trying to overwrite file when not allowed.")
+        with log_timing(log, 'Snapshotting parameters for ' +
+                        self.params_save_path):
+            self.saver.save(self.params_save_path,
+                            serial.get_param_snapshot(self.model),
+                            save_fn=serial.save_params)
+        self.first_params_save = False
+
 
 class SerializationGuard(object):
     """
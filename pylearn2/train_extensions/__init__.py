@@ -176,3 +176,34 @@ class ChannelSmoother(TrainExtension):
 
         self.out_ch.val_record[-1] = mean
         logger.info('\t{0}: {1}'.format(self.channel_to_publish, mean))
+
+
+class MonitoringSchedule(TrainExtension):
+    """
+    Makes the monitor estimate the channels on a fixed random subset of
+    each monitoring dataset, and only compute their exact values every
+    few epochs. See `Monitor.set_schedule`.
+
+    Parameters
+    ----------
+    subset_batches : int
+        The number of batches drawn from each monitoring dataset for the
+        estimate.
+    full_every : int, optional
+        Do a full evaluation every `full_every` epochs. If not specified,
+        full evaluations only happen on demand (see
+        `Monitor.request_full_evaluation`).
+    seed : int, list or tuple, optional
+        The seed used to pick the subset.
+    """
+
+    def __init__(self, subset_batches, full_every=None, seed=(2015, 3, 17)):
+        self.subset_batches = subset_batches
+        self.full_every = full_every
+        self.seed = seed
+
+    @functools.wraps(TrainExtension.setup)
+    def setup(self, model, dataset, algorithm):
+        model.monitor.set_schedule(self.subset_batches,
+                                   full_every=self.full_every,
+                                   seed=self.seed)
@@ -118,14 +118,27 @@ class MonitorBasedSaveBest(TrainExtension):
     tag_key : str, optional
         A unique key to use for storing diagnostic information in
         `model.tag`. If `None`, use the class name (default).
+    async_save : int, optional
+        If specified, instead of pickling the whole model to `save_path`,
+        snapshot the best parameter values and write them to
+        `<save_path stem>_params.npz` from a background thread, with at
+        most `async_save` saves in flight. See
+        `pylearn2.utils.serial.AsyncSaver` and
+        `pylearn2.utils.serial.save_params`.
     """
     def __init__(self, channel_name, save_path=None, store_best_model=False,
-                 higher_is_better=False, tag_key=None):
+                 higher_is_better=False, tag_key=None, async_save=None):
         self.channel_name = channel_name
         assert save_path is not None or store_best_model, (
             "Either save_path must be defined or store_best_model must be " +
             "True. (Or both.)")
         self.save_path = save_path
+        if async_save is not None and save_path is not None:
+            self.saver = serial.AsyncSaver(async_save)
+            base, ext = os.path.splitext(save_path)
+            self.params_save_path = base + '_params.npz'
+        else:
+            self.saver = None
         self.store_best_model = store_best_model
         self.higher_is_better = higher_is_better
         if higher_is_better:
@@ -167,6 +180,9 @@ class MonitorBasedSaveBest(TrainExtension):
         if self.save_path is not None:
             model.tag[self._tag_key]['save_path'] = os.path.abspath(
                 self.save_path)
+        if self.saver is not None:
+            model.tag[self._tag_key]['params_save_path'] = os.path.abspath(
+                self.params_save_path)
         model.tag[self._tag_key]['hostname'] = socket.gethostname()
         self._update_tag(model)
 
@@ -197,10 +213,36 @@ class MonitorBasedSaveBest(TrainExtension):
             self._update_tag(model)
             if self.store_best_model:
                 self.best_model = deepcopy(model)
-            if self.save_path is not None:
+            if self.saver is not None:
+                self.saver.save(self.params_save_path,
+                                serial.get_param_snapshot(model),
+                                save_fn=serial.save_params)
+            elif self.save_path is not None:
                 with log_timing(log, 'Saving to ' + self.save_path):
                     serial.save(self.save_path, model, on_overwrite='backup')
 
+    def on_save(self, model, dataset, algorithm):
+        """
+        At the final save of a training run, waits for the background
+        saves of the best parameters to finish, re-raising any error that
+        happened in one of them. Periodic saves during training don't
+        wait.
+
+        Parameters
+        ----------
+        model : pylearn2.models.model.Model
+            The model being trained, whose monitor tells whether training
+            is over
+        dataset : pylearn2.datasets.dataset.Dataset
+            Not used
+        algorithm : TrainingAlgorithm
+            Not used
+        """
+        monitor = getattr(model, 'monitor', None)
+        if (self.saver is not None and
+                getattr(monitor, 'training_succeeded', False)):
+            self.saver.wait()
+
     def _update_tag(self, model):
         """
         Update `model.tag` with information about the current best.
@@ -233,6 +233,9 @@ class LiveMonitoring(TrainExtension):
                         chan.time_record = chan.time_record[
                             rsp_msg.start:end:rsp_msg.step
                         ]
+                        chan.estimate_record = chan.estimate_record[
+                            rsp_msg.start:end:rsp_msg.step
+                        ]
                         chan.val_record = chan.val_record[
                             rsp_msg.start:end:rsp_msg.step
                         ]
@@ -343,6 +346,7 @@ class LiveMonitor(object):
                 chan.epoch_record += rsp_chan.epoch_record
                 chan.example_record += rsp_chan.example_record
                 chan.time_record += rsp_chan.time_record
+                chan.estimate_record += rsp_chan.estimate_record
                 chan.val_record += rsp_chan.val_record
 
     def follow_channels(self, channel_list):
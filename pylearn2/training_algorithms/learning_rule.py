@@ -497,3 +497,89 @@ class RMSProp(LearningRule):
             updates[param] = param + delta_x_t
 
         return updates
+
+
+class GradientAccumulator(object):
+    """
+    Sums the gradients of several minibatches so that a learning rule
+    can be applied to their average, as if they had been computed on a
+    single large batch.
+
+    The gradient of each minibatch is weighted by the number of examples
+    it contains, so a smaller last batch contributes proportionally.
+    The state of the learning rule itself is left alone: it is only
+    advanced by the updates built from `get_mean_grads`, i.e. once per
+    parameter update rather than once per minibatch.
+
+    Parameters
+    ----------
+    params : list
+        The shared variables being optimized.
+    """
+
+    def __init__(self, params):
+        self.accumulators = OrderedDict()
+        for param in params:
+            accumulator = sharedX(param.get_value() * 0.)
+            if param.name is not None:
+                accumulator.name = 'grad_accumulator_' + param.name
+            self.accumulators[param] = accumulator
+        self.num_examples = sharedX(0., 'grad_accumulator_num_examples')
+        self.batch_weight = T.scalar('batch_weight', dtype=config.floatX)
+
+    def get_accumulate_updates(self, grads):
+        """
+        Returns the updates adding the gradients of one minibatch to the
+        accumulators.
+
+        Parameters
+        ----------
+        grads : dict
+            A dictionary mapping from the model's parameters to their
+            gradients on the minibatch. The gradients are weighted by
+            `self.batch_weight`, which must be given the number of
+            examples in the minibatch.
+
+        Returns
+        -------
+        updates : OrderedDict
+            A dictionary mapping the accumulators to their new values.
+        """
+        updates = OrderedDict()
+        for param, accumulator in six.iteritems(self.accumulators):
+            updates[accumulator] = (accumulator +
+                                    self.batch_weight * grads[param])
+        updates[self.num_examples] = self.num_examples + self.batch_weight
+        return updates
+
+    def get_mean_grads(self):
+        """
+        Returns the average gradient of the accumulated minibatches.
+
+        Returns
+        -------
+        grads : OrderedDict
+            A dictionary mapping from the model's parameters to the
+            average of their accumulated gradients.
+        """
+        grads = OrderedDict()
+        for param, accumulator in six.iteritems(self.accumulators):
+            grads[param] = accumulator / self.num_examples
+            if param.name is not None:
+                grads[param].name = 'mean_grad_' + param.name
+        return grads
+
+    def get_reset_updates(self):
+        """
+        Returns the updates setting all the accumulators back to zero.
+
+        Returns
+        -------
+        updates : OrderedDict
+            A dictionary mapping the accumulators to zero.
+        """
+        updates = OrderedDict()
+        for accumulator in self.accumulators.values():
+            updates[accumulator] = T.zeros_like(accumulator)
+        updates[self.num_examples] = T.zeros_like(self.num_examples)
+        return updates
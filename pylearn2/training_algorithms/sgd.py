@@ -25,14 +25,17 @@ from pylearn2.monitor import Monitor
 from pylearn2.space import CompositeSpace, NullSpace
 from pylearn2.train_extensions import TrainExtension
 from pylearn2.training_algorithms.training_algorithm import TrainingAlgorithm
+from pylearn2.training_algorithms.learning_rule import GradientAccumulator
 from pylearn2.training_algorithms.learning_rule import Momentum
 from pylearn2.training_algorithms.learning_rule import MomentumAdjustor \
         as LRMomentumAdjustor
 from pylearn2.utils.iteration import is_stochastic, has_uniform_batch_size
+from pylearn2.utils.iteration import PrefetchingIterator
 from pylearn2.utils import py_integer_types, py_float_types
 from pylearn2.utils import safe_zip
 from pylearn2.utils import serial
 from pylearn2.utils import sharedX
+from pylearn2.utils.compile import cached_function
 from pylearn2.utils import contains_nan
 from pylearn2.utils import contains_inf
 from pylearn2.utils import isfinite
@@ -149,6 +152,22 @@ class SGD(TrainingAlgorithm):
     seed : valid argument to np.random.RandomState, optional
         The seed used for the random number generate to be passed to the
         training dataset iterator (if any)
+    prefetch : int, optional
+        If specified, the training batches are assembled in a background
+        thread, with at most `prefetch` batches prepared ahead of the
+        update function. See
+        :py:class:`pylearn2.utils.iteration.PrefetchingIterator`.
+    monitoring_workers : int, optional
+        If specified, the monitoring datasets are evaluated concurrently
+        by up to this many threads. See `Monitor.set_num_workers`.
+    accumulate_batches : int, optional
+        If specified, the gradients of this many consecutive minibatches
+        are averaged before each parameter update, so that the effective
+        batch size is `batch_size * accumulate_batches` while only
+        `batch_size` examples are held in memory at once. Update
+        callbacks and the monitor's batch count follow the parameter
+        updates, not the minibatches. A partial group left at the end of
+        an epoch is applied on its own.
     """
     def __init__(self, learning_rate, cost=None, batch_size=None,
                  monitoring_batch_size=None, monitoring_batches=None,
@@ -158,7 +177,8 @@ class SGD(TrainingAlgorithm):
                  set_batch_size = False,
                  train_iteration_mode = None, batches_per_iter=None,
                  theano_function_mode = None, monitoring_costs=None,
-                 seed=[2012, 10, 5]):
+                 seed=[2012, 10, 5], prefetch=None, monitoring_workers=None,
+                 accumulate_batches=None):
 
         if isinstance(cost, (list, tuple, set)):
             raise TypeError("SGD no longer supports using collections of " +
@@ -192,6 +212,18 @@ class SGD(TrainingAlgorithm):
         self.rng = make_np_rng(seed, which_method=["randn","randint"])
         self.theano_function_mode = theano_function_mode
         self.monitoring_costs = monitoring_costs
+        if prefetch is not None and prefetch < 1:
+            raise ValueError("prefetch must be a positive integer, got " +
+                             str(prefetch))
+        self.prefetch = prefetch
+        if monitoring_dataset is None and monitoring_workers is not None:
+            raise ValueError("Specified a number of monitoring workers " +
+                             "but not a monitoring dataset.")
+        self.monitoring_workers = monitoring_workers
+        if accumulate_batches is not None and accumulate_batches < 1:
+            raise ValueError("accumulate_batches must be a positive "
+                             "integer, got " + str(accumulate_batches))
+        self.accumulate_batches = accumulate_batches
 
     def _setup_monitor(self):
         """
@@ -214,6 +246,8 @@ class SGD(TrainingAlgorithm):
                                num_batches=self.monitoring_batches,
                                extra_costs=self.monitoring_costs,
                                mode=self.monitor_iteration_mode)
+            if getattr(self, 'monitoring_workers', None) is not None:
+                self.monitor.set_num_workers(self.monitoring_workers)
             dataset_name = first_key(self.monitoring_dataset)
             monitoring_dataset = self.monitoring_dataset[dataset_name]
             #TODO: have Monitor support non-data-dependent channels
@@ -345,6 +379,19 @@ class SGD(TrainingAlgorithm):
                                       'paramname': param.name})
             assert grads[param].dtype == param.dtype
 
+        accumulate = getattr(self, 'accumulate_batches', None)
+        if accumulate:
+            # The minibatch function only accumulates the gradients (and
+            # applies the cost's own updates). The parameter updates below
+            # are built from the averaged gradients and go in a separate
+            # function, together with the reset of the accumulators.
+            accumulator = GradientAccumulator(params)
+            accumulate_updates = updates
+            accumulate_updates.update(
+                accumulator.get_accumulate_updates(grads))
+            grads = accumulator.get_mean_grads()
+            updates = accumulator.get_reset_updates()
+
         lr_scalers = model.get_lr_scalers()
 
         for key in lr_scalers:
@@ -395,12 +442,21 @@ class SGD(TrainingAlgorithm):
         # for AdaDelta and RMSProp).
         self._setup_monitor()
 
+        if accumulate:
+            with log_timing(log, 'Compiling sgd_accumulate'):
+                self.sgd_accumulate = cached_function(
+                    theano_args + (accumulator.batch_weight,),
+                    updates=accumulate_updates,
+                    name='sgd_accumulate',
+                    on_unused_input='ignore',
+                    mode=self.theano_function_mode)
+            theano_args = ()
         with log_timing(log, 'Compiling sgd_update'):
-            self.sgd_update = function(theano_args,
-                                       updates=updates,
-                                       name='sgd_update',
-                                       on_unused_input='ignore',
-                                       mode=self.theano_function_mode)
+            self.sgd_update = cached_function(theano_args,
+                                              updates=updates,
+                                              name='sgd_update',
+                                              on_unused_input='ignore',
+                                              mode=self.theano_function_mode)
         self.params = params
 
     def train(self, dataset):
@@ -445,21 +501,45 @@ class SGD(TrainingAlgorithm):
                 batch_size=self.batch_size,
                 data_specs=flat_data_specs, return_tuple=True,
                 rng = rng, num_batches = self.batches_per_iter)
+        if getattr(self, 'prefetch', None):
+            iterator = PrefetchingIterator(iterator, depth=self.prefetch)
 
         on_load_batch = self.on_load_batch
-        for batch in iterator:
-            for callback in on_load_batch:
-                callback(*batch)
-            self.sgd_update(*batch)
-            # iterator might return a smaller batch if dataset size
-            # isn't divisible by batch_size
-            # Note: if data_specs[0] is a NullSpace, there is no way to know
-            # how many examples would actually have been in the batch,
-            # since it was empty, so actual_batch_size would be reported as 0.
-            actual_batch_size = flat_data_specs[0].np_batch_size(batch)
-            self.monitor.report_batch(actual_batch_size)
-            for callback in self.update_callbacks:
-                callback(self)
+        accumulate = getattr(self, 'accumulate_batches', None)
+        pending_batches = 0
+        pending_examples = 0
+        try:
+            for batch in iterator:
+                for callback in on_load_batch:
+                    callback(*batch)
+                # iterator might return a smaller batch if dataset size
+                # isn't divisible by batch_size
+                # Note: if data_specs[0] is a NullSpace, there is no way to
+                # know how many examples would actually have been in the
+                # batch, since it was empty, so actual_batch_size would be
+                # reported as 0.
+                actual_batch_size = flat_data_specs[0].np_batch_size(batch)
+                if accumulate:
+                    self.sgd_accumulate(
+                        *(tuple(batch) +
+                          (np.cast[config.floatX](actual_batch_size),)))
+                    pending_batches += 1
+                    pending_examples += actual_batch_size
+                    if pending_batches < accumulate:
+                        continue
+                    self._apply_accumulated(pending_examples)
+                    pending_batches = 0
+                    pending_examples = 0
+                else:
+                    self.sgd_update(*batch)
+                    self.monitor.report_batch(actual_batch_size)
+                    for callback in self.update_callbacks:
+                        callback(self)
+            if pending_batches > 0:
+                self._apply_accumulated(pending_examples)
+        finally:
+            if isinstance(iterator, PrefetchingIterator):
+                iterator.close()
 
         # Make sure none of the parameters have bad values
         for param in self.params:
@@ -467,6 +547,21 @@ class SGD(TrainingAlgorithm):
             if not isfinite(value):
                 raise Exception("NaN in " + param.name)
 
+    def _apply_accumulated(self, num_examples):
+        """
+        Updates the parameters with the accumulated gradients and reports
+        the corresponding virtual batch to the monitor.
+
+        Parameters
+        ----------
+        num_examples : int
+            The number of examples the gradients were accumulated over
+        """
+        self.sgd_update()
+        self.monitor.report_batch(num_examples)
+        for callback in self.update_callbacks:
+            callback(self)
+
     def continue_learning(self, model):
         """
         Returns True if the algorithm should continue running, or False
@@ -1385,6 +1385,49 @@ def test_sgd_sequential():
     assert all(visited)
 
 
+def test_sgd_prefetch():
+
+    # tests that prefetching the training batches visits every
+    # example exactly once per epoch
+
+    dim = 1
+    batch_size = 5
+    m = 5 * batch_size
+
+    dataset = ArangeDataset(m)
+
+    model = SoftmaxModel(dim)
+
+    learning_rate = 1e-3
+
+    visited = [0] * m
+
+    def visit(X):
+        for i in X[:, 0]:
+            visited[int(i)] += 1
+
+    data_specs = (model.get_input_space(), model.get_input_source())
+    cost = CallbackCost(visit, data_specs)
+
+    termination_criterion = EpochCounter(5)
+
+    algorithm = SGD(learning_rate,
+                    cost,
+                    batch_size=batch_size,
+                    train_iteration_mode='shuffled_sequential',
+                    monitoring_dataset=None,
+                    termination_criterion=termination_criterion,
+                    update_callbacks=None,
+                    set_batch_size=False,
+                    prefetch=2)
+
+    algorithm.setup(dataset=dataset, model=model)
+
+    algorithm.train(dataset)
+
+    assert all(v == 1 for v in visited)
+
+
 def test_determinism():
 
     # Verifies that running SGD twice results in the same examples getting
@@ -1933,5 +1976,38 @@ def test_uneven_batch_size():
         monitor_iteration_mode='even_sequential')
 
 
+def test_gradient_accumulation():
+    """
+    Tests that accumulating the gradients of several minibatches gives
+    the same parameters and monitor counts as training on larger
+    batches, including a smaller last batch.
+    """
+    dim = 3
+    m = 23
+    rng = np.random.RandomState([25, 9, 2012])
+    dataset = DenseDesignMatrix(X=rng.randn(m, dim))
+
+    def train(batch_size, accumulate_batches):
+        model = SoftmaxModel(dim)
+        algorithm = SGD(1e-1, DummyCost(),
+                        batch_size=batch_size,
+                        learning_rule=Momentum(.5),
+                        train_iteration_mode='sequential',
+                        accumulate_batches=accumulate_batches)
+        algorithm.setup(dataset=dataset, model=model)
+        algorithm.train(dataset)
+        algorithm.train(dataset)
+        return model
+
+    large = train(10, None)
+    accumulated = train(5, 2)
+
+    assert np.allclose(large.P.get_value(), accumulated.P.get_value())
+    large_monitor = Monitor.get_monitor(large)
+    monitor = Monitor.get_monitor(accumulated)
+    assert monitor.get_batches_seen() == large_monitor.get_batches_seen() == 6
+    assert monitor.get_examples_seen() == 2 * m
+
+
 if __name__ == '__main__':
     test_monitor_based_lr()
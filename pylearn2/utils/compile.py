@@ -1,12 +1,27 @@
 """Utilities related to the compilation of Theano functions."""
 import functools
+import hashlib
+import itertools
+import logging
+import os
+
+import numpy as np
+import theano
+from theano.compat import six
+from theano.compat.six.moves import cPickle
+
+from pylearn2.compat import OrderedDict
 
 __author__ = "David Warde-Farley"
 __copyright__ = "Copyright 2012, David Warde-Farley / Universite de Montreal"
 __license__ = "3-clause BSD"
 __maintainer__ = "David Warde-Farley"
 __email__ = "wardefar@iro"
-__all__ = ["compiled_theano_function", "HasCompiledFunctions"]
+__all__ = ["compiled_theano_function", "HasCompiledFunctions",
+           "graph_key", "FunctionCache", "get_function_cache",
+           "cached_function"]
+
+logger = logging.getLogger(__name__)
 
 
 def compiled_theano_function(fn):
@@ -82,3 +97,443 @@ class HasCompiledFunctions(object):
         if '_compiled_functions' in state:
             del state['_compiled_functions']
         return state
+
+
+def _type_key(var):
+    """
+    Returns a string describing the type of a Theano variable, including
+    its broadcastable pattern when it has one.
+    """
+    return '%s%s' % (var.type, getattr(var.type, 'broadcastable', ''))
+
+
+def _value_key(value):
+    """
+    Returns a string describing a parameter of a Theano op, which is the
+    same in every process.
+    """
+    if hasattr(value, '__props__') or isinstance(value, theano.Op):
+        return _op_key(value)
+    if isinstance(value, (list, tuple)):
+        return '(%s)' % ', '.join(_value_key(v) for v in value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s: %s' % (_value_key(k), _value_key(v))
+                                  for k, v in sorted(value.items(),
+                                                     key=repr))
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return 'array(%s, %s, %s)' % (value.dtype, value.shape,
+                                      hashlib.md5(value.data).hexdigest())
+    if isinstance(value, type) or callable(value):
+        # Functions and classes print with their address
+        return '%s.%s' % (getattr(value, '__module__', None),
+                          getattr(value, '__name__', type(value).__name__))
+    return repr(value)
+
+
+def _op_key(op):
+    """
+    Returns a string identifying a Theano op by class and parameters.
+
+    Op hashes depend on object identities and, on Python 3, on the
+    randomized hashing of strings, so the key is built from the op's
+    `__props__` (or its string when it has none) so that it is the same in
+    every process.
+    """
+    cls = type(op)
+    props = getattr(op, '__props__', None)
+    if props is None:
+        params = str(op)
+    else:
+        params = _value_key(tuple(getattr(op, p) for p in props))
+    return '%s.%s %s' % (cls.__module__, cls.__name__, params)
+
+
+def _mode_key(mode):
+    """
+    Returns a string identifying a compilation mode, or None if functions
+    compiled in that mode must not be cached.
+    """
+    if mode is None:
+        mode = theano.config.mode
+    if isinstance(mode, six.string_types):
+        return mode
+    if hasattr(mode, 'record'):
+        # RecordMode logs every compilation and call
+        return None
+    return '%s(%s, %s)' % (type(mode).__name__, mode.linker, mode.optimizer)
+
+
+def graph_key(inputs, outputs, updates=None, givens=None, mode=None):
+    """
+    Computes a structural hash of the graph a call to `theano.function`
+    would compile.
+
+    Two calls get the same key when their graphs have the same ops
+    connected in the same way, their inputs, constants and shared
+    variables have the same types, and they use the same mode. Shared
+    variables are identified by their position in the graph, not by
+    identity, so the graphs of two copies of a model share a key.
+
+    Parameters
+    ----------
+    inputs : list of Variables
+        Inputs of the function
+    outputs : Variable or list of Variables, or None
+        Outputs of the function
+    updates : OrderedDict or list of pairs, optional
+        Updates of shared variables
+    givens : OrderedDict or list of pairs, optional
+        Substitutions applied to the graph
+    mode : str or Mode, optional
+        Compilation mode
+
+    Returns
+    -------
+    key : str or None
+        Hex digest identifying the graph, or None if the call can't be
+        cached
+    shared : list
+        Shared variables of the graph, in the order used by the key
+    """
+    mode_key = _mode_key(mode)
+    if mode_key is None:
+        return None, []
+    updates = list(updates.items() if hasattr(updates, 'items')
+                   else updates or [])
+    givens = OrderedDict(givens.items() if hasattr(givens, 'items')
+                         else givens or [])
+    if outputs is None:
+        outputs, multiple = [], True
+    elif isinstance(outputs, (list, tuple)):
+        multiple = True
+    else:
+        outputs, multiple = [outputs], False
+    variables = list(inputs) + list(outputs) + list(givens.values())
+    for var, value in updates:
+        variables.extend([var, value])
+    if not all(isinstance(v, theano.Variable) for v in variables):
+        return None, []
+
+    md5 = hashlib.md5()
+
+    def write(*args):
+        md5.update((' '.join(str(a) for a in args) + '\n').encode('utf-8'))
+
+    write(theano.__version__, theano.config.floatX, theano.config.device,
+          mode_key, multiple)
+    # Givens alias variables to their replacement, so ids are numbered
+    # by a separate counter
+    ids = {}
+    counter = itertools.count()
+    shared = []
+
+    def visit(root):
+        # Iterative post-order traversal, so that deep graphs don't hit
+        # the recursion limit
+        stack = [(root, False)]
+        while stack:
+            var, expanded = stack.pop()
+            if var in ids:
+                continue
+            if var in givens:
+                given = givens[var]
+                if given in ids:
+                    ids[var] = ids[given]
+                else:
+                    stack.extend([(var, False), (given, False)])
+                continue
+            owner = var.owner
+            if owner is not None and not expanded:
+                stack.append((var, True))
+                stack.extend((i, False) for i in owner.inputs
+                             if i not in ids)
+                continue
+            if owner is not None:
+                for i in owner.inputs:
+                    if i not in ids:
+                        # An input reached through a cycle of givens
+                        return False
+                write('apply', _op_key(owner.op),
+                      [ids[i] for i in owner.inputs])
+                for out in owner.outputs:
+                    ids[out] = next(counter)
+                    write('out', _type_key(out))
+            elif isinstance(var, theano.compile.SharedVariable):
+                ids[var] = next(counter)
+                shared.append(var)
+                write('shared', _type_key(var))
+                default_update = getattr(var, 'default_update', None)
+                if default_update is not None:
+                    pending.append((var, default_update))
+            elif isinstance(var, theano.Constant):
+                ids[var] = next(counter)
+                data = np.asarray(var.data)
+                write('constant', _type_key(var), data.dtype, data.shape,
+                      hashlib.md5(data.tostring()).hexdigest())
+            else:
+                ids[var] = next(counter)
+                write('free', _type_key(var))
+        return True
+
+    pending = []
+    for i, var in enumerate(inputs):
+        ids[var] = next(counter)
+        write('input', i, _type_key(var))
+    for var in list(outputs) + [v for pair in updates for v in pair]:
+        if not visit(var):
+            return None, []
+    write('outputs', [ids[v] for v in outputs])
+    write('updates', [(ids[var], ids[value]) for var, value in updates])
+    updated = set(var for var, _ in updates)
+    while pending:
+        var, value = pending.pop(0)
+        if var not in updated:
+            if not visit(value):
+                return None, []
+            write('default_update', ids[var], ids[value])
+    return md5.hexdigest(), shared
+
+
+class FunctionCache(object):
+    """
+    A cache of compiled Theano functions keyed by the structure of their
+    graph, so that compiling the same graph again -- e.g. when a
+    `Monitor` is rebuilt, or when a training algorithm is set up for a
+    new copy of a model -- reuses the optimized function.
+
+    A cached function compiled for other shared variables than the
+    requested ones is copied with its shared variables swapped, which
+    skips the graph optimization. Least recently used entries are
+    dropped once `max_entries` functions are cached.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Maximum number of functions kept in memory, and on disk when
+        `cache_dir` is given. Note that cached functions keep their
+        shared variables, and the memory (possibly on the GPU) holding
+        their values, alive until they are evicted or `clear` is
+        called, even once the model owning them is gone.
+    cache_dir : str, optional
+        If given, compiled functions are also pickled to this directory,
+        and reused by later processes. Pickled functions include the
+        values of their shared variables.
+    """
+
+    def __init__(self, max_entries=32, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        """
+        Returns the path of the file caching the function of `key`.
+        """
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def _insert(self, key, entry):
+        """
+        Stores `entry` as the most recently used entry.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key):
+        """
+        Loads the `(shared, fn)` entry of `key` from the cache directory,
+        or returns None.
+        """
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        reoptimize = getattr(theano.config, 'reoptimize_unpickled_function',
+                             None)
+        try:
+            if reoptimize is not None:
+                theano.config.reoptimize_unpickled_function = False
+            with open(self._path(key), 'rb') as f:
+                stored_key, shared, fn = cPickle.load(f)
+        except Exception as e:
+            logger.warning('Could not load cached function %s: %s', key, e)
+            return None
+        finally:
+            if reoptimize is not None:
+                theano.config.reoptimize_unpickled_function = reoptimize
+        if stored_key != key:
+            return None
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            # Evicted by another process in the meantime
+            pass
+        return shared, fn
+
+    def _store(self, key, entry):
+        """
+        Pickles `entry` to the cache directory, then removes the least
+        recently used files beyond `max_entries`.
+        """
+        if self.cache_dir is None:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp = '%s.%d.tmp' % (self._path(key), os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                cPickle.dump((key,) + entry, f, -1)
+            os.rename(tmp, self._path(key))
+        except Exception as e:
+            logger.warning('Could not store cached function %s: %s', key, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        # Other processes sharing the directory may remove files at any
+        # time, so files which have disappeared are skipped
+        mtimes = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    mtimes.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        mtimes.sort()
+        for _, path in mtimes[:max(len(mtimes) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def function(self, inputs, outputs=None, mode=None, updates=None,
+                 givens=None, name=None, **kwargs):
+        """
+        Returns a function equivalent to `pylearn2.utils.function` called
+        with the same arguments, reusing a cached one if possible.
+
+        Calls with other keyword arguments than those listed, with
+        `on_unused_input` other than 'ignore', or with a `RecordMode`,
+        are not cached.
+
+        Parameters
+        ----------
+        inputs : list of Variables
+            Inputs of the function
+        outputs : Variable or list of Variables, optional
+            Outputs of the function
+        mode : str or Mode, optional
+            Compilation mode
+        updates : OrderedDict or list of pairs, optional
+            Updates of shared variables
+        givens : OrderedDict or list of pairs, optional
+            Substitutions applied to the graph
+        name : str, optional
+            Name of the function
+        kwargs : dict
+            Other arguments of `theano.function`
+
+        Returns
+        -------
+        fn : theano.compile.Function
+            Compiled function
+        """
+        from pylearn2.utils import function
+        if kwargs.get('on_unused_input', 'ignore') == 'ignore':
+            kwargs.pop('on_unused_input', None)
+        compile_kwargs = dict(kwargs, outputs=outputs, mode=mode,
+                              updates=updates, givens=givens, name=name)
+        if self.max_entries <= 0 or kwargs:
+            if 'on_unused_input' in kwargs:
+                return theano.function(inputs, **compile_kwargs)
+            return function(inputs, **compile_kwargs)
+        key, shared = graph_key(inputs, outputs, updates, givens, mode)
+        if key is None:
+            return function(inputs, **compile_kwargs)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+        if entry is not None:
+            cached_shared, fn = entry
+            swap = dict((old, new) for old, new in zip(cached_shared, shared)
+                        if old is not new)
+            try:
+                if swap:
+                    fn = fn.copy(swap=swap, name=name)
+            except (AttributeError, TypeError, ValueError) as e:
+                # Older versions of Theano can't swap shared variables
+                logger.debug('Could not reuse cached function %s: %s',
+                             key, e)
+            else:
+                self.hits += 1
+                self._insert(key, (shared, fn))
+                return fn
+
+        self.misses += 1
+        fn = function(inputs, **compile_kwargs)
+        self._insert(key, (shared, fn))
+        self._store(key, (shared, fn))
+        return fn
+
+    def clear(self):
+        """
+        Forgets the functions cached in memory. Files in `cache_dir` are
+        kept.
+        """
+        self._entries.clear()
+
+
+_function_cache = None
+
+
+def get_function_cache():
+    """
+    Returns the process-wide `FunctionCache`.
+
+    It is configured by the environment variables
+    PYLEARN2_FUNCTION_CACHE_SIZE (maximum number of cached functions)
+    and PYLEARN2_FUNCTION_CACHE_DIR (directory where compiled functions
+    persist across processes).
+
+    The cache is disabled unless PYLEARN2_FUNCTION_CACHE_SIZE is set to
+    a positive number, because cached functions keep the parameters of
+    the models they were compiled for alive (see `FunctionCache`), e.g.
+    after a monitor is recompiled or between cross-validation folds.
+
+    Returns
+    -------
+    cache : FunctionCache
+        The function cache
+    """
+    global _function_cache
+    if _function_cache is None:
+        _function_cache = FunctionCache(
+            max_entries=int(os.environ.get('PYLEARN2_FUNCTION_CACHE_SIZE',
+                                           0)),
+            cache_dir=os.environ.get('PYLEARN2_FUNCTION_CACHE_DIR'))
+    return _function_cache
+
+
+def cached_function(*args, **kwargs):
+    """
+    A drop-in replacement for `pylearn2.utils.function` that goes through
+    the process-wide `FunctionCache`.
+
+    Parameters
+    ----------
+    args : list
+        Positional arguments of `pylearn2.utils.function`
+    kwargs : dict
+        Keyword arguments of `pylearn2.utils.function`
+
+    Returns
+    -------
+    fn : theano.compile.Function
+        Compiled function
+    """
+    return get_function_cache().function(*args, **kwargs)
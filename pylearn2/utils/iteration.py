@@ -14,14 +14,20 @@ Presets:
 - random_uniform: on each call to next, returns a random subset of the
   dataset. Samples with replacement, but still reports that
   container is empty after num_examples / batch_size calls
+- chunk_shuffled_sequential: reads the dataset as large contiguous
+  chunks in shuffled order, and shuffles examples within a pool of a
+  few chunks before cutting it into batches
 """
 from __future__ import division
 
+import sys
+import threading
 import warnings
 import numpy as np
 from theano.compat import six
+from theano.compat.six.moves import queue
 
-from pylearn2.space import CompositeSpace
+from pylearn2.space import CompositeSpace, IndexSpace
 from pylearn2.utils import safe_izip, wraps
 from pylearn2.utils.data_specs import is_flat_specs
 from pylearn2.utils.exc import reraise_as
@@ -639,6 +645,159 @@ class BatchwiseShuffledSequentialIterator(SequentialSubsetIterator):
     uniform_batch_size = False
 
 
+class ChunkShuffledSequentialIterator(SubsetIterator):
+    """
+    Visits the dataset once per epoch as a sequence of large contiguous
+    chunks taken in random order. A pool of `pool_chunks` chunks is
+    shuffled in memory and cut into batches, so each batch only touches
+    a few contiguous regions of the dataset.
+
+    This is meant for on-disk datasets (HDF5, PyTables, memory-mapped
+    arrays) where scattered reads are slow: the amount of mixing lies
+    between `shuffled_sequential` (full shuffle) and
+    `batchwise_shuffled_sequential` (no mixing within a batch), and is
+    controlled by `chunk_size * pool_chunks`.
+
+    Parameters
+    ----------
+    dataset_size : int
+        The number of examples, total, in the dataset.
+    batch_size : int
+        The number of examples per batch. The last batch may be
+        smaller.
+    num_batches : int, optional
+        The number of batches to return. Defaults to enough batches to
+        cover the whole dataset once.
+    rng : `np.random.RandomState` or seed, optional
+        The random number generator or seed to use.
+    chunk_size : int, optional
+        The number of contiguous examples in a chunk. Defaults to
+        `default_chunk_size` batches.
+    pool_chunks : int, optional
+        The number of chunks shuffled together. Defaults to
+        `default_pool_chunks`.
+
+    Notes
+    -----
+    Returns sorted arrays of indices (`fancy = True`), which is what
+    HDF5 fancy selection requires.
+
+    Use :py:func:`chunk_shuffled` to build an iteration mode class with
+    a different pool configuration.
+    """
+    stochastic = True
+    fancy = True
+    uniform_batch_size = False
+
+    default_chunk_size = 10
+    default_pool_chunks = 10
+
+    def __init__(self, dataset_size, batch_size, num_batches=None, rng=None,
+                 chunk_size=None, pool_chunks=None):
+        if batch_size is None:
+            raise ValueError("batch_size cannot be None for chunk shuffled "
+                             "iteration")
+        self._rng = make_np_rng(rng, which_method=["random_integers",
+                                                   "shuffle"])
+        max_num_batches = int(np.ceil(dataset_size / batch_size))
+        if num_batches is None:
+            num_batches = max_num_batches
+        elif num_batches > max_num_batches:
+            raise ValueError("dataset of %d examples can only provide "
+                             "%d batches with batch_size %d, but %d "
+                             "batches were requested" %
+                             (dataset_size, max_num_batches,
+                              batch_size, num_batches))
+        if chunk_size is None:
+            chunk_size = self.default_chunk_size * batch_size
+        if pool_chunks is None:
+            pool_chunks = self.default_pool_chunks
+        if chunk_size < 1 or pool_chunks < 1:
+            raise ValueError("chunk_size and pool_chunks must be positive")
+        self._dataset_size = dataset_size
+        self._batch_size = batch_size
+        self._num_batches = int(num_batches)
+        self._chunk_size = chunk_size
+        self._pool_chunks = pool_chunks
+        self._next_batch_no = 0
+
+        self._chunk_starts = np.arange(0, dataset_size, chunk_size)
+        self._rng.shuffle(self._chunk_starts)
+        self._next_chunk = 0
+        self._pool = np.zeros(0, dtype='int64')
+
+    def _fill_pool(self):
+        """
+        Adds the next `pool_chunks` chunks to the examples left over
+        from the previous pool, and shuffles the result.
+        """
+        starts = self._chunk_starts[self._next_chunk:
+                                    self._next_chunk + self._pool_chunks]
+        self._next_chunk += len(starts)
+        ranges = [np.arange(start, min(start + self._chunk_size,
+                                       self._dataset_size))
+                  for start in starts]
+        pool = np.concatenate([self._pool] + ranges)
+        self._rng.shuffle(pool)
+        self._pool = pool
+
+    @wraps(SubsetIterator.next)
+    def next(self):
+        if self._next_batch_no >= self._num_batches:
+            raise StopIteration()
+        while len(self._pool) < self._batch_size and \
+                self._next_chunk < len(self._chunk_starts):
+            self._fill_pool()
+        if len(self._pool) == 0:
+            raise StopIteration()
+        self._last = np.sort(self._pool[:self._batch_size])
+        self._pool = self._pool[self._batch_size:]
+        self._next_batch_no += 1
+        return self._last
+
+    def __next__(self):
+        return self.next()
+
+    @property
+    @wraps(SubsetIterator.num_examples, assigned=(), updated=())
+    def num_examples(self):
+        return min(self.batch_size * self.num_batches, self._dataset_size)
+
+    @property
+    @wraps(SubsetIterator.uneven, assigned=(), updated=())
+    def uneven(self):
+        return self.batch_size * self.num_batches > self._dataset_size
+
+
+def chunk_shuffled(chunk_size, pool_chunks):
+    """
+    Returns a :py:class:`ChunkShuffledSequentialIterator` class with a
+    specific pool configuration, usable as an iteration mode.
+
+    Parameters
+    ----------
+    chunk_size : int
+        The number of contiguous examples in a chunk.
+    pool_chunks : int
+        The number of chunks shuffled together.
+
+    Returns
+    -------
+    class
+        A subclass of ChunkShuffledSequentialIterator.
+    """
+    def __init__(self, dataset_size, batch_size, num_batches=None, rng=None):
+        ChunkShuffledSequentialIterator.__init__(self, dataset_size,
+                                                 batch_size, num_batches,
+                                                 rng, chunk_size=chunk_size,
+                                                 pool_chunks=pool_chunks)
+
+    return type("ChunkShuffledSequentialIterator_%d_%d" %
+                (chunk_size, pool_chunks),
+                (ChunkShuffledSequentialIterator,),
+                {'__init__': __init__})
+
+
 _iteration_schemes = {
     'sequential': SequentialSubsetIterator,
     'shuffled_sequential': ShuffledSequentialSubsetIterator,
@@ -649,6 +808,9 @@ _iteration_schemes = {
     'even_shuffled_sequential': as_even(ShuffledSequentialSubsetIterator),
     'even_batchwise_shuffled_sequential':
     as_even(BatchwiseShuffledSequentialIterator),
+    'chunk_shuffled_sequential': ChunkShuffledSequentialIterator,
+    'even_chunk_shuffled_sequential':
+    as_even(ChunkShuffledSequentialIterator),
 }
 
 
@@ -729,6 +891,15 @@ class FiniteDatasetIterator(object):
         A list of callables, in the same order as the sources
         in `data_specs`, that will be called on the individual
         source batches prior to any further processing.
+    num_buffers : int, optional
+        If specified, batches are gathered into a ring of `num_buffers`
+        preallocated arrays per source (using `np.take`) and cast in
+        place, instead of allocating new arrays for every batch. A
+        returned batch is then only valid until the buffer it lives in
+        is reused, i.e. for `num_buffers - 1` further calls to `next`.
+        Only used by datasets relying on the old `get_data` interface.
+        When combined with a :py:class:`PrefetchingIterator` of depth
+        `d`, at least `d + 2` buffers are needed.
 
     Notes
     -----
@@ -742,11 +913,15 @@ class FiniteDatasetIterator(object):
     """
 
     def __init__(self, dataset, subset_iterator, data_specs=None,
-                 return_tuple=False, convert=None):
+                 return_tuple=False, convert=None, num_buffers=None):
         self._data_specs = data_specs
         self._dataset = dataset
         self._subset_iterator = subset_iterator
         self._return_tuple = return_tuple
+        if num_buffers is not None and num_buffers < 1:
+            raise ValueError("num_buffers must be a positive integer, got "
+                             + str(num_buffers))
+        self._num_buffers = num_buffers
 
         # Keep only the needed sources in self._raw_data.
         # Remember what source they correspond to in self._source
@@ -807,6 +982,11 @@ class FiniteDatasetIterator(object):
             assert len(convert) == len(source)
             self._convert = convert
 
+        # dtype each source can be cast to in place before formatting,
+        # when buffers are reused. Only the default conversion of
+        # non-index, dense spaces is known to commute with the cast.
+        self._cast_dtype = [None for s in source]
+
         for i, (so, sp) in enumerate(safe_izip(source, sub_spaces)):
             try:
                 idx = dataset_source.index(so)
@@ -829,6 +1009,10 @@ class FiniteDatasetIterator(object):
                 # of the loop.
                 fn = (lambda batch, dspace=dspace, sp=sp:
                       dspace.np_format_as(batch, sp))
+                if not isinstance(dspace, IndexSpace) and \
+                   not getattr(dspace, 'sparse', False) and \
+                   not getattr(sp, 'sparse', False):
+                    self._cast_dtype[i] = getattr(sp, 'dtype', None)
 
             self._convert[i] = fn
 
@@ -874,13 +1058,63 @@ class FiniteDatasetIterator(object):
         )
 
     def _fallback_next(self, next_index):
-        # TODO: handle fancy-index copies by allocating a buffer and
-        # using np.take()
+        if self._num_buffers is not None:
+            return self._buffered_next(next_index)
         return tuple(
             fn(data[next_index]) if fn else data[next_index]
             for data, fn in safe_izip(self._raw_data, self._convert)
         )
 
+    def _buffered_next(self, next_index):
+        """
+        Like `_fallback_next`, but fills the next set of buffers of the
+        ring instead of allocating new arrays.
+        """
+        if not hasattr(self, '_buffers'):
+            self._buffers = [None] * self._num_buffers
+            self._buffer_idx = 0
+        buffers = self._buffers[self._buffer_idx]
+        if buffers is None:
+            buffers = [{} for data in self._raw_data]
+            self._buffers[self._buffer_idx] = buffers
+        self._buffer_idx = (self._buffer_idx + 1) % self._num_buffers
+
+        rval = []
+        for data, fn, dtype, buf in safe_izip(self._raw_data, self._convert,
+                                              self._cast_dtype, buffers):
+            if not isinstance(data, np.ndarray):
+                batch = data[next_index]
+            else:
+                max_rows = self.batch_size or 0
+                if isinstance(next_index, slice):
+                    # Slicing already returns a view
+                    batch = data[next_index]
+                else:
+                    num_rows = len(next_index)
+                    if 'take' not in buf or \
+                       buf['take'].shape[0] < num_rows:
+                        buf['take'] = np.empty(
+                            (max(max_rows, num_rows),) + data.shape[1:],
+                            dtype=data.dtype)
+                    batch = buf['take'][:num_rows]
+                    # mode='clip' avoids the internal copy np.take makes
+                    # when out is given with mode='raise'; the indices
+                    # produced by the subset iterators are always valid.
+                    np.take(data, next_index, axis=0, out=batch,
+                            mode='clip')
+                if dtype is not None and batch.dtype != dtype:
+                    num_rows = batch.shape[0]
+                    if 'cast' not in buf or \
+                       buf['cast'].shape[0] < num_rows:
+                        buf['cast'] = np.empty(
+                            (max(max_rows, num_rows),) + data.shape[1:],
+                            dtype=dtype)
+                    cast = buf['cast'][:num_rows]
+                    cast[...] = batch
+                    batch = cast
+            rval.append(fn(batch) if fn else batch)
+        return tuple(rval)
+
     def __next__(self):
         return self.next()
 
@@ -908,3 +1142,115 @@ class FiniteDatasetIterator(object):
     @wraps(SubsetIterator.stochastic, assigned=(), updated=())
     def stochastic(self):
         return self._subset_iterator.stochastic
+
+
+class PrefetchingIterator(object):
+    """
+    Wraps a data iterator and assembles upcoming batches in a background
+    thread, so that fetching batch N+1 overlaps with the processing of
+    batch N.
+
+    Parameters
+    ----------
+    iterator : object
+        The iterator to wrap, typically the result of a call to
+        `Dataset.iterator`.
+    depth : int, optional
+        The maximum number of batches that may be prepared ahead of
+        the consumer. Defaults to 1.
+
+    Notes
+    -----
+    The wrapped iterator is consumed from a single worker thread, so
+    the batches are returned in exactly the same order as they would
+    be without prefetching. Any exception raised while fetching a batch
+    is re-raised in the consumer when that batch is requested.
+
+    Most of the work done while fetching a batch (NumPy fancy indexing,
+    casts and HDF5 reads) releases the GIL, which is what makes a
+    thread sufficient here.
+    """
+
+    _END = object()
+
+    def __init__(self, iterator, depth=1):
+        if depth < 1:
+            raise ValueError("depth must be at least 1, got %d" % depth)
+        self._iterator = iterator
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for batch in self._iterator:
+                if not self._put((batch, None)):
+                    return
+        except Exception:
+            self._put((None, sys.exc_info()))
+            return
+        self._put((self._END, None))
+
+    def __iter__(self):
+        return self
+
+    @wraps(SubsetIterator.next)
+    def next(self):
+        if self._done:
+            raise StopIteration()
+        batch, exc_info = self._queue.get()
+        if exc_info is not None:
+            self._done = True
+            six.reraise(*exc_info)
+        if batch is self._END:
+            self._done = True
+            raise StopIteration()
+        return batch
+
+    def __next__(self):
+        return self.next()
+
+    def close(self):
+        """
+        Stops the worker thread without consuming the remaining batches.
+        """
+        self._done = True
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    @wraps(SubsetIterator.batch_size, assigned=(), updated=())
+    def batch_size(self):
+        return self._iterator.batch_size
+
+    @property
+    @wraps(SubsetIterator.num_batches, assigned=(), updated=())
+    def num_batches(self):
+        return self._iterator.num_batches
+
+    @property
+    @wraps(SubsetIterator.num_examples, assigned=(), updated=())
+    def num_examples(self):
+        return self._iterator.num_examples
+
+    @property
+    @wraps(SubsetIterator.uneven, assigned=(), updated=())
+    def uneven(self):
+        return self._iterator.uneven
+
+    @property
+    @wraps(SubsetIterator.stochastic, assigned=(), updated=())
+    def stochastic(self):
+        return self._iterator.stochastic
@@ -12,10 +12,13 @@ import logging
 import numpy as np
 from theano.compat import six
 from theano.compat.six.moves import cPickle, xrange
+import json
 import os
 import time
+import threading
 import warnings
 import sys
+import zipfile
 from pylearn2.utils.string_utils import preprocess
 from pylearn2.utils.mem import improve_memory_error_message
 io = None
@@ -273,6 +276,316 @@ def save(filepath, obj, on_overwrite = 'ignore'):
             finally:
                 sys.setrecursionlimit(old_limit)
 
+def get_param_snapshot(model):
+    """
+    Returns a copy of the current parameter values of a model, which can
+    be saved without holding up training.
+
+    Parameters
+    ----------
+    model : Model
+        The model whose parameters are copied.
+
+    Returns
+    -------
+    snapshot : dict
+        A dictionary with the parameter names under 'names' and copies
+        of their values, in the order of `model.get_params()`, under
+        'values'. The values can be restored with
+        `model.set_param_values(snapshot['values'])`. The class of the
+        model and the YAML it was built from, if any, are stored under
+        'model_class' and 'yaml_src'.
+    """
+    model_class = model.__class__
+    return {'names': [param.name for param in model.get_params()],
+            'values': model.get_param_values(borrow=False),
+            'model_class': model_class.__module__ + '.' +
+            model_class.__name__,
+            'yaml_src': getattr(model, 'yaml_src', None)}
+
+
+PARAMS_FORMAT_VERSION = 1
+
+
+def save_params(filepath, obj):
+    """
+    Saves the parameter values of a model in a compact checkpoint: an
+    uncompressed .npz file holding one array per parameter and a small
+    JSON manifest. Unlike `save`, this does not pickle the model, so
+    the monitor history, Theano graphs and datasets are left out.
+
+    Parameters
+    ----------
+    filepath : str
+        The destination file. Should end with '.npz'.
+    obj : Model or dict
+        The model to save, or a snapshot of it returned by
+        `get_param_snapshot`.
+
+    See Also
+    --------
+    load_params : Restores a model from such a checkpoint.
+    """
+    if isinstance(obj, dict):
+        snapshot = obj
+    else:
+        snapshot = get_param_snapshot(obj)
+    filepath = preprocess(filepath)
+    values = snapshot['values']
+    manifest = {
+        'format': 'pylearn2.params',
+        'version': PARAMS_FORMAT_VERSION,
+        'names': snapshot['names'],
+        'shapes': [list(value.shape) for value in values],
+        'dtypes': [str(value.dtype) for value in values],
+        'model_class': snapshot.get('model_class'),
+        'yaml_src': snapshot.get('yaml_src')
+    }
+    arrays = dict(('param_%d' % i, value) for i, value in enumerate(values))
+    arrays['manifest'] = np.array(json.dumps(manifest))
+    save_dir = os.path.dirname(filepath)
+    if save_dir != '' and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    # Passing a file object keeps np.savez from changing the extension
+    with open(filepath, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _mmap_npz(filepath):
+    """
+    Memory-maps the arrays stored, uncompressed, in a .npz file.
+
+    Parameters
+    ----------
+    filepath : str
+        The .npz file.
+
+    Returns
+    -------
+    arrays : dict
+        Maps each array name to a read-only `numpy.memmap`, or to an
+        in-memory array for members that cannot be mapped (compressed
+        members, object arrays).
+    """
+    arrays = {}
+    with zipfile.ZipFile(filepath) as zf:
+        infos = zf.infolist()
+    npz = None
+    with open(filepath, 'rb') as f:
+        for info in infos:
+            name = info.filename
+            if name.endswith('.npy'):
+                name = name[:-len('.npy')]
+            if info.compress_type == zipfile.ZIP_STORED:
+                # The member data follows its local file header, whose
+                # length depends on the file name and extra field
+                f.seek(info.header_offset)
+                header = f.read(30)
+                name_len, extra_len = struct.unpack('<HH', header[26:30])
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    read_header = np.lib.format.read_array_header_1_0
+                else:
+                    read_header = np.lib.format.read_array_header_2_0
+                shape, fortran_order, dtype = read_header(f)
+                if not dtype.hasobject and np.prod(shape) > 0:
+                    arrays[name] = np.memmap(
+                        filepath, dtype=dtype, mode='r', offset=f.tell(),
+                        shape=shape, order='F' if fortran_order else 'C')
+                    continue
+            if npz is None:
+                npz = np.load(filepath)
+            arrays[name] = npz[name]
+    return arrays
+
+
+def load_params(filepath, model=None, mmap=True):
+    """
+    Restores a model from a checkpoint written by `save_params`.
+
+    Parameters
+    ----------
+    filepath : str
+        The checkpoint file.
+    model : Model, optional
+        The model to load the parameters into. If not specified, the
+        model is built from the YAML stored in the checkpoint.
+    mmap : bool, optional
+        If True (default), the parameter arrays are memory-mapped from
+        the file and copied straight into the model's shared variables,
+        so they are never all held in memory twice.
+
+    Returns
+    -------
+    model : Model
+        The model, with its parameters set to the checkpoint's values.
+    """
+    filepath = preprocess(filepath)
+    if mmap:
+        arrays = _mmap_npz(filepath)
+    else:
+        arrays = np.load(filepath)
+    manifest = json.loads(str(arrays['manifest'][()]))
+    if manifest.get('format') != 'pylearn2.params':
+        raise ValueError(filepath + " is not a parameter checkpoint")
+    if manifest['version'] > PARAMS_FORMAT_VERSION:
+        raise ValueError("%s uses version %d of the parameter checkpoint "
+                         "format, but only versions up to %d are supported"
+                         % (filepath, manifest['version'],
+                            PARAMS_FORMAT_VERSION))
+
+    if model is None:
+        if manifest['yaml_src'] is None:
+            raise ValueError(filepath + " does not record the YAML of its "
+                             "model, so the model must be provided")
+        from pylearn2.config import yaml_parse
+        model = yaml_parse.load(manifest['yaml_src'])
+
+    params = model.get_params()
+    if len(params) != len(manifest['names']):
+        raise ValueError("%s holds %d parameters but the model has %d" %
+                         (filepath, len(manifest['names']), len(params)))
+    values = []
+    for i, (param, name) in enumerate(zip(params, manifest['names'])):
+        value = arrays['param_%d' % i]
+        param_shape = param.get_value(borrow=True).shape
+        if value.shape != param_shape:
+            raise ValueError("Parameter %d (%s) has shape %s in %s but %s "
+                             "in the model" % (i, name, value.shape,
+                                               filepath, param_shape))
+        values.append(value)
+    model.set_param_values(values)
+    return model
+
+
+class AsyncSaver(object):
+    """
+    Saves objects from background threads, so that the caller only
+    blocks when too many saves are already in flight.
+
+    Each object is first written to a temporary file in the same
+    directory, which is then renamed to the requested path, so that the
+    file at that path is always a complete save.
+
+    Parameters
+    ----------
+    max_in_flight : int, optional
+        The maximum number of saves running at the same time. `save`
+        blocks until a slot is available.
+
+    Notes
+    -----
+    The saved objects must not be modified by the caller while they are
+    being written; use a snapshot such as the one returned by
+    `get_param_snapshot`.
+    """
+
+    def __init__(self, max_in_flight=1):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be a positive integer, got "
+                             + str(max_in_flight))
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._errors = []
+        # Sequence number of the last save requested and of the last save
+        # written, for each path, so that a slow save never replaces a
+        # more recent one.
+        self._requested = {}
+        self._written = {}
+
+    def save(self, filepath, obj, save_fn=None):
+        """
+        Starts saving `obj` to `filepath` in a background thread.
+
+        Parameters
+        ----------
+        filepath : str
+            The destination file, see `save`.
+        obj : object
+            The object to save.
+        save_fn : callable, optional
+            The function writing `obj`, called with a file path and
+            `obj`, e.g. `save_params`. Defaults to pickling `obj` as
+            `save` does.
+        """
+        self._raise_errors()
+        filepath = preprocess(filepath)
+        self._slots.acquire()
+        with self._lock:
+            seq = self._requested.get(filepath, 0) + 1
+            self._requested[filepath] = seq
+            self._threads = [t for t in self._threads if t.is_alive()]
+            thread = threading.Thread(target=self._write,
+                                      args=(filepath, obj, seq, save_fn))
+            self._threads.append(thread)
+        thread.start()
+
+    def _write(self, filepath, obj, seq, save_fn):
+        """
+        Writes `obj` to a temporary file and renames it to `filepath`.
+        """
+        if save_fn is None:
+            save_fn = _save
+        try:
+            base, ext = os.path.splitext(filepath)
+            tmp_path = '%s.tmp%d-%d%s' % (base, os.getpid(), seq, ext)
+            try:
+                save_fn(tmp_path, obj)
+                with self._lock:
+                    if seq > self._written.get(filepath, 0):
+                        # os.rename is atomic when both paths are on the
+                        # same file system.
+                        os.rename(tmp_path, filepath)
+                        self._written[filepath] = seq
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except Exception:
+            logger.exception("Background save to {0} failed".format(
+                filepath))
+            with self._lock:
+                self._errors.append(sys.exc_info())
+        finally:
+            self._slots.release()
+
+    def _raise_errors(self):
+        """
+        Re-raises the first error that happened in a background save.
+        """
+        with self._lock:
+            if not self._errors:
+                return
+            exc_info = self._errors[0]
+            self._errors = []
+        six.reraise(*exc_info)
+
+    def wait(self):
+        """
+        Blocks until all the saves in flight are written.
+        """
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        self._raise_errors()
+
+    def __getstate__(self):
+        """
+        Drops the locks, threads and pending errors, which cannot be
+        pickled. Saves in flight are not waited for.
+        """
+        return {'max_in_flight': self.max_in_flight}
+
+    def __setstate__(self, state):
+        """
+        Recreates an idle saver.
+        """
+        self.__init__(state['max_in_flight'])
+
+
 def get_pickle_protocol():
     """
     Allow configuration of the pickle protocol on a per-machine basis.
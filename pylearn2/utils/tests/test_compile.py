@@ -1,9 +1,15 @@
 """Tests for compilation utilities."""
-import theano
+import os
 import pickle
+import subprocess
+import sys
+
+import numpy as np
+import theano
 
+from pylearn2.utils import sharedX
 from pylearn2.utils.compile import (
-    compiled_theano_function, HasCompiledFunctions
+    compiled_theano_function, HasCompiledFunctions, FunctionCache, graph_key
 )
 
 
@@ -32,3 +38,46 @@ def test_pickling():
     assert not hasattr(b, '_compiled_functions')
     assert abs(b.func() - Dummy.const) < 1e-6
     assert not (a.func is b.func)
+
+
+def test_function_cache():
+    def make_graph():
+        x = theano.tensor.vector()
+        w = sharedX(np.zeros(3))
+        return x, w, [(w, w + 2 * x)]
+
+    x, w, updates = make_graph()
+    x2, w2, updates2 = make_graph()
+    key, shared = graph_key([x], None, updates)
+    assert shared == [w]
+    assert graph_key([x2], None, updates2)[0] == key
+    assert graph_key([x2], w2 * 2, updates2)[0] != key
+
+    cache = FunctionCache()
+    f = cache.function([x], updates=updates)
+    g = cache.function([x2], updates=updates2)
+    assert cache.hits + cache.misses == 2
+    g(np.ones(3, dtype=x2.dtype))
+    assert np.allclose(w2.get_value(), 2.)
+    assert np.allclose(w.get_value(), 0.)
+    f(np.ones(3, dtype=x.dtype))
+    assert np.allclose(w.get_value(), 2.)
+
+
+def _mlp_graph_key():
+    """Returns the graph key of a small MLP update, for the test below."""
+    x = theano.tensor.matrix()
+    W = sharedX(np.zeros((3, 2)))
+    b = sharedX(np.zeros(2))
+    cost = theano.tensor.tanh(theano.tensor.dot(x, W) + b).sum(axis=1).mean()
+    updates = [(W, W - 0.1 * theano.grad(cost, W))]
+    return graph_key([x], cost, updates)[0]
+
+
+def test_graph_key_across_processes():
+    env = dict(os.environ, PYTHONHASHSEED='random')
+    other = subprocess.check_output(
+        [sys.executable, '-c',
+         'from pylearn2.utils.tests.test_compile import _mlp_graph_key; '
+         'print(_mlp_graph_key())'], env=env)
+    assert other.decode('utf-8').split()[-1] == _mlp_graph_key()
@@ -5,7 +5,7 @@ from nose.tools import assert_raises
 import numpy as np
 import theano
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
-from pylearn2.space import VectorSpace
+from pylearn2.space import CompositeSpace, VectorSpace
 from pylearn2.utils.iteration import (
     SubsetIterator,
     SequentialSubsetIterator,
@@ -13,7 +13,11 @@ from pylearn2.utils.iteration import (
     RandomSliceSubsetIterator,
     RandomUniformSubsetIterator,
     BatchwiseShuffledSequentialIterator,
-    as_even
+    ChunkShuffledSequentialIterator,
+    PrefetchingIterator,
+    as_even,
+    chunk_shuffled,
+    resolve_iterator_class
 )
 
 
@@ -149,6 +153,38 @@ def test_batchwise_shuffled_sequential():
         assert iter_slice.step is None or iter_slice.step == 1
 
 
+def test_chunk_shuffled_sequential():
+
+    dataset_size = 103
+    batch_size = 7
+    chunk_size = 20
+    pool_chunks = 2
+
+    iterator = ChunkShuffledSequentialIterator(
+        dataset_size, batch_size, None, rng=1,
+        chunk_size=chunk_size, pool_chunks=pool_chunks)
+    assert iterator.num_batches == 15
+    visited = [False] * dataset_size
+    for idxs in iterator:
+        assert len(idxs) <= batch_size
+        assert np.all(np.diff(idxs) > 0)
+        for idx in idxs:
+            assert not visited[idx]
+            visited[idx] = True
+    assert all(visited)
+
+    # A batch can only draw from the chunks of the current pool plus
+    # the leftovers of the previous one
+    iterator = chunk_shuffled(chunk_size, pool_chunks)(dataset_size,
+                                                      batch_size, rng=1)
+    for idxs in iterator:
+        assert len(np.unique(idxs // chunk_size)) <= 2 * pool_chunks
+
+    mode = resolve_iterator_class('chunk_shuffled_sequential')
+    assert mode is ChunkShuffledSequentialIterator
+    assert mode.stochastic and mode.fancy
+
+
 def test_uneven_batches():
     dataset_size = 50
     batch_size = 20
@@ -182,10 +218,12 @@ def test_uneven_batches():
     test_ignore_uneven_iterator(SequentialSubsetIterator)
     test_ignore_uneven_iterator(ShuffledSequentialSubsetIterator)
     test_ignore_uneven_iterator(BatchwiseShuffledSequentialIterator)
+    test_ignore_uneven_iterator(ChunkShuffledSequentialIterator)
 
     test_include_uneven_iterator(SequentialSubsetIterator)
     test_include_uneven_iterator(ShuffledSequentialSubsetIterator)
     test_include_uneven_iterator(BatchwiseShuffledSequentialIterator)
+    test_include_uneven_iterator(ChunkShuffledSequentialIterator)
     
 def test_finitedataset_source_check():
     """
@@ -205,3 +243,81 @@ def test_finitedataset_source_check():
                          data_specs=(VectorSpace(15),'featuresX'))
     except ValueError as e:
         assert 'featuresX' in str(e)
+
+
+def test_prefetching_iterator():
+    """
+    Check that prefetching returns the same batches, in the same order,
+    as the wrapped iterator, and forwards its properties.
+    """
+    X = np.random.rand(23, 4).astype(theano.config.floatX)
+    dataset = DenseDesignMatrix(X=X)
+
+    def make_iterator():
+        return dataset.iterator(mode='shuffled_sequential', batch_size=5,
+                                rng=3)
+
+    expected = list(make_iterator())
+    for depth in [1, 2, 10]:
+        iterator = PrefetchingIterator(make_iterator(), depth=depth)
+        assert iterator.batch_size == 5
+        assert iterator.num_examples == 23
+        assert iterator.stochastic
+        batches = list(iterator)
+        assert len(batches) == len(expected)
+        for batch, expected_batch in zip(batches, expected):
+            assert np.all(batch == expected_batch)
+
+    iterator = PrefetchingIterator(make_iterator())
+    iterator.next()
+    iterator.close()
+    assert_raises(StopIteration, iterator.next)
+
+    assert_raises(ValueError, PrefetchingIterator, make_iterator(), 0)
+
+
+def test_prefetching_iterator_error():
+    """
+    Check that an error raised while fetching a batch is re-raised
+    in the consumer.
+    """
+    def failing():
+        yield 0
+        raise KeyError('failing batch')
+
+    iterator = PrefetchingIterator(failing())
+    assert iterator.next() == 0
+    assert_raises(KeyError, iterator.next)
+    assert_raises(StopIteration, iterator.next)
+
+
+def test_finitedataset_num_buffers():
+    """
+    Check that iterating with preallocated buffers returns the same
+    data as the default path, and that the buffers are reused.
+    """
+    X = np.random.rand(20, 4)
+    y = np.random.rand(20, 2)
+    dataset = DenseDesignMatrix(X=X, y=y)
+    data_specs = (CompositeSpace((VectorSpace(4, dtype='float32'),
+                                  VectorSpace(2))),
+                  ('features', 'targets'))
+
+    def make_iterator(num_buffers=None):
+        return dataset.iterator(mode='shuffled_sequential', batch_size=6,
+                                data_specs=data_specs, rng=0,
+                                num_buffers=num_buffers)
+
+    expected = [(X_batch.copy(), y_batch.copy())
+                for X_batch, y_batch in make_iterator()]
+    iterator = make_iterator(num_buffers=2)
+    batches = []
+    for (X_batch, y_batch), (X_expected, y_expected) in \
+            zip(iterator, expected):
+        assert X_batch.dtype == 'float32'
+        assert np.all(X_batch == X_expected)
+        assert np.all(y_batch == y_expected)
+        batches.append(X_batch)
+    assert len(batches) == len(expected)
+    assert np.may_share_memory(batches[0], batches[2])
+    assert not np.may_share_memory(batches[0], batches[1])
@@ -1,10 +1,20 @@
 """
 Tests for the pylearn2.utils.serial module. Currently only tests
-read_bin_lush_matrix and load_train_file methods.
+read_bin_lush_matrix, load_train_file, AsyncSaver and parameter
+checkpoints.
 """
-from theano.compat.six.moves import xrange
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_raises
+from theano.compat.six.moves import cPickle, xrange
 import pylearn2
 from pylearn2.utils.serial import read_bin_lush_matrix, load_train_file
+from pylearn2.utils.serial import AsyncSaver, load
+from pylearn2.utils.serial import save_params, load_params
+from pylearn2.models.model import Model
+from pylearn2.utils import sharedX
 import numpy as np
 
 pylearn2_path = pylearn2.__path__[0]
@@ -135,3 +145,71 @@ def test_load_train_file():
     }
     load_train_file(yaml_path + 'test_model.yaml')
     load_train_file(yaml_path + 'test_model.yaml', environ=environ)
+
+
+def test_async_saver():
+    """
+    Saves several objects in the background and checks that the last
+    one wins and that no temporary file is left behind.
+    """
+    save_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(save_dir, 'params.pkl')
+        saver = AsyncSaver(max_in_flight=2)
+        for i in xrange(5):
+            saver.save(path, {'values': [np.arange(10) * i]})
+        saver.wait()
+        assert np.all(load(path)['values'][0] == np.arange(10) * 4)
+        assert os.listdir(save_dir) == ['params.pkl']
+
+        # Errors in the background are raised in the caller
+        bad_path = os.path.join(path, 'params.pkl')
+        saver.save(bad_path, 0)
+        assert_raises(Exception, saver.wait)
+
+        # The thread state is dropped when pickling
+        copy = cPickle.loads(cPickle.dumps(saver))
+        assert copy.max_in_flight == 2
+        copy.save(path, {'values': []})
+        copy.wait()
+    finally:
+        shutil.rmtree(save_dir)
+
+    assert_raises(ValueError, AsyncSaver, 0)
+
+
+class ParamsModel(Model):
+    """A model with a couple of parameters."""
+    def __init__(self, seed):
+        super(ParamsModel, self).__init__()
+        rng = np.random.RandomState(seed)
+        self.W = sharedX(rng.uniform(size=(4, 3)), name='W')
+        self.b = sharedX(rng.uniform(size=(3,)), name='b')
+        self._params = [self.W, self.b]
+
+
+def test_params_checkpoint():
+    """
+    Saves the parameters of a model and loads them into another one,
+    with and without memory mapping.
+    """
+    save_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(save_dir, 'params.npz')
+        model = ParamsModel(0)
+        save_params(path, model)
+        for mmap in [True, False]:
+            other = ParamsModel(1)
+            assert load_params(path, other, mmap=mmap) is other
+            for value, other_value in zip(model.get_param_values(),
+                                          other.get_param_values()):
+                assert np.all(value == other_value)
+
+        # No YAML was recorded, so the model can't be rebuilt
+        assert_raises(ValueError, load_params, path)
+
+        bad_model = ParamsModel(0)
+        bad_model._params = [bad_model.W]
+        assert_raises(ValueError, load_params, path, bad_model)
+    finally:
+        shutil.rmtree(save_dir)